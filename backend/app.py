@@ -1,24 +1,44 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
 from auth.models import User, ActivityLog, UploadedFile  # Import models
-from auth import auth_bp, db, bcrypt  # Import Blueprint, database, and bcrypt
-from chatbot import INBOTChatbot
+from auth import auth_bp, db, bcrypt, password_hasher  # Import Blueprint, database, and bcrypt
+from auth import upgrade_database, engine_options, configure_engine, keyset_page, ActivityLogWriter
+from auth.utils import CachingJWTManager
+from chatbot import INBOTChatbot, SupabaseStorage, LocalStorage, StorageError, LLMGateway, UNKNOWN_OWNER, owned_file_name
+from chatbot.metrics import REGISTRY, HTTP_REQUEST_SECONDS, instrument_engine, observe_span
+from chatbot.profiling import SamplingProfiler
+from jobs import JobQueue, PeriodicTask
 import logging
 import os
-from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, get_jwt_identity
 from werkzeug.utils import secure_filename
 import secrets
+import atexit
+import json
+import time
+from datetime import datetime
+
+# Frontends allowed to call the API
+ALLOWED_ORIGINS = ["http://localhost:3000", "http://127.0.0.1:3000"]
+
+# Limits of /api/ask/batch: questions per request, and Groq calls in flight per request
+MAX_BATCH_QUESTIONS = int(os.environ.get('INBOT_MAX_BATCH_QUESTIONS', 100))
+BATCH_CONCURRENCY = int(os.environ.get('INBOT_BATCH_CONCURRENCY', 8))
+
+# Page sizes of /api/files and /api/activity
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app, resources={
     r"/api/*": {
-        "origins": ["http://localhost:3000", "http://127.0.0.1:3000"],
+        "origins": ALLOWED_ORIGINS,
         "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
         "allow_headers": ["Content-Type", "Authorization"]
     },
     r"/auth/*": {
-        "origins": ["http://localhost:3000", "http://127.0.0.1:3000"],
+        "origins": ALLOWED_ORIGINS,
         "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
         "allow_headers": ["Content-Type", "Authorization"]
     }
@@ -26,22 +46,104 @@ CORS(app, resources={
 
 # Secure secret key
 app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', secrets.token_hex(32))
-jwt = JWTManager(app)
+jwt = CachingJWTManager(app)  # verified tokens are cached, for the Flask routes and the ASGI ones alike
 
 # Database configuration
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(basedir, 'instance', 'inbot.db')}"
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+    'INBOT_DATABASE_URL', f"sqlite:///{os.path.join(basedir, 'instance', 'inbot.db')}")
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Pooled connections for Postgres and the like, a lock timeout for SQLite (see auth/database.py)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+
+# bcrypt cost of new password hashes (older hashes move to it at the next login), and the threads
+# and queue of password checks: logins beyond them are refused with a 503 instead of piling up
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('INBOT_BCRYPT_ROUNDS', 12))
+app.config['BCRYPT_WORKERS'] = int(os.environ.get('INBOT_BCRYPT_WORKERS', 2))
+app.config['BCRYPT_MAX_PENDING'] = int(os.environ.get('INBOT_BCRYPT_MAX_PENDING', 64))
 
 # Initialize extensions
 db.init_app(app)
 bcrypt.init_app(app)
+password_hasher.init_app(app)
 
 # Chatbot setup
 UPLOAD_FOLDER = './data/uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-chatbot = INBOTChatbot(documents_dir=UPLOAD_FOLDER)
+
+# The 'files' bucket on Supabase, or a local directory standing in for it when Supabase is not configured
+if os.environ.get('SUPABASE_URL'):
+    storage = SupabaseStorage(os.environ['SUPABASE_URL'], os.environ.get('SUPABASE_KEY', ''), bucket='files')
+else:
+    storage = LocalStorage(os.environ.get('INBOT_LOCAL_STORAGE_DIR', './data/storage'))
+
+# Groq API calls: per-attempt timeout, retries, connection pool and circuit breaker
+llm = LLMGateway(
+    timeout=float(os.environ.get('INBOT_GROQ_TIMEOUT', 30)),
+    connect_timeout=float(os.environ.get('INBOT_GROQ_CONNECT_TIMEOUT', 5)),
+    max_retries=int(os.environ.get('INBOT_GROQ_MAX_RETRIES', 2)),
+    max_connections=int(os.environ.get('INBOT_GROQ_MAX_CONNECTIONS', 20)),
+    failure_threshold=int(os.environ.get('INBOT_GROQ_BREAKER_THRESHOLD', 5)),
+    reset_timeout=float(os.environ.get('INBOT_GROQ_BREAKER_RESET', 30)),
+)
+
+def lookup_document_owners(file_names):
+    """Returns {stored file name: owner id} of the files the uploads table records an owner for."""
+    file_paths = [os.path.join(UPLOAD_FOLDER, name) for name in file_names]
+    with app.app_context():
+        rows = db.session.query(UploadedFile.filepath, UploadedFile.user_id).filter(
+            UploadedFile.filepath.in_(file_paths), UploadedFile.user_id.isnot(None)).all()
+    return {os.path.basename(filepath): user_id for filepath, user_id in rows}
+
+# Several standalone or writer processes would each write the same index segments, manifest and
+# documents, and each run its own storage sync. WEB_CONCURRENCY is the worker count uvicorn and
+# gunicorn start when it is not given on their command line
+INDEX_ROLE = os.environ.get('INBOT_INDEX_ROLE', 'standalone')
+if INDEX_ROLE != 'reader' and int(os.environ.get('WEB_CONCURRENCY', 1)) > 1:
+    raise RuntimeError(f"A {INDEX_ROLE} index must be owned by a single process; run one process with "
+                       "INBOT_INDEX_ROLE=writer and the other workers with INBOT_INDEX_ROLE=reader.")
+
+chatbot = INBOTChatbot(
+    documents_dir=UPLOAD_FOLDER,
+    retriever=os.environ.get('INBOT_RETRIEVER', 'bm25'),
+    answer_cache_ttl=int(os.environ.get('INBOT_ANSWER_CACHE_TTL', 3600)),
+    answer_cache_path=os.environ.get('INBOT_ANSWER_CACHE_PATH'),
+    search_cache_size=int(os.environ.get('INBOT_SEARCH_CACHE_SIZE', 4096)),
+    storage=storage,
+    answer_mode=os.environ.get('INBOT_ANSWER_MODE', 'snippets'),
+    context_tokens=int(os.environ.get('INBOT_CONTEXT_TOKENS', 1500)),
+    llm=llm,
+    owner_lookup=lookup_document_owners,  # files synced from storage are private to their uploader
+    # Several worker processes share one index: one process runs as the 'writer', the others as
+    # 'reader's serving its memory-mapped snapshots. 'standalone' is a single process doing both
+    index_role=INDEX_ROLE,
+    snapshot_shards=int(os.environ.get('INBOT_SNAPSHOT_SHARDS', 1)),
+    background_load=True,  # serve right away; the saved index loads in the background
+)
+chatbot.register_metrics(REGISTRY)
+
+# Sampling profiler, off unless INBOT_PROFILER=1; it can also be switched on and off at /api/profiler
+# by the users listed in INBOT_PROFILER_ADMINS (comma separated user ids), and nobody else
+profiler = SamplingProfiler(interval=float(os.environ.get('INBOT_PROFILER_INTERVAL', 0.01)))
+PROFILER_ADMINS = {user_id.strip() for user_id in os.environ.get('INBOT_PROFILER_ADMINS', '').split(',') if user_id.strip()}
+if os.environ.get('INBOT_PROFILER') == '1':
+    profiler.start()
+
+# Background workers for uploads, so parsing and indexing never block a request
+job_queue = JobQueue(num_workers=int(os.environ.get('INBOT_JOB_WORKERS', 1)))
+
+# Files are pulled from storage on a schedule instead of before every question; readers leave it to the writer
+storage_sync_task = PeriodicTask(
+    int(os.environ.get('INBOT_STORAGE_SYNC_INTERVAL', 300)), chatbot.fetch_files_from_supabase, name="inbot-storage-sync")
+if chatbot.index_role != 'reader':
+    storage_sync_task.start()
+
+# The writer applies the uploads, deletions and owner changes the readers hand it
+if chatbot.index_role == 'writer':
+    spool_task = PeriodicTask(
+        float(os.environ.get('INBOT_SPOOL_INTERVAL', 1)), chatbot.process_spool, name="inbot-index-spool")
+    spool_task.start()
 
 # Logging configuration
 logging.basicConfig(level=logging.INFO)
@@ -49,21 +151,104 @@ logging.basicConfig(level=logging.INFO)
 # Register Blueprints
 app.register_blueprint(auth_bp, url_prefix='/auth')
 
-# Database initialization
+# Database initialization: the data persists across restarts, and the schema is brought up to date by
+# migrations. Set INBOT_DB_AUTO_MIGRATE=0 to run them once with `flask --app app upgrade-db` instead
 with app.app_context():
-    try:
-        db.drop_all()
-        db.create_all()
-        print("✅ Database tables recreated successfully.")
-    except Exception as e:
-        print(f"❌ Error recreating database tables: {e}")
+    configure_engine(db.engine)  # WAL mode for SQLite
+    instrument_engine(db.engine)  # time every query for /metrics
+    if os.environ.get('INBOT_DB_AUTO_MIGRATE', '1') == '1':
+        try:
+            applied = upgrade_database(db.engine)
+            print(f"✅ Database schema up to date ({applied} migrations applied).")
+        except Exception as e:
+            print(f"❌ Error migrating the database: {e}")
+
+@app.cli.command("upgrade-db")
+def upgrade_db_command():
+    """Apply the pending database migrations."""
+    print(f"Applied {upgrade_database(db.engine)} migrations.")
+
+# Activity log entries are written in batches in the background, never inside a request
+activity_log = ActivityLogWriter(
+    app,
+    flush_interval=float(os.environ.get('INBOT_ACTIVITY_FLUSH_INTERVAL', 2)),
+    max_batch=int(os.environ.get('INBOT_ACTIVITY_BATCH_SIZE', 500)),
+)
+activity_log.start()
+atexit.register(activity_log.stop)
+
+def load_document_owners():
+    """Background job: hand the index the owner of every uploaded file, as recorded in the database."""
+    with app.app_context():
+        rows = db.session.query(UploadedFile.filepath, UploadedFile.user_id).all()
+    if rows:
+        # Uploads recorded before files had owners stay private rather than shared
+        chatbot.set_document_owners({os.path.basename(filepath): UNKNOWN_OWNER if user_id is None else user_id
+                                     for filepath, user_id in rows})
+    return {"documents": len(rows)}
+
+# The database is the record of who uploaded what; readers get the owners from the writer's snapshots
+if chatbot.index_role != 'reader':
+    job_queue.submit(load_document_owners)
+
+# Time every request for /metrics, labelled with its route pattern rather than the raw path
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, request.method, route, str(response.status_code))
+    return response
 
 @app.route('/')
 def home():
     return "Welcome to the INBOT API!"
 
+# Prometheus scrape endpoint: timing histograms, cache hit rates and index size gauges
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# Runtime switch for the sampling profiler: POST {"enabled": true, "interval": 0.01, "reset": true}
+@app.route('/api/profiler', methods=['GET', 'POST'])
+@jwt_required()
+def profiler_control():
+    if get_jwt_identity() not in PROFILER_ADMINS:
+        return jsonify({"error": "Profiler access denied"}), 403
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            if data.get("reset"):
+                profiler.reset()
+            if data.get("enabled") is True:
+                profiler.start(interval=float(data["interval"]) if data.get("interval") else None)
+            elif data.get("enabled") is False:
+                profiler.stop()
+        return jsonify({**profiler.status(), "top": profiler.top()}), 200
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid profiler settings: {e}"}), 400
+
+# Samples as collapsed stacks, ready for flamegraph.pl or speedscope
+@app.route('/api/profiler/stacks', methods=['GET'])
+@jwt_required()
+def profiler_stacks():
+    if get_jwt_identity() not in PROFILER_ADMINS:
+        return jsonify({"error": "Profiler access denied"}), 403
+    return Response(profiler.collapsed(), mimetype='text/plain')
+
+# Readiness probe: the API serves at once, but searches wait until the saved index is loaded
+@app.route('/api/health', methods=['GET'])
+def health():
+    ready = chatbot.ready.is_set()
+    return jsonify({"status": "ok" if ready else "loading", "index_ready": ready}), 200 if ready else 503
+
 # Chatbot ask route
 @app.route('/api/ask', methods=['POST'])
+@jwt_required(optional=True)
 def ask_chatbot():
     try:
         data = request.get_json()
@@ -72,13 +257,83 @@ def ask_chatbot():
         if not question or not isinstance(question, str) or question.strip() == "":
             return jsonify({"error": "Invalid question format"}), 400
 
-        chatbot.fetch_files_from_supabase()  # Fetch files from Supabase
-        response = chatbot.ask_question(question)  # Get chatbot response
+        # Signed-in users search their own documents and the shared ones, anonymous users the shared ones only
+        response = chatbot.ask_question(question, user=get_jwt_identity())  # Get chatbot response
         return jsonify({"response": response}), 200
     except Exception as e:
         logging.error(f"Error in /api/ask: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
+def read_batch_questions(data):
+    """Returns the questions of a batch request, or an error message if they are not a valid batch."""
+    questions = data.get("questions") if isinstance(data, dict) else None
+    if not isinstance(questions, list) or not questions:
+        return None, "Expected a non-empty list of questions"
+    if len(questions) > MAX_BATCH_QUESTIONS:
+        return None, f"At most {MAX_BATCH_QUESTIONS} questions per batch"
+    if any(not isinstance(question, str) or question.strip() == "" for question in questions):
+        return None, "Invalid question format"
+    return questions, None
+
+# Batched ask route: answers come back in the order of the questions
+@app.route('/api/ask/batch', methods=['POST'])
+@jwt_required(optional=True)
+def ask_chatbot_batch():
+    try:
+        questions, error = read_batch_questions(request.get_json(silent=True))
+        if error:
+            return jsonify({"error": error}), 400
+
+        responses = chatbot.ask_questions(questions, max_concurrency=BATCH_CONCURRENCY, user=get_jwt_identity())
+        return jsonify({"responses": responses}), 200
+    except Exception as e:
+        logging.error(f"Error in /api/ask/batch: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
+def process_upload(filename, file_path, user_id):
+    """Background job: record an uploaded file, push it to Supabase and index it for search.
+
+    The file is stored and indexed under the name it was saved as locally, see owned_file_name.
+    """
+    name = os.path.basename(file_path)
+
+    # The owner comes first: from the moment the file is in storage, any instance may sync and index it
+    chatbot.set_document_owner(name, user_id)
+
+    # Save metadata to database, where other instances look up the owner of the files they sync.
+    # Uploading a file again replaces the user's earlier upload of the same name
+    with app.app_context():
+        record = UploadedFile.query.filter_by(filename=filename, user_id=user_id).first()
+        is_new = record is None
+        if is_new:
+            record = UploadedFile(filename=filename, filepath=file_path, user_id=user_id)
+            db.session.add(record)
+        else:
+            record.filepath = file_path
+            record.uploaded_at = datetime.utcnow()
+        db.session.commit()
+        file_id = record.id
+
+    # Save to Supabase storage
+    try:
+        with open(file_path, 'rb') as f:
+            chatbot.storage.upload(name, f)
+    except Exception:
+        if is_new:
+            with app.app_context():
+                UploadedFile.query.filter_by(id=file_id).delete()
+                db.session.commit()
+        raise
+    activity_log.log(user_id, user_id, "upload", f"Uploaded {filename}")
+
+    # Parse and index the file so it is searchable right away, by its owner only
+    if not chatbot.index_file(name):
+        chatbot.save_index()
+        raise RuntimeError(f"Failed to parse file '{filename}'")
+    chatbot.save_index()
+
+    return {"filename": filename}
+
 @app.route('/api/upload', methods=['POST'])
 @jwt_required()
 def upload_file():
@@ -93,38 +348,77 @@ def upload_file():
             return jsonify({"error": "No file selected"}), 422
 
         filename = secure_filename(uploaded_file.filename)
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
+        if not filename:
+            return jsonify({"error": "Invalid file name"}), 422
+        file_path = os.path.join(UPLOAD_FOLDER, owned_file_name(user_id, filename))
 
         # Save file locally
         uploaded_file.save(file_path)
 
-        # Save to Supabase storage
-        with open(file_path, 'rb') as f:
-            supabase_response = chatbot.supabase.storage.from_('files').upload(filename, f)
-            if supabase_response.error:
-                return jsonify({"error": "Failed to upload file to Supabase"}), 500
-
-        # Save metadata to database
-        new_file = UploadedFile(filename=filename, filepath=file_path, user_id=user_id)
-        db.session.add(new_file)
-        db.session.commit()
+        # Storage, metadata and indexing happen in the background
+        job_id = job_queue.submit(process_upload, filename, file_path, user_id, owner=user_id)
 
-        return jsonify({"message": "File uploaded successfully!"}), 201
+        return jsonify({"message": "File upload accepted", "job_id": job_id}), 202
     except Exception as e:
         logging.error(f"Error uploading file: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_job(job_id):
+    try:
+        user_id = get_jwt_identity()
+        job = job_queue.get(job_id)
+
+        if not job or job["owner"] != user_id:
+            return jsonify({"error": "Job not found"}), 404
+
+        job.pop("owner")
+        return jsonify({"job": job}), 200
+    except Exception as e:
+        logging.error(f"Error fetching job: {e}")
+        return jsonify({"error": "Failed to fetch job"}), 500
+
 @app.route('/api/files', methods=['GET'])
 @jwt_required()
 def get_files():
     try:
         user_id = get_jwt_identity()
-        files = UploadedFile.query.filter_by(user_id=user_id).all()
-        return jsonify({"files": [{"name": f.filename, "uploaded_at": f.uploaded_at} for f in files]}), 200
+        limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+        # Only the listed columns, one page at a time, straight off the (user_id, uploaded_at) index
+        query = db.session.query(UploadedFile.id, UploadedFile.filename, UploadedFile.uploaded_at).filter(
+            UploadedFile.user_id == user_id)
+        files, next_cursor = keyset_page(
+            query, UploadedFile.uploaded_at, UploadedFile.id, cursor=request.args.get('cursor'), limit=limit)
+        return jsonify({
+            "files": [{"name": f.filename, "uploaded_at": f.uploaded_at} for f in files],
+            "next_cursor": next_cursor,
+        }), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logging.error(f"Error fetching files: {e}")
         return jsonify({"error": "Failed to fetch files"}), 500
 
+@app.route('/api/activity', methods=['GET'])
+@jwt_required()
+def get_activity():
+    try:
+        user_id = get_jwt_identity()
+        limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+        query = ActivityLog.query.filter(ActivityLog.user_id == user_id)
+        entries, next_cursor = keyset_page(
+            query, ActivityLog.date, ActivityLog.id, cursor=request.args.get('cursor'), limit=limit)
+        return jsonify({
+            "activity": [{"type": a.type, "description": a.description, "date": a.date} for a in entries],
+            "next_cursor": next_cursor,
+        }), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error fetching activity: {e}")
+        return jsonify({"error": "Failed to fetch activity"}), 500
+
 @app.route('/api/files/<filename>', methods=['DELETE'])
 @jwt_required()
 def delete_file(filename):
@@ -139,14 +433,24 @@ def delete_file(filename):
         if os.path.exists(file_record.filepath):
             os.remove(file_record.filepath)
 
-        # Delete from Supabase storage
-        supabase_response = chatbot.supabase.storage.from_('files').remove([filename])
-        if supabase_response.error:
+        # Delete from Supabase storage, where it is kept under its stored name
+        name = os.path.basename(file_record.filepath)
+        try:
+            chatbot.storage.remove([name])
+        except StorageError as e:
+            logging.error(f"Error deleting file from storage: {e}")
             return jsonify({"error": "Failed to delete file from Supabase storage"}), 500
+        if chatbot.storage_sync:
+            chatbot.storage_sync.forget(name)
+
+        # Drop it from the search index
+        chatbot.remove_document(name)
+        chatbot.save_index()
 
         # Delete from database
         db.session.delete(file_record)
         db.session.commit()
+        activity_log.log(user_id, user_id, "delete", f"Deleted {filename}")
 
         return jsonify({"message": f"File '{filename}' deleted successfully"}), 200
     except Exception as e:
@@ -155,6 +459,7 @@ def delete_file(filename):
 
 # Chat endpoint for interacting with the bot
 @app.route('/api/chat', methods=['POST'])
+@jwt_required(optional=True)
 def chat_with_bot():
     try:
         data = request.get_json()
@@ -163,13 +468,44 @@ def chat_with_bot():
         if not question or not isinstance(question, str) or question.strip() == "":
             return jsonify({"error": "Invalid question format"}), 400
 
-        chatbot.fetch_files_from_supabase()  # Fetch and index files
-        response = chatbot.ask_question(question)  # Get bot response
+        response = chatbot.ask_question(question, user=get_jwt_identity())  # Get bot response
         return jsonify({"response": response}), 200
     except Exception as e:
         logging.error(f"Error in /api/chat: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
+# Streaming chat endpoint: the answer arrives as server-sent events while it is generated
+@app.route('/api/chat/stream', methods=['POST'])
+@jwt_required(optional=True)
+def chat_stream():
+    try:
+        data = request.get_json()
+        question = data.get("question")
+
+        if not question or not isinstance(question, str) or question.strip() == "":
+            return jsonify({"error": "Invalid question format"}), 400
+        user = get_jwt_identity()
+    except Exception as e:
+        logging.error(f"Error in /api/chat/stream: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
+    def generate():
+        started = time.perf_counter()
+        first_token = True
+        for piece in chatbot.ask_question_stream(question, user=user):
+            if first_token:
+                observe_span("chat_stream.first_token", time.perf_counter() - started)
+                logging.info(f"/api/chat/stream time to first token: {(time.perf_counter() - started) * 1000:.1f} ms")
+                first_token = False
+            yield f"data: {json.dumps({'token': piece})}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 if __name__ == '__main__':
     try:
         print("🚀 Starting INBOT API on port 5000")
@@ -0,0 +1,176 @@
+"""ASGI entry point for production serving.
+
+The chat endpoints are served natively on the event loop, so a waiting Groq call costs a
+coroutine instead of a worker thread. Every other route is handed to the Flask app.
+
+A single process indexes and serves on its own:
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+Several worker processes must not each own the index. One process runs as the writer, and
+the workers serving requests run as readers of its snapshots:
+
+    INBOT_INDEX_ROLE=writer uvicorn asgi:application --host 127.0.0.1 --port 5001
+    INBOT_INDEX_ROLE=reader uvicorn asgi:application --host 0.0.0.0 --port 5000 --workers 4
+"""
+import json
+import time
+import logging
+from asgiref.wsgi import WsgiToAsgi
+from auth.utils import token_cache
+from app import app, chatbot, jwt, ALLOWED_ORIGINS, BATCH_CONCURRENCY, read_batch_questions
+from chatbot.metrics import HTTP_REQUEST_SECONDS, observe_span
+
+flask_application = WsgiToAsgi(app)
+
+
+async def read_json(receive):
+    """Read the whole request body and decode it as JSON. Returns None if it is not valid JSON."""
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    try:
+        return json.loads(body or b"null")
+    except ValueError:
+        return None
+
+
+def response_headers(scope, content_type):
+    """Builds the response headers, including CORS headers for allowed origins."""
+    headers = [(b"content-type", content_type)]
+    origin = dict(scope["headers"]).get(b"origin", b"").decode("latin-1")
+    if origin in ALLOWED_ORIGINS:
+        headers += [(b"access-control-allow-origin", origin.encode("latin-1")), (b"vary", b"Origin")]
+    return headers
+
+
+async def send_json(scope, send, payload, status):
+    await send({"type": "http.response.start", "status": status, "headers": response_headers(scope, b"application/json")})
+    await send({"type": "http.response.body", "body": json.dumps(payload).encode("utf-8")})
+
+
+def request_user(scope):
+    """Returns the identity of the request's bearer token, or None without one.
+
+    Raises an exception for a token that is invalid or expired, like jwt_required(optional=True).
+    """
+    authorization = dict(scope["headers"]).get(b"authorization", b"").decode("latin-1")
+    if not authorization.startswith("Bearer "):
+        return None
+    def decode(token):
+        with app.app_context():
+            return jwt.verify(token)
+
+    return token_cache.claims(authorization[len("Bearer "):], decode)["sub"]
+
+
+async def read_question(scope, receive, send):
+    """Returns the question of a chat request, or None after answering with a 400."""
+    data = await read_json(receive)
+    question = data.get("question") if isinstance(data, dict) else None
+
+    if not question or not isinstance(question, str) or question.strip() == "":
+        await send_json(scope, send, {"error": "Invalid question format"}, 400)
+        return None
+    return question
+
+
+async def ask(scope, receive, send, user):
+    try:
+        question = await read_question(scope, receive, send)
+        if question is None:
+            return
+
+        response = await chatbot.ask_question_async(question, user=user)  # Get chatbot response
+        await send_json(scope, send, {"response": response}, 200)
+    except Exception as e:
+        logging.error(f"Error in {scope['path']}: {e}")
+        await send_json(scope, send, {"error": "Internal server error"}, 500)
+
+
+async def ask_batch(scope, receive, send, user):
+    try:
+        questions, error = read_batch_questions(await read_json(receive))
+        if error:
+            await send_json(scope, send, {"error": error}, 400)
+            return
+
+        responses = await chatbot.ask_questions_async(questions, max_concurrency=BATCH_CONCURRENCY, user=user)
+        await send_json(scope, send, {"responses": responses}, 200)
+    except Exception as e:
+        logging.error(f"Error in {scope['path']}: {e}")
+        await send_json(scope, send, {"error": "Internal server error"}, 500)
+
+
+async def chat_stream(scope, receive, send, user):
+    question = await read_question(scope, receive, send)
+    if question is None:
+        return
+
+    headers = response_headers(scope, b"text/event-stream")
+    headers += [(b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")]
+    await send({"type": "http.response.start", "status": 200, "headers": headers})
+
+    started = time.perf_counter()
+    first_token = True
+    async for piece in chatbot.ask_question_stream_async(question, user=user):
+        if first_token:
+            observe_span("chat_stream.first_token", time.perf_counter() - started)
+            logging.info(f"/api/chat/stream time to first token: {(time.perf_counter() - started) * 1000:.1f} ms")
+            first_token = False
+        event = f"data: {json.dumps({'token': piece})}\n\n"
+        await send({"type": "http.response.body", "body": event.encode("utf-8"), "more_body": True})
+    await send({"type": "http.response.body", "body": b"event: done\ndata: {}\n\n"})
+
+
+# Routes answered on the event loop; same paths and payloads as the Flask views
+ASYNC_ROUTES = {
+    "/api/ask": ask,
+    "/api/ask/batch": ask_batch,
+    "/api/chat": ask,
+    "/api/chat/stream": chat_stream,
+}
+
+
+async def application(scope, receive, send):
+    """Dispatch POSTs to the async chat routes and everything else to Flask."""
+    if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in ASYNC_ROUTES:
+        # Timed here, since these requests never reach Flask's request hooks
+        started = time.perf_counter()
+        statuses = []
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                statuses.append(message["status"])
+            await send(message)
+
+        try:
+            try:
+                user = request_user(scope)
+            except Exception as e:
+                logging.info(f"Rejected token on {scope['path']}: {e}")
+                await send_json(scope, send_and_record, {"msg": "Invalid or expired token"}, 401)
+                return
+            await ASYNC_ROUTES[scope["path"]](scope, receive, send_and_record, user)
+        finally:
+            status = str(statuses[0]) if statuses else "500"
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, "POST", scope["path"], status)
+    elif scope["type"] == "http":
+        await flask_application(scope, receive, send)
+    elif scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+if __name__ == '__main__':
+    import uvicorn
+    print("🚀 Starting INBOT API (async) on port 5000")
+    uvicorn.run("asgi:application", host="127.0.0.1", port=5000)
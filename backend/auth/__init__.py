@@ -1,5 +1,7 @@
 from .auth import auth_bp  # Import the authentication Blueprint
-from .models import db, bcrypt  # Import database and bcrypt instances
+from .models import db, bcrypt, password_hasher  # Import database and bcrypt instances
+from .database import upgrade_database, engine_options, configure_engine, keyset_page, ActivityLogWriter
 
 # Define what gets imported when "from auth import *" is used
-__all__ = ["auth_bp", "db", "bcrypt"]
+__all__ = ["auth_bp", "db", "bcrypt", "password_hasher", "upgrade_database", "engine_options", "configure_engine", "keyset_page",
+           "ActivityLogWriter"]
@@ -1,6 +1,6 @@
 from flask import Blueprint, request, jsonify
 from .models import db, User
-from .utils import is_valid_email, is_strong_password
+from .utils import is_valid_email, is_strong_password, HasherBusyError
 # from utils import log_activity
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
@@ -42,6 +42,8 @@ def signup():
         db.session.commit()
         return jsonify({'message': 'User registered successfully'}), 201
 
+    except HasherBusyError:
+        return jsonify({'error': 'Too many sign-ups in progress, try again shortly'}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -64,6 +66,10 @@ def login():
         if not user or not user.check_password(password):
             return jsonify({'error': 'Invalid email or password'}), 401
 
+        # Move the stored hash to the configured bcrypt cost while the password is at hand
+        if user.rehash_password_if_needed(password):
+            db.session.commit()
+
         # Generate a JWT token using flask_jwt_extended
         access_token = create_access_token(identity=user.id, expires_delta=timedelta(hours=1))
 
@@ -73,6 +79,8 @@ def login():
             'token': access_token
         }), 200
 
+    except HasherBusyError:
+        return jsonify({'error': 'Too many logins in progress, try again shortly'}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -0,0 +1,223 @@
+import os
+import base64
+import logging
+import threading
+from datetime import datetime
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, event, insert, inspect, or_, select, text
+
+from .models import db, User, UploadedFile, ActivityLog
+
+
+def engine_options(database_url):
+    """Returns the SQLAlchemy engine options for a database URL, tunable through the environment.
+
+    Server databases such as Postgres get a connection pool that checks connections before use
+    and recycles them before the server drops them. SQLite runs in WAL mode (see configure_engine).
+    """
+    if database_url.startswith("sqlite"):
+        # A SQLite connection is a file handle; waiting on a lock is what needs a bound
+        return {"connect_args": {"timeout": float(os.environ.get('INBOT_DB_BUSY_TIMEOUT', 30))}}
+    return dict(
+        pool_pre_ping=True,
+        pool_size=int(os.environ.get('INBOT_DB_POOL_SIZE', 10)),
+        max_overflow=int(os.environ.get('INBOT_DB_MAX_OVERFLOW', 20)),
+        pool_timeout=float(os.environ.get('INBOT_DB_POOL_TIMEOUT', 30)),
+        pool_recycle=int(os.environ.get('INBOT_DB_POOL_RECYCLE', 1800)),
+    )
+
+
+def configure_engine(engine):
+    """Put every new SQLite connection in WAL mode, so readers never wait for the one writer."""
+    if engine.dialect.name != "sqlite":
+        return
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")  # durable at checkpoints, safe against corruption
+        cursor.close()
+
+    event.listen(engine, "connect", on_connect)
+
+
+# Bookkeeping table of the schema versions applied, outside db.Model so create_all never touches it
+schema_metadata = MetaData()
+schema_versions = Table(
+    "schema_version", schema_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String(255), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def _create_tables(connection):
+    db.metadata.create_all(connection, tables=[User.__table__, UploadedFile.__table__, ActivityLog.__table__])
+
+
+def _add_missing_columns(connection):
+    # Databases created by older versions lack some columns; existing rows get NULL in them
+    inspector = inspect(connection)
+    for table in (User.__table__, UploadedFile.__table__, ActivityLog.__table__):
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+
+
+def _create_indexes(connection):
+    # Databases created before the indexes were declared on the models
+    for table in (UploadedFile.__table__, ActivityLog.__table__):
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+# (version, description, function applying it); append new migrations, never edit applied ones
+MIGRATIONS = [
+    (1, "Create the user, uploaded_file and activity_log tables", _create_tables),
+    (2, "Add the columns databases of older versions lack", _add_missing_columns),
+    (3, "Index uploaded files and activity by user", _create_indexes),
+]
+
+
+def upgrade_database(engine):
+    """Apply the migrations the database has not seen yet, each in its own transaction.
+
+    Returns the number of migrations applied. Data is kept; tables are only ever created or altered.
+    """
+    schema_metadata.create_all(engine, checkfirst=True)
+    with engine.connect() as connection:
+        applied = set(connection.execute(select(schema_versions.c.version)).scalars())
+
+    count = 0
+    for version, description, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        with engine.begin() as connection:
+            migrate(connection)
+            connection.execute(insert(schema_versions).values(
+                version=version, description=description, applied_at=datetime.utcnow()))
+        logging.info(f"Applied database migration {version}: {description}")
+        count += 1
+    return count
+
+
+def encode_cursor(timestamp, row_id):
+    """Returns the opaque cursor pointing after a row, from its sort timestamp and id."""
+    raw = f"{timestamp.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Returns the (timestamp, id) a cursor points after; raises ValueError for a malformed cursor."""
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split("|")
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (UnicodeError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def keyset_page(query, timestamp_column, id_column, cursor=None, limit=50):
+    """Returns one page of rows, newest first, and the cursor of the next page (None on the last one).
+
+    Rows are ordered by (timestamp, id) and a page starts strictly after the cursor's row, so
+    fetching a page costs one index range scan however deep it is, unlike OFFSET, and rows
+    inserted meanwhile never shift or repeat entries. The rows must carry both columns.
+    """
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        query = query.filter(or_(timestamp_column < timestamp,
+                                 (timestamp_column == timestamp) & (id_column < row_id)))
+    rows = query.order_by(timestamp_column.desc(), id_column.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, timestamp_column.key), getattr(last, id_column.key))
+
+
+class ActivityLogWriter:
+    """Buffers ActivityLog entries and inserts them in batches from a background thread.
+
+    Logging an activity only appends to a list, so requests never wait on the database for it.
+    The buffer is written every flush_interval seconds, or as soon as it holds max_batch entries,
+    with one multi-row INSERT. Entries still buffered when the process dies are lost.
+    """
+
+    def __init__(self, app, flush_interval=2.0, max_batch=500, max_buffered=10000):
+        """Prepare the writer; start() begins flushing. Beyond max_buffered entries new ones are dropped."""
+        self.app = app
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_buffered = max_buffered
+        self.buffer = []
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def log(self, user_id, user, activity_type, description):
+        """Queue an activity of a user for the next batch."""
+        entry = {"user_id": user_id, "user": str(user)[:100], "type": activity_type,
+                 "description": description[:255], "date": datetime.utcnow()}
+        with self.lock:
+            if len(self.buffer) >= self.max_buffered:
+                self.dropped += 1
+                return
+            self.buffer.append(entry)
+            full = len(self.buffer) >= self.max_batch
+        if full:
+            self.wake.set()
+
+    def flush(self):
+        """Write every buffered entry now. Returns the number written."""
+        with self.flush_lock:
+            with self.lock:
+                entries, self.buffer = self.buffer, []
+            if not entries:
+                return 0
+            try:
+                with self.app.app_context():
+                    for start in range(0, len(entries), self.max_batch):
+                        db.session.execute(insert(ActivityLog), entries[start:start + self.max_batch])
+                    db.session.commit()
+            except OperationalError as e:
+                logging.error(f"Error writing {len(entries)} activity log entries, will retry: {e}")
+                with self.lock:
+                    # Keep them for the next attempt, unless that overflows the buffer
+                    room = max(0, self.max_buffered - len(self.buffer))
+                    self.dropped += max(0, len(entries) - room)
+                    self.buffer[:0] = entries[:room]
+                return 0
+            except Exception as e:
+                # Not a passing outage: retrying the same entries would fail again
+                logging.error(f"Error writing {len(entries)} activity log entries, dropped: {e}")
+                with self.lock:
+                    self.dropped += len(entries)
+                return 0
+            return len(entries)
+
+    def start(self):
+        """Flush on a background thread until stop() is called."""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="inbot-activity-log", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Stop the background thread and write what is left."""
+        self.stopped.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.flush()
@@ -1,10 +1,12 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from datetime import datetime  
+from .utils import PasswordHasher
 
 # Initialize SQLAlchemy and Bcrypt
 db = SQLAlchemy()
 bcrypt = Bcrypt()
+password_hasher = PasswordHasher(bcrypt)  # bcrypt on a bounded thread pool
 
 # User Model
 class User(db.Model):
@@ -19,10 +21,17 @@ class User(db.Model):
     def __init__(self, name, email, password):
         self.name = name
         self.email = email
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return bcrypt.check_password_hash(self.password_hash, password)
+        return password_hasher.check(self.password_hash, password)
+
+    def rehash_password_if_needed(self, password):
+        """Re-hash a just-checked password if its hash was made at another bcrypt cost. True if it was."""
+        if not password_hasher.needs_rehash(self.password_hash):
+            return False
+        self.password_hash = password_hasher.hash(password)
+        return True
 
 # Uploaded File Model
 class UploadedFile(db.Model):
@@ -33,6 +42,12 @@ class UploadedFile(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Link to user
     user = db.relationship('User', backref=db.backref('uploaded_files', lazy=True))  # Relationship
 
+    # Lookups by owner and name, and each user's files newest first (the /api/files pages)
+    __table_args__ = (
+        db.Index('ix_uploaded_file_user_filename', 'user_id', 'filename'),
+        db.Index('ix_uploaded_file_user_uploaded_at', 'user_id', 'uploaded_at'),
+    )
+
 class ActivityLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Link to user
@@ -41,3 +56,8 @@ class ActivityLog(db.Model):
     description = db.Column(db.String(255), nullable=False)  # Description of the activity
     date = db.Column(db.DateTime, default=datetime.utcnow)  # Timestamp of the activity
 
+    # Each user's activity newest first (the /api/activity pages)
+    __table_args__ = (
+        db.Index('ix_activity_log_user_date', 'user_id', 'date'),
+    )
+
@@ -1,9 +1,16 @@
 import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 # import logging
 # from auth.models import ActivityLog, db, User
 # from flask import request
 import jwt
 from flask import request, jsonify
+from flask_jwt_extended import JWTManager, decode_token
+from flask_jwt_extended.exceptions import JWTExtendedException
 from functools import wraps
 
 
@@ -22,21 +29,172 @@ def is_strong_password(password):
         any(char in "!@#$%^&*()-_+=" for char in password)  # Contains a special character
     )
 
+class HasherBusyError(RuntimeError):
+    """Raised instead of queueing a password hash when the hashing pool is already full."""
+
+
+class PasswordHasher:
+    """Runs bcrypt on a small, bounded thread pool, with a configurable cost.
+
+    bcrypt is deliberately slow and CPU bound. Running it on at most `workers` threads keeps a
+    login storm from taking every core away from searches, and refusing work beyond
+    `max_pending` waiting hashes sheds load instead of queueing logins until they time out.
+    Stored hashes of another cost are re-hashed at the next successful login.
+    """
+
+    def __init__(self, bcrypt, rounds=12, workers=2, max_pending=64):
+        self.bcrypt = bcrypt
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self.slots = threading.BoundedSemaphore(workers + max_pending)
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        """Read BCRYPT_LOG_ROUNDS, BCRYPT_WORKERS and BCRYPT_MAX_PENDING from the app config."""
+        self.rounds = app.config.get('BCRYPT_LOG_ROUNDS', self.rounds)
+        self.workers = app.config.get('BCRYPT_WORKERS', self.workers)
+        self.max_pending = app.config.get('BCRYPT_MAX_PENDING', self.max_pending)
+        self.slots = threading.BoundedSemaphore(self.workers + self.max_pending)
+
+    def _run(self, func, *args):
+        if not self.slots.acquire(blocking=False):
+            raise HasherBusyError("Too many password checks in progress")
+        try:
+            if self.executor is None:
+                with self.lock:
+                    if self.executor is None:
+                        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inbot-bcrypt")
+            return self.executor.submit(func, *args).result()
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        """Returns the bcrypt hash of a password, at the configured cost."""
+        return self._run(self.bcrypt.generate_password_hash, password, self.rounds).decode('utf-8')
+
+    def check(self, password_hash, password):
+        """True if the password matches the hash."""
+        return self._run(self.bcrypt.check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if the hash was made at another cost than the configured one."""
+        try:
+            return int(password_hash.split('$')[2]) != self.rounds  # $2b$<cost>$<salt and hash>
+        except (IndexError, ValueError):
+            return True
+
+
+class RevokedTokenError(jwt.InvalidTokenError):
+    """Raised for a token revoked with VerifiedTokenCache.revoke()."""
+
+
+class VerifiedTokenCache:
+    """Small LRU of the claims of tokens already verified, keyed by a digest of the token.
+
+    A token seen again skips signature checking and decoding. Entries never outlive the token's
+    own expiry, nor ttl seconds, so a token signed with a rotated key is not trusted for long.
+    Revoked tokens are refused by this process until they expire.
+    """
+
+    def __init__(self, max_entries=4096, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # token digest -> (expires_at, claims), least recently used first
+        self.revoked = {}  # token digest -> expiry of the revoked token
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def claims(self, token, decode):
+        """Returns the claims of a token, from the cache or from decode(token), which raises if it is invalid."""
+        key = self._key(token)
+        now = time.time()
+        with self.lock:
+            if key in self.revoked:
+                raise RevokedTokenError("Token has been revoked")
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return entry[1]
+            self.counters["misses"] += 1
+
+        claims = decode(token)
+        expires_at = now + self.ttl
+        if isinstance(claims.get('exp'), (int, float)):
+            expires_at = min(expires_at, claims['exp'])
+        with self.lock:
+            self.entries[key] = (expires_at, claims)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return claims
+
+    def revoke(self, token):
+        """Refuse a token from now on, e.g. after logging out, and forget its claims."""
+        try:
+            expires_at = float(jwt.decode(token, options={"verify_signature": False})["exp"])
+        except (jwt.InvalidTokenError, KeyError, TypeError, ValueError):
+            expires_at = float("inf")
+        key = self._key(token)
+        now = time.time()
+        with self.lock:
+            self.entries.pop(key, None)
+            self.revoked = {revoked: until for revoked, until in self.revoked.items() if until > now}
+            self.revoked[key] = expires_at
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """Returns the hit/miss counters and the current size."""
+        with self.lock:
+            return {**self.counters, "size": len(self.entries), "max_entries": self.max_entries}
+
+
+# Verified claims of the bearer tokens of recent requests
+token_cache = VerifiedTokenCache()
+
+
+class CachingJWTManager(JWTManager):
+    """JWTManager that answers token checks from a VerifiedTokenCache, so jwt_required() skips re-verifying."""
+
+    def __init__(self, app=None, cache=None, **kwargs):
+        self.token_cache = cache or token_cache
+        super().__init__(app, **kwargs)
+
+    def verify(self, encoded_token):
+        """Returns the claims of a token, checked and decoded without the cache. Needs an app context."""
+        return super()._decode_jwt_from_config(encoded_token)
+
+    def _decode_jwt_from_config(self, encoded_token, csrf_value=None, allow_expired=False):
+        # Every token flask_jwt_extended checks comes through here; CSRF and expiry-tolerant checks bypass the cache
+        if csrf_value is not None or allow_expired:
+            return super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+        return self.token_cache.claims(encoded_token, self.verify)
+
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = request.headers.get('Authorization')
+        token = request.headers.get('Authorization', '')
 
-        if not token:
+        if not token.startswith('Bearer '):
             return jsonify({'error': 'Token is missing'}), 401
 
         try:
-            # Decode the token
-            data = jwt.decode(token, os.getenv('SECRET_KEY'), algorithms=['HS256'])
-            request.user_id = data['user_id']  # Attach the user ID to the request
+            # Decode the token the way jwt_required() does, unless it was verified recently
+            data = decode_token(token[len('Bearer '):])
+            request.user_id = data['sub']  # Attach the user ID to the request
         except jwt.ExpiredSignatureError:
             return jsonify({'error': 'Token has expired'}), 401
-        except jwt.InvalidTokenError:
+        except (jwt.InvalidTokenError, JWTExtendedException):
             return jsonify({'error': 'Invalid token'}), 401
 
         return f(*args, **kwargs)
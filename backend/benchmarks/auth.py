@@ -0,0 +1,127 @@
+"""Benchmarks for authentication: /auth/login throughput per bcrypt cost, and bearer token checks.
+
+Logins go through the Flask test client from several threads at once, so the bounded bcrypt
+pool and its 503s are measured as deployed. Run from backend/:
+
+    python -m benchmarks.auth --rounds 10 12 --threads 1 8 --logins 100
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+from .run import BACKEND_DIR, latency_summary
+
+
+def login_storm(client, email, password, logins, threads):
+    """Log in `logins` times from `threads` threads. Returns the throughput, latencies and refusals."""
+    durations = []
+    statuses = {}
+    lock = threading.Lock()
+    remaining = iter(range(logins))
+
+    def work():
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            started = time.perf_counter()
+            response = client.post("/auth/login", json={"email": email, "password": password})
+            elapsed = time.perf_counter() - started
+            with lock:
+                durations.append(elapsed)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    return {
+        "logins_per_second": round(statuses.get(200, 0) / elapsed, 1),
+        "latency": latency_summary(durations),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+def token_checks(app, checks):
+    """Times decoding one bearer token `checks` times, without and with the verified-token cache."""
+    from flask_jwt_extended import create_access_token
+    from auth.utils import VerifiedTokenCache
+
+    with app.app_context():
+        token = create_access_token(identity="1")
+        verify = app.extensions["flask-jwt-extended"].verify  # the app's own decode goes through its cache
+        cache = VerifiedTokenCache()
+        results = {}
+        for name, check in (("decode", verify), ("cached", lambda t: cache.claims(t, verify))):
+            started = time.perf_counter()
+            for _ in range(checks):
+                check(token)
+            results[name] = {"checks_per_second": round(checks / (time.perf_counter() - started), 1)}
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 12], help="bcrypt costs to compare")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8], help="concurrent login threads")
+    parser.add_argument("--logins", type=int, default=100, help="logins per cost and thread count")
+    parser.add_argument("--token-checks", type=int, default=20000, help="bearer token checks to time")
+    parser.add_argument("--output", help="results file (default: print only)")
+    args = parser.parse_args(argv)
+    output = os.path.abspath(args.output) if args.output else None
+
+    # A throwaway database and working directory; importing the app sets up the rest
+    workspace = tempfile.mkdtemp(prefix="inbot-auth-bench-")
+    os.environ.update({
+        "INBOT_DATABASE_URL": f"sqlite:///{os.path.join(workspace, 'bench.db')}",
+        "INBOT_LOCAL_STORAGE_DIR": os.path.join(workspace, "data", "storage"),
+        "INBOT_STORAGE_SYNC_INTERVAL": str(24 * 3600),
+    })
+    os.environ.setdefault("GROQ_API_KEY", "benchmark")
+    os.chdir(workspace)
+    sys.path.insert(0, BACKEND_DIR)
+    try:
+        import app as inbot_app
+        from auth import db, password_hasher
+        from auth.models import User
+
+        client = inbot_app.app.test_client()
+        password = "Benchmark-passw0rd!"
+        report = {"workers": password_hasher.workers, "max_pending": password_hasher.max_pending, "logins": {}}
+        for rounds in args.rounds:
+            password_hasher.rounds = rounds
+            email = f"bench-{rounds}@example.com"
+            with inbot_app.app.app_context():
+                db.session.add(User(name="Benchmark", email=email, password=password))
+                db.session.commit()
+            for threads in args.threads:
+                results = login_storm(client, email, password, args.logins, threads)
+                report["logins"][f"rounds-{rounds}.threads-{threads}"] = results
+                print(f"bcrypt cost {rounds}, {threads} threads: {results['logins_per_second']} logins/s, "
+                      f"p50 {results['latency'].get('p50_ms')} ms / p99 {results['latency'].get('p99_ms')} ms, "
+                      f"statuses {results['statuses']}", flush=True)
+
+        report["token_checks"] = token_checks(inbot_app.app, args.token_checks)
+        print(f"token checks: {report['token_checks']['decode']['checks_per_second']}/s decoded, "
+              f"{report['token_checks']['cached']['checks_per_second']}/s cached")
+        inbot_app.chatbot.ingestion.close()
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
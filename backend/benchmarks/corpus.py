@@ -0,0 +1,156 @@
+import os
+import json
+import random
+import shutil
+
+# Common words of internal documents; together with generated words they give a Zipf-like vocabulary
+BASE_WORDS = """
+policy employee manager report budget quarter revenue customer contract invoice payment
+vendor supplier project deadline meeting agenda schedule review approval request process
+procedure safety training onboarding benefit insurance holiday leave travel expense
+reimbursement security password access account network server backup incident support
+ticket release product feature roadmap strategy market sales forecast target growth
+compliance audit risk legal privacy data retention office equipment laptop software
+license hardware inventory shipping warehouse order delivery quality standard document
+template form signature department team director finance operations marketing engineering
+research development design testing deployment maintenance upgrade migration database
+analytics dashboard metric performance goal objective evaluation feedback promotion salary
+payroll tax pension health wellness remote hybrid workplace handbook guideline regulation
+""".split()
+
+SYLLABLES = "ka lo mi ne ra su ti ve zo an el is or un ba de fi gu ho ja ku ly mo pe".split()
+
+# How many documents of each format a corpus holds, in repeating order
+FORMATS = ("txt", "pdf", "docx")
+
+
+def make_vocabulary(rng, size=3000):
+    """Returns the base words followed by generated ones, most frequent first."""
+    vocabulary = list(BASE_WORDS)
+    seen = set(vocabulary)
+    while len(vocabulary) < size:
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            vocabulary.append(word)
+    return vocabulary
+
+
+def make_paragraphs(rng, vocabulary, weights, num_paragraphs):
+    """Returns paragraphs of sentences drawn from the vocabulary by Zipf weights."""
+    paragraphs = []
+    for _ in range(num_paragraphs):
+        sentences = []
+        for _ in range(rng.randint(3, 7)):
+            words = rng.choices(vocabulary, weights=weights, k=rng.randint(6, 18))
+            sentences.append(" ".join(words).capitalize() + rng.choice(".....!?"))
+        paragraphs.append(" ".join(sentences))
+    return paragraphs
+
+
+def write_txt(path, paragraphs):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n\n".join(paragraphs))
+
+
+def write_docx(path, paragraphs):
+    import docx  # python-docx, already needed for parsing
+
+    document = docx.Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    document.save(path)
+
+
+def write_pdf(path, paragraphs, lines_per_page=40, chars_per_line=90):
+    """Write a plain PDF with one Helvetica text object per page, readable by PyPDF2."""
+    lines = []
+    for paragraph in paragraphs:
+        line = ""
+        for word in paragraph.split():
+            if line and len(line) + len(word) + 1 > chars_per_line:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        lines.append(line)
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+
+    def escape(text):
+        return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    # Objects: 1 catalog, 2 page tree, 3 font, then a page and its content stream per page
+    objects = {1: "<< /Type /Catalog /Pages 2 0 R >>", 3: "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    kids = []
+    for number, page_lines in enumerate(pages):
+        page_id, content_id = 4 + 2 * number, 5 + 2 * number
+        kids.append(f"{page_id} 0 R")
+        stream = "BT /F1 10 Tf 12 TL 50 800 Td " + " ".join(f"({escape(line)}) Tj T*" for line in page_lines) + " ET"
+        objects[page_id] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>")
+        objects[content_id] = f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream"
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(data)
+        data += f"{object_id} 0 obj\n{objects[object_id]}\nendobj\n".encode('latin-1')
+    xref = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('latin-1')
+    for object_id in sorted(objects):
+        data += f"{offsets[object_id]:010d} 00000 n \n".encode('latin-1')
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode('latin-1')
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+WRITERS = {"txt": write_txt, "pdf": write_pdf, "docx": write_docx}
+
+
+def generate_corpus(corpus_dir, num_documents, seed=0, paragraphs=(4, 24)):
+    """Fill corpus_dir with num_documents synthetic TXT, PDF and DOCX files, reusing an identical earlier corpus.
+
+    The same (num_documents, seed, paragraphs) always gives the same files, so results
+    of different versions are comparable. Returns the corpus description.
+    """
+    spec = {"documents": num_documents, "seed": seed, "paragraphs": list(paragraphs), "formats": list(FORMATS)}
+    spec_path = os.path.join(corpus_dir, ".corpus.json")
+    try:
+        with open(spec_path, 'r', encoding='utf-8') as f:
+            existing = json.load(f)
+        if existing["spec"] == spec:
+            return existing
+    except (OSError, ValueError, KeyError):
+        pass
+
+    shutil.rmtree(corpus_dir, ignore_errors=True)
+    os.makedirs(corpus_dir)
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng)
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+
+    total_bytes = 0
+    for number in range(num_documents):
+        file_format = FORMATS[number % len(FORMATS)]
+        path = os.path.join(corpus_dir, f"doc-{number:05d}.{file_format}")
+        WRITERS[file_format](path, make_paragraphs(rng, vocabulary, weights, rng.randint(*paragraphs)))
+        total_bytes += os.path.getsize(path)
+
+    description = {"spec": spec, "bytes": total_bytes, "vocabulary": vocabulary}
+    with open(spec_path, 'w', encoding='utf-8') as f:
+        json.dump(description, f)
+    return description
+
+
+def make_questions(vocabulary, count, seed=1):
+    """Returns count questions built from corpus words, so most of them match some passage."""
+    rng = random.Random(seed)
+    weights = [1 / rank ** 0.5 for rank in range(1, len(vocabulary) + 1)]
+    templates = ("What is the {} {}?", "How does the {} {} work?", "Where can I find the {} {} {}?",
+                 "Who approves {} {}?", "{} {} {} deadline")
+    questions = []
+    for _ in range(count):
+        template = rng.choice(templates)
+        questions.append(template.format(*rng.choices(vocabulary, weights=weights, k=template.count("{}"))))
+    return questions
@@ -0,0 +1,287 @@
+"""Benchmarks for ingestion, search and end-to-end /api/ask latency.
+
+Synthetic TXT/PDF/DOCX corpora are generated once per size and reused, and every size runs
+in a fresh process so memory high-water marks do not leak between sizes. Groq is replaced
+by a stub with a fixed latency, so only INBOT's own work is measured. Run from backend/:
+
+    python -m benchmarks.run --sizes 10 1000 10000
+    python -m benchmarks.run --sizes 1000 --compare benchmarks/results/<earlier run>.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import subprocess
+from types import SimpleNamespace
+
+import numpy as np
+
+from .corpus import generate_corpus, make_questions
+
+RESULTS_FORMAT_VERSION = 1
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RESULTS_DIR = os.path.join(BACKEND_DIR, "benchmarks", "results")
+
+# Metrics where a larger value is better; for every other metric smaller is better
+HIGHER_IS_BETTER = ("per_second",)
+
+
+class StubGroqClient:
+    """Stands in for the Groq client, answering every chat completion after a fixed delay."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, messages, model, stream=False, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        content = f"Stub answer to: {messages[-1]['content'][-80:]}"
+        if stream:
+            return iter([SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def latency_summary(seconds):
+    """Returns count, mean and p50/p90/p99/max of a list of durations, in milliseconds."""
+    if not seconds:
+        return {"count": 0}
+    ms = np.asarray(seconds) * 1000
+    return {
+        "count": len(ms),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p90_ms": round(float(np.percentile(ms, 90)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def peak_memory_mb():
+    """Returns the resident-set high-water marks of this process and of its finished children, in MB."""
+    unit = 2 ** 20 if sys.platform == 'darwin' else 2 ** 10  # ru_maxrss is bytes on macOS, KB elsewhere
+    return {
+        "process_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit, 1),
+        "workers_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit, 1),
+    }
+
+
+def run_size(args, num_documents):
+    """Benchmark one corpus size in this process and return its results."""
+    workspace = os.path.abspath(os.path.join(args.work_dir, f"size-{num_documents}"))
+    documents_dir = os.path.join(workspace, "data", "uploads")
+    corpus = generate_corpus(documents_dir, num_documents, seed=args.seed)
+
+    # Start from an empty index and database; chatbot.py logs to inbot.log in the working directory
+    for stale in ("data/uploads_index", "data/storage", "bench.db"):
+        path = os.path.join(workspace, stale)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.isfile(path):
+            os.remove(path)
+    os.chdir(workspace)
+    os.environ.setdefault("GROQ_API_KEY", "benchmark")
+    sys.path.insert(0, BACKEND_DIR)
+
+    results = {"documents": num_documents, "corpus_bytes": corpus["bytes"]}
+
+    # Ingestion: a cold build of the whole corpus, then a rescan with nothing changed
+    started = time.perf_counter()
+    from chatbot import INBOTChatbot
+    results["import_seconds"] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    bot = INBOTChatbot(documents_dir="data/uploads", ingest_workers=args.workers)
+    elapsed = time.perf_counter() - started
+    results["index_cold"] = {
+        "seconds": round(elapsed, 3),
+        "documents_per_second": round(num_documents / elapsed, 1),
+        "mb_per_second": round(corpus["bytes"] / elapsed / 2 ** 20, 2),
+        "indexed": len(bot.document_index),
+    }
+
+    started = time.perf_counter()
+    bot.index_documents()
+    results["index_warm"] = {"seconds": round(time.perf_counter() - started, 3)}
+
+    # Search: distinct corpus-word questions after a short warm-up
+    questions = make_questions(corpus["vocabulary"], args.queries + 10, seed=args.seed + 1)
+    for question in questions[:10]:
+        bot.search_documents(question)
+    durations = []
+    for question in questions[10:]:
+        started = time.perf_counter()
+        bot.search_documents(question)
+        durations.append(time.perf_counter() - started)
+    results["search_documents"] = latency_summary(durations)
+    results["memory_after_search"] = peak_memory_mb()
+
+    bot.ingestion.close()
+    del bot
+
+    # End to end: the Flask app loads the index just built and answers through the test client
+    os.environ.update({
+        "INBOT_DATABASE_URL": f"sqlite:///{os.path.join(workspace, 'bench.db')}",
+        "INBOT_LOCAL_STORAGE_DIR": os.path.join(workspace, "data", "storage"),
+        "INBOT_STORAGE_SYNC_INTERVAL": str(24 * 3600),
+        "INBOT_ANSWER_MODE": args.answer_mode,
+    })
+    started = time.perf_counter()
+    import app as inbot_app
+    inbot_app.chatbot.wait_until_ready()
+    results["app_ready_seconds"] = round(time.perf_counter() - started, 3)
+    inbot_app.chatbot.index_documents()  # wait out the rescan the loader started
+
+    stub = StubGroqClient(latency=args.groq_latency)
+    inbot_app.llm.client = stub
+
+    client = inbot_app.app.test_client()
+    questions = make_questions(corpus["vocabulary"], args.queries + 10, seed=args.seed + 2)
+    for question in questions[:10]:
+        client.post("/api/ask", json={"question": question})
+    by_path = {"documents": [], "llm": []}
+    errors = 0
+    for question in questions[10:]:
+        started = time.perf_counter()
+        response = client.post("/api/ask", json={"question": question})
+        elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            errors += 1
+            continue
+        answered_by_llm = "AI Assistant" in response.get_json()["response"]
+        by_path["llm" if answered_by_llm else "documents"].append(elapsed)
+    results["api_ask"] = {
+        "all": latency_summary(by_path["documents"] + by_path["llm"]),
+        "documents": latency_summary(by_path["documents"]),
+        "llm": latency_summary(by_path["llm"]),
+        "errors": errors,
+        "groq_calls": stub.calls,
+    }
+    results["memory_peak"] = peak_memory_mb()
+    inbot_app.chatbot.ingestion.close()
+    return results
+
+
+def git_revision():
+    """Returns the commit the tree is at and whether it has local changes, or None outside git."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BACKEND_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=""):
+    """Returns {dotted.metric.name: number} for every number in nested results."""
+    metrics = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            metrics.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[name] = value
+    return metrics
+
+
+def compare(baseline, current, tolerance):
+    """Print every metric next to the baseline. Returns the names of metrics that regressed beyond tolerance."""
+    old, new = flatten(baseline["sizes"]), flatten(current["sizes"])
+    regressions = []
+    if baseline.get("config") != current["config"]:
+        print(f"Note: the runs used different settings: {baseline.get('config')} vs {current['config']}")
+    print(f"{'metric':<48} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name in sorted(set(old) & set(new)):
+        if not old[name]:
+            continue
+        change = (new[name] - old[name]) / abs(old[name])
+        worse = -change if name.rsplit(".", 1)[-1].endswith(HIGHER_IS_BETTER) else change
+        flag = ""
+        if (name.endswith("_ms") or name.endswith("seconds") or name.endswith("_mb")
+                or name.endswith(HIGHER_IS_BETTER)) and worse > tolerance:
+            flag = "  REGRESSED"
+            regressions.append(name)
+        print(f"{name:<48} {old[name]:>12} {new[name]:>12} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000], help="corpus sizes in documents")
+    parser.add_argument("--queries", type=int, default=200, help="timed searches and questions per size")
+    parser.add_argument("--workers", type=int, default=None, help="ingestion worker processes (default: CPU count)")
+    parser.add_argument("--groq-latency", type=float, default=0.0, help="seconds the stub Groq client takes to answer")
+    parser.add_argument("--answer-mode", choices=("snippets", "rag"), default="snippets")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", default=os.path.join(BACKEND_DIR, "benchmarks", ".work"),
+                        help="where corpora and indexes are kept between runs")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative slowdown reported as a regression")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)  # internal: run one size, print JSON
+    args = parser.parse_args(argv)
+
+    if args.single is not None:
+        results = run_size(args, args.single)
+        sys.stdout.write("\n" + json.dumps(results) + "\n")
+        return 0
+
+    revision = git_revision()
+    report = {
+        "version": RESULTS_FORMAT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git": revision,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items()
+                   if key in ("queries", "workers", "groq_latency", "answer_mode", "seed")},
+        "sizes": {},
+    }
+
+    for size in args.sizes:
+        print(f"Benchmarking {size} documents...", flush=True)
+        command = [sys.executable, "-m", "benchmarks.run", "--single", str(size), "--queries", str(args.queries),
+                   "--groq-latency", str(args.groq_latency), "--answer-mode", args.answer_mode,
+                   "--seed", str(args.seed), "--work-dir", os.path.abspath(args.work_dir)]
+        if args.workers is not None:
+            command += ["--workers", str(args.workers)]
+        completed = subprocess.run(command, cwd=BACKEND_DIR, capture_output=True, text=True)
+        if completed.returncode != 0:
+            sys.stderr.write(completed.stderr)
+            return completed.returncode
+        # The chatbot prints to stdout as well, so the results are the last line
+        results = json.loads(completed.stdout.strip().splitlines()[-1])
+        report["sizes"][str(size)] = results
+        print(f"  indexed {results['index_cold']['documents_per_second']} docs/s, "
+              f"search p50 {results['search_documents'].get('p50_ms')} ms / p99 {results['search_documents'].get('p99_ms')} ms, "
+              f"/api/ask p50 {results['api_ask']['all'].get('p50_ms')} ms, "
+              f"peak {results['memory_peak']['process_mb']} MB", flush=True)
+
+    output = args.output
+    if not output:
+        commit = revision["commit"] + ("-dirty" if revision["dirty"] else "") if revision else "unknown"
+        output = os.path.join(DEFAULT_RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} metrics regressed by more than {args.tolerance:.0%}.")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
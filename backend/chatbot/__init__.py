@@ -1,4 +1,6 @@
-from .chatbot import INBOTChatbot  # Import the chatbot class
+from .chatbot import INBOTChatbot, UNKNOWN_OWNER, owned_file_name  # Import the chatbot class
+from .storage import SupabaseStorage, LocalStorage, StorageError  # File bucket clients
+from .llm import LLMGateway, CircuitOpenError  # Groq API access with retries and a circuit breaker
 
 # Public API of the `chatbot` package
-__all__ = ["INBOTChatbot"]
+__all__ = ["INBOTChatbot", "UNKNOWN_OWNER", "owned_file_name", "SupabaseStorage", "LocalStorage", "StorageError", "LLMGateway", "CircuitOpenError"]
@@ -0,0 +1,138 @@
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Bounded in-memory LRU cache whose entries expire after a TTL, optionally backed by SQLite."""
+
+    def __init__(self, max_entries=1024, ttl=3600, path=None, max_disk_entries=100000):
+        """Create the cache. With a path, entries also go to a SQLite file shared across restarts and workers."""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "disk_hits": 0, "evictions": 0, "expirations": 0}
+        self.disk_writes = 0
+
+        self.db = None
+        if path:
+            try:
+                self.db = sqlite3.connect(path, check_same_thread=False)
+                self.db.execute("PRAGMA journal_mode=WAL")
+                self.db.execute(
+                    "CREATE TABLE IF NOT EXISTS cache "
+                    "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+                )
+                self.db.commit()
+            except sqlite3.Error as e:
+                logging.error(f"Could not open cache database '{path}', using memory only: {e}")
+                self.db = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        """Returns the cached value for key, or default if it is missing or expired."""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self.entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                    return value
+                del self.entries[key]
+                self.counters["expirations"] += 1
+
+            # Fall back to the disk copy, e.g. after a restart or when another worker filled it
+            value, expires_at = self._disk_get(key, now)
+            if expires_at is not None:
+                self._remember(key, value, expires_at)
+                self.counters["hits"] += 1
+                self.counters["disk_hits"] += 1
+                return value
+
+            self.counters["misses"] += 1
+            return default
+
+    def set(self, key, value):
+        """Store a value under key for the cache's TTL."""
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            self._remember(key, value, expires_at)
+            self._disk_set(key, value, expires_at)
+
+    def clear(self):
+        """Drop every entry, in memory and on disk."""
+        with self.lock:
+            self.entries.clear()
+            if self.db is not None:
+                self.db.execute("DELETE FROM cache")
+                self.db.commit()
+
+    def stats(self):
+        """Returns the hit/miss counters, the hit rate and the current size."""
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+                "size": len(self.entries),
+                "max_entries": self.max_entries,
+            }
+
+    def _remember(self, key, value, expires_at):
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def _disk_get(self, key, now):
+        # Returns (value, expires_at), or (None, None) when the key is not on disk
+        if self.db is None:
+            return None, None
+        try:
+            row = self.db.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None, None
+            if row[1] <= now:
+                self.db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self.db.commit()
+                self.counters["expirations"] += 1
+                return None, None
+            self.db.execute("UPDATE cache SET used_at = ? WHERE key = ?", (now, key))
+            self.db.commit()
+            return json.loads(row[0]), row[1]
+        except (sqlite3.Error, ValueError) as e:
+            logging.error(f"Error reading cache database: {e}")
+            return None, None
+
+    def _disk_set(self, key, value, expires_at):
+        if self.db is None:
+            return
+        try:
+            now = time.time()
+            self.db.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, now),
+            )
+
+            # Every so often keep the file bounded: drop expired rows, then the least recently used ones
+            self.disk_writes += 1
+            if self.disk_writes % 100 == 0:
+                self.db.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+                self.db.execute(
+                    "DELETE FROM cache WHERE key IN "
+                    "(SELECT key FROM cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,),
+                )
+            self.db.commit()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logging.error(f"Error writing cache database: {e}")
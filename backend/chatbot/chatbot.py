@@ -1,14 +1,30 @@
 import os
-import PyPDF2
-from groq import Groq
-from docx import Document
-import re
-import nltk
-from nltk.stem import PorterStemmer
-from fuzzywuzzy import fuzz, process
+import time
+import asyncio
+import functools
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import shutil
+import hashlib
+from bisect import bisect_left
 from dotenv import load_dotenv  # Import dotenv
+from .index import InvertedIndex
+from .ingest import IngestionPipeline
+from .locks import ReadWriteLock
+from .manifest import DocumentManifest
+from .parsing import parse_document, clean_parsed_text
+from .storage import StorageSync
+from .store import DocumentStore
+from .rag import pack_passages, build_messages
+from .ranking import BM25Ranker, DocumentShard
+from .snapshot import IndexSnapshot, IndexSpool, write_snapshot, current_snapshot
+from .cache import TTLCache
+from .fuzzy import FuzzyVocabulary
+from .llm import LLMGateway
+from .metrics import span, CallbackMetric
+from .text import query_terms, word_at, normalize_question, load_stemmer, stem
 
 # Load environment variables from the .env file
 load_dotenv()
@@ -19,44 +35,522 @@ print(f"Loaded API Key: {os.environ.get('GROQ_API_KEY')}")
 # Set up logging configuration
 logging.basicConfig(filename='inbot.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Download necessary NLTK data
-nltk.download('punkt_tab')
+GROQ_MODEL = "llama3-8b-8192"
 
-# Initialize Groq client with API key
-client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+
+# Framing of answers that come from the Groq API
+AI_ANSWER_HEADER = "🤖 **AI Assistant’s Response:**\n\n"
+AI_ANSWER_FOOTER = "\n\n✏️ **Let me know if there’s anything else I can assist with!**"
+ERROR_ANSWER = "⚠️ **Error:** Unable to process your question at the moment. Please try again later."
+SOURCES_HEADER = "\n\n📚 **Sources:** "
+
+# Local outcome of answering a question: either a document answer, or the prompt for Groq
+# with the cache key, any cached answer and the passages the prompt was built from
+PreparedAnswer = namedtuple("PreparedAnswer", ["document_answer", "cache_key", "cached_answer", "messages", "sources"])
+
+# Seconds a search waits for the saved index to load before answering from what is loaded
+READY_TIMEOUT = 30
+
+# Pass as the user of a search to cover every document, whoever owns it. API requests pass
+# the id of the signed-in user instead, or None for an anonymous one, who sees shared documents only
+ALL_USERS = object()
+
+# Owner of a file synced from storage that no user is recorded as owning: no user id matches it,
+# so the file stays private until its owner is known, rather than shared with everyone
+UNKNOWN_OWNER = "unknown"
+
+# Separates the owner id from the uploaded file name in the names of users' files
+OWNER_SEPARATOR = "__"
 
 class INBOTChatbot:
-    def __init__(self, documents_dir='data/'):
-        """Initialize the chatbot and ensure the document directory exists."""
+    def __init__(self, documents_dir='data/', index_dir=None, ingest_workers=None, ingest_timeout=120, retriever='bm25',
+                 answer_cache_size=1024, answer_cache_ttl=3600, answer_cache_path=None, search_threads=8,
+                 storage=None, background_load=False, answer_mode='snippets', context_tokens=1500, rag_top_k=12,
+                 llm=None, index_role='standalone', snapshot_shards=1, snapshot_poll=1.0, search_cache_size=4096,
+                 search_cache_ttl=3600, owner_lookup=None):
+        """Initialize the chatbot and ensure the document directory exists.
+
+        retriever picks how passages are ranked: 'bm25' for keyword ranking or
+        'embedding' for semantic search over a local vector store. Groq answers are
+        cached in memory, and in a SQLite file too when answer_cache_path is set. The
+        passages found for a query are cached too, up to search_cache_size queries, until
+        the index or a document owner changes.
+        storage is the file bucket (SupabaseStorage or LocalStorage) mirrored into
+        documents_dir by fetch_files_from_supabase. owner_lookup(file names) returns
+        {file name: owner id} for synced files, e.g. from the uploads table; files it does not
+        know belong to UNKNOWN_OWNER. With background_load the saved
+        index is loaded on a background thread and the constructor returns at once;
+        searches wait until it is ready.
+
+        answer_mode 'snippets' answers with the matching passages and asks Groq only
+        when nothing matches; 'rag' sends up to rag_top_k of the best passages to Groq,
+        within a budget of context_tokens, and lists them as the answer's sources.
+        llm is the LLMGateway Groq calls go through; a default one is made when omitted.
+
+        index_role lets several worker processes share one index. 'standalone' indexes and
+        serves on its own. 'writer' does the same, and also publishes an immutable snapshot
+        on every save, with its BM25 matrix split into snapshot_shards document ranges.
+        'reader' builds nothing: it memory-maps the current snapshot, switches to a newer
+        one within snapshot_poll seconds, and hands uploads, deletions and owner changes
+        to the writer through a spool directory.
+        """
         self.documents_dir = documents_dir
-        self.document_index = {}
+
+        # The inverted index, manifest and cleaned texts live next to the documents
+        # directory, e.g. 'data/uploads_index'
+        self.index_dir = index_dir or f"{os.path.normpath(documents_dir)}_index"
+        self.document_index = DocumentStore(os.path.join(self.index_dir, "documents"))
+        self.inverted_index = InvertedIndex(self.index_dir)
+        self.ranker = BM25Ranker(self.inverted_index)
+        # Owner id -> the owner's documents with their own ranker; None holds the shared documents
+        self.shards = {None: DocumentShard(self.inverted_index, collection=self.ranker)}
+        # Misspelled query terms are matched to vocabulary terms a couple of edits away
+        self.fuzzy_vocabulary = FuzzyVocabulary(self.inverted_index)
+        self.manifest = DocumentManifest(os.path.join(self.index_dir, "manifest.json"))
+        self.retriever = retriever
+        self.embedding_retriever = None
+        if retriever == 'embedding':
+            from .embeddings import EmbeddingRetriever
+            self.embedding_retriever = EmbeddingRetriever(
+                self.inverted_index, self.document_index, os.path.join(self.index_dir, "vectors"))
+        elif retriever != 'bm25':
+            raise ValueError(f"Unknown retriever '{retriever}', expected 'bm25' or 'embedding'.")
+        if index_role not in ('standalone', 'writer', 'reader'):
+            raise ValueError(f"Unknown index role '{index_role}', expected 'standalone', 'writer' or 'reader'.")
+        if index_role == 'reader' and retriever != 'bm25':
+            raise ValueError("Snapshot readers only support the 'bm25' retriever.")
+        self.index_role = index_role
+        self.snapshot_shards = snapshot_shards
+        self.snapshot_poll = snapshot_poll
+        self.snapshot_dir = os.path.join(self.index_dir, "snapshots")
+        self.snapshot = None        # the IndexSnapshot a reader serves from
+        self.snapshot_checked = 0.0  # when a reader last looked for a newer snapshot
+        self.snapshot_lock = threading.Lock()
+        self.spool = IndexSpool(os.path.join(self.index_dir, "spool"))
+        if answer_mode not in ('snippets', 'rag'):
+            raise ValueError(f"Unknown answer mode '{answer_mode}', expected 'snippets' or 'rag'.")
+        self.answer_mode = answer_mode
+        self.context_tokens = context_tokens
+        self.rag_top_k = rag_top_k
+        self.index_dirty = False
+        self.save_lock = threading.Lock()  # one save at a time, so index segments are written in order
+
+        # Searches share the index; indexing jobs take it exclusively
+        self.index_lock = ReadWriteLock()
+        self._index_version = (None, None)  # (index generation, version digest)
+        self.owners_generation = 0  # bumped when a document changes owner, which changes who sees it
+        self._visible_versions = {}  # user scope -> ((index, owners) generation, digest of the visible documents)
+
+        # Groq calls go through the gateway for timeouts, retries and coalescing
+        self.llm = llm or LLMGateway()
+
+        # Answers from Groq, so repeated questions skip the LLM round-trip
+        self.answer_cache = TTLCache(max_entries=answer_cache_size, ttl=answer_cache_ttl, path=answer_cache_path)
+
+        # Passages found per query, so questions many users ask skip matching, ranking and highlighting
+        self.search_cache = TTLCache(max_entries=search_cache_size, ttl=search_cache_ttl)
+        self.search_cache_generation = None  # the (index, owners) generation the cached passages belong to
+
+        # Async callers run searches here, so a few threads serve any number of in-flight requests
+        self.search_executor = ThreadPoolExecutor(max_workers=search_threads, thread_name_prefix="inbot-search")
+
+        # Parsing is CPU-bound, so it runs on a pool of worker processes
+        self.ingestion = IngestionPipeline(max_workers=ingest_workers, timeout=ingest_timeout)
+
+        # Local mirror of the storage bucket, refreshed by fetch_files_from_supabase; a reader leaves it to the writer
+        self.storage = storage
+        self.owner_lookup = owner_lookup
+        self.storage_sync = None
+        if storage and index_role != 'reader':
+            self.storage_sync = StorageSync(storage, documents_dir, os.path.join(self.index_dir, "storage"))
         
+        # Set once the saved index is loaded; until then searches and indexing wait
+        self.ready = threading.Event()
+
         # Create documents directory if it doesn't exist
         if not os.path.exists(documents_dir):
             os.makedirs(documents_dir)
             logging.info(f"Created directory {documents_dir} for storing documents.")
+            self.ready.set()
+        elif background_load:
+            threading.Thread(target=self.load, name="inbot-index-loader", daemon=True).start()
         else:
-            self.index_documents()
+            self.load()
+
+    def load(self):
+        """Load the saved index, mark the chatbot ready, then index whatever changed since the save."""
+        if self.index_role == 'reader':
+            try:
+                self.refresh_snapshot(force=True)
+            finally:
+                self.ready.set()
+            load_stemmer()
+            with self.index_lock.read_lock():
+                self.fuzzy_vocabulary.ensure_built()
+            return
+
+        started = time.perf_counter()
+        try:
+            with self.index_lock.write_lock():
+                self.load_index()
+        finally:
+            self.ready.set()
+        logging.info(f"Index snapshot loaded in {(time.perf_counter() - started) * 1000:.0f} ms.")
+
+        # Pay for the NLTK import and the ranking structures here rather than in the first search
+        load_stemmer()
+        self.index_documents()
+        if self.index_role == 'writer' and current_snapshot(self.snapshot_dir) is None:
+            self.save_index(force=True)
+        with self.index_lock.read_lock():
+            self.fuzzy_vocabulary.ensure_built()
+            if self.embedding_retriever:
+                self.embedding_retriever.save()
+            else:
+                for shard in list(self.shards.values()):
+                    shard.ranker.ensure_built()
+
+    def wait_until_ready(self, timeout=None):
+        """Block until the saved index is loaded. Returns False if the timeout expired first."""
+        return self.ready.wait(timeout)
+
+    def load_index(self):
+        """Restore the inverted index, manifest and document texts saved by a previous run."""
+        index_loaded = self.inverted_index.load()
+        manifest_loaded = self.manifest.load()
+
+        # Without both halves nothing can be trusted, so start from scratch
+        if not (index_loaded and manifest_loaded):
+            self.inverted_index.clear()
+            self.manifest.clear()
+            self.document_index.clear()
+            self.shards = {None: DocumentShard(self.inverted_index, collection=self.ranker)}
+            return
+
+        # Documents the index knows about but the manifest does not are leftovers of an interrupted save
+        for file_name in list(self.inverted_index.doc_lengths):
+            if file_name not in self.manifest:
+                self.inverted_index.remove_document(file_name)
+
+        # The texts are only mapped, not read; documents missing from the store are parsed again on rescan
+        self.document_index.load()
+        for file_name in list(self.document_index):
+            if file_name not in self.inverted_index:
+                self.document_index.pop(file_name)
+
+        # Partition the documents by owner
+        self.shards = {None: DocumentShard(self.inverted_index, collection=self.ranker)}
+        for file_name in self.inverted_index.doc_lengths:
+            self.shard(self.manifest.owner(file_name)).add(file_name)
+
+    def save_index(self, force=False):
+        """Persist the inverted index and manifest if anything changed, and publish a snapshot as a writer.
+
+        Only the documents changed since the last save are written. The write lock is held just
+        long enough to take them and a copy of the manifest; they are serialized after it is
+        released, so searches and indexing go on meanwhile. Readers have nothing to save; the
+        writer saves after applying their requests.
+        """
+        if self.index_role == 'reader':
+            return
+        with self.save_lock:
+            with self.index_lock.write_lock():
+                if not (self.index_dirty or force):
+                    return
+                with span("index.checkpoint"):
+                    self.document_index.save()
+                    if self.embedding_retriever:
+                        self.embedding_retriever.compact()
+                    changes = self.inverted_index.checkpoint()
+                    manifest = self.manifest.copy()
+                self.index_dirty = False
+
+            # The texts and index are written first; load_index drops entries the manifest does not know
+            with span("index.save"):
+                try:
+                    self.inverted_index.write_segment(changes)
+                    manifest.save()
+                except Exception:
+                    with self.index_lock.write_lock():
+                        self.inverted_index.restore(changes)
+                        self.index_dirty = True
+                    raise
+
+            if self.embedding_retriever:
+                # Passages are embedded and their vectors appended here rather than in the next search
+                with self.index_lock.read_lock(), span("index.embed"):
+                    self.embedding_retriever.save()
+
+            if self.index_role == 'writer':
+                # A snapshot only reads the index, so searches go on while it is written
+                with self.index_lock.read_lock(), span("index.snapshot"):
+                    os.makedirs(self.snapshot_dir, exist_ok=True)
+                    write_snapshot(self.snapshot_dir, self.inverted_index, self.document_index, self.manifest,
+                                   self.ranker, self.index_version(), num_shards=self.snapshot_shards)
+
+    def refresh_snapshot(self, force=False):
+        """As a reader, switch to the current snapshot if it changed. Checks at most every snapshot_poll seconds."""
+        now = time.monotonic()
+        if not force and now - self.snapshot_checked < self.snapshot_poll:
+            return
+        if self.index_lock.reading():
+            # Swapping needs the write lock, which a reading thread would wait for forever; the next search swaps
+            return
+        with self.snapshot_lock:
+            self.snapshot_checked = now
+            name = current_snapshot(self.snapshot_dir)
+            if name is None or (self.snapshot is not None and self.snapshot.name == name):
+                return
+            try:
+                snapshot = IndexSnapshot(self.snapshot_dir, name)
+            except (OSError, ValueError) as e:
+                logging.error(f"Could not open index snapshot '{name}': {e}")
+                return
+
+            # Searches in flight finish on the old snapshot; its files stay mapped until they let go
+            with self.index_lock.write_lock():
+                self.snapshot = snapshot
+                self.inverted_index = snapshot
+                self.document_index = snapshot.text
+                self.fuzzy_vocabulary.inverted_index = snapshot
+            logging.info(f"Serving index snapshot '{name}' with {len(snapshot)} documents.")
+
+    def process_spool(self):
+        """As the writer, apply the index changes readers requested, then save and publish a snapshot."""
+        requests = self.spool.pending()
+        if not requests:
+            return
+        for path, request in requests:
+            try:
+                operation = request["operation"]
+                if operation == "index":
+                    self.index_files(request["files"])
+                elif operation == "remove":
+                    self.remove_document(request["file"])
+                elif operation == "owners":
+                    self.set_document_owners(request["owners"])
+                else:
+                    logging.error(f"Unknown index request '{operation}' in '{path}'.")
+            except Exception as e:
+                logging.error(f"Error applying index request '{path}': {e}")
+            os.remove(path)
+        self.save_index()
 
     def index_documents(self):
-        """Index all existing documents by parsing and cleaning their contents."""
+        """Index new or changed documents and drop deleted ones, using the manifest to skip unchanged files."""
+        if self.index_role == 'reader':
+            return
         logging.info("Indexing documents for faster search.")
         
         try:
-            # Loop through files in the documents directory
-            for file_name in os.listdir(self.documents_dir):
-                file_path = os.path.join(self.documents_dir, file_name)
-                parsed_text = self.parse_document(file_path)
+            # Hidden files are copies still being written, e.g. by the storage sync
+            present = {
+                file_name for file_name in os.listdir(self.documents_dir)
+                if not file_name.startswith('.') and os.path.isfile(os.path.join(self.documents_dir, file_name))
+            }
+
+            # Step 1: Forget documents that were deleted since they were indexed
+            with self.index_lock.write_lock():
+                for file_name in self.manifest.names():
+                    if file_name not in present:
+                        self.remove_document(file_name)
 
-                # If text is parsed successfully, clean and index it
-                if parsed_text and not parsed_text.startswith("Error"):
-                    cleaned_text = self.clean_parsed_text(parsed_text)
-                    self.document_index[file_name] = cleaned_text  # Cache cleaned text in memory
+            # Step 2: Parse only new or changed files
+            self.index_files(sorted(present))
 
+            self.save_index()
             logging.info(f"Indexed {len(self.document_index)} documents successfully.")
         except Exception as e:
             logging.error(f"Error during document indexing: {e}")
 
+    def index_files(self, file_names, progress=None):
+        """Index the given files, parsing new or changed ones in parallel. Returns {file name: indexed}."""
+        self.wait_until_ready()
+        if self.index_role == 'reader':
+            return self._index_files_by_writer(file_names)
+        outcome = {}
+        pending = {}  # file path -> (file name, stat, content hash)
+
+        # Step 1: Reuse every file the manifest shows as unchanged
+        with self.index_lock.write_lock():
+            for file_name in file_names:
+                indexed, stat, digest = self.check_file(file_name)
+                if indexed is None:
+                    pending[os.path.join(self.documents_dir, file_name)] = (file_name, stat, digest)
+                else:
+                    outcome[file_name] = indexed
+
+        # Step 2: Parse and clean the rest across the worker pool, without holding the lock
+        for result in self.ingestion.run(pending, progress=progress):
+            file_name, stat, digest = pending[result.file_path]
+            with self.index_lock.write_lock():
+                outcome[file_name] = self.store_document(file_name, stat, digest, result.cleaned_text, result.analysis)
+
+        return outcome
+
+    def _index_files_by_writer(self, file_names):
+        # Ask the writer, then wait for a snapshot that has this content of each file
+        digests = {
+            file_name: DocumentManifest.file_digest(os.path.join(self.documents_dir, file_name))
+            for file_name in file_names
+        }
+        self.spool.submit("index", files=list(file_names))
+        outcome = {}
+        deadline = time.monotonic() + self.ingestion.timeout + 30
+        while True:
+            self.refresh_snapshot(force=True)
+            files = self.snapshot.files if self.snapshot is not None else {}
+            for file_name, digest in digests.items():
+                entry = files.get(file_name)
+                if entry and entry[0] == digest:
+                    outcome[file_name] = entry[1]
+            if len(outcome) == len(digests) or time.monotonic() > deadline:
+                break
+            time.sleep(self.snapshot_poll)
+
+        for file_name in digests.keys() - outcome.keys():
+            logging.error(f"Timed out waiting for the index writer to index '{file_name}'.")
+            outcome[file_name] = False
+        return outcome
+
+    def index_file(self, file_name):
+        """Parse, clean and index one file unless it is unchanged. Returns True if the file is indexed."""
+        return self.index_files([file_name]).get(file_name, False)
+
+    def check_file(self, file_name):
+        """Returns (indexed, stat, content hash), where indexed is None if the file must be parsed again."""
+        file_path = os.path.join(self.documents_dir, file_name)
+        stat = os.stat(file_path)
+        entry = self.manifest.get(file_name)
+
+        # Compare mtime and size first, and only hash files that look modified
+        digest = None if self.manifest.is_unchanged(file_name, stat) else DocumentManifest.file_digest(file_path)
+
+        if entry and digest in (None, entry["sha256"]):
+            if digest is not None:
+                # Same content with a new mtime, e.g. after a copy
+                self.manifest.record(file_name, file_path, stat, entry["sha256"], entry["indexed"])
+                self.index_dirty = True
+
+            if not entry["indexed"]:
+                return False, stat, entry["sha256"]
+
+            if file_name in self.document_index and file_name in self.inverted_index:
+                return True, stat, entry["sha256"]
+
+        # The file is new or its content changed
+        return None, stat, digest or DocumentManifest.file_digest(file_path)
+
+    def store_document(self, file_name, stat, digest, cleaned_text, analysis=None):
+        """Index freshly cleaned text, or None if parsing failed, and record the file. Returns True if indexed."""
+        indexed = cleaned_text is not None
+        shard = self.shard(self.manifest.owner(file_name))
+        if indexed:
+            with span("index.add"):
+                self.document_index.put(file_name, cleaned_text, digest)  # Appended to the mapped text store
+                self.inverted_index.add_document(file_name, cleaned_text, analysis)
+            shard.add(file_name)
+        else:
+            self.document_index.pop(file_name, None)
+            self.inverted_index.remove_document(file_name)
+            shard.discard(file_name)
+
+        # Failed files are recorded too, so they are not retried until they change
+        file_path = os.path.join(self.documents_dir, file_name)
+        self.manifest.record(file_name, file_path, stat, digest, indexed)
+        self.index_dirty = True
+        return indexed
+
+    def remove_document(self, file_name):
+        """Drop a document from the in-memory cache, the inverted index and the manifest."""
+        if self.index_role == 'reader':
+            self.spool.submit("remove", file=file_name)
+            return
+        with self.index_lock.write_lock():
+            self.document_index.pop(file_name, None)
+            self.inverted_index.remove_document(file_name)
+            self.shard(self.manifest.owner(file_name)).discard(file_name)
+
+            if self.manifest.remove(file_name):
+                self.index_dirty = True
+
+    def shard(self, owner):
+        """Returns the shard of an owner's documents, creating it on first use. Call with the index lock held."""
+        shard = self.shards.get(owner)
+        if shard is None:
+            shard = self.shards[owner] = DocumentShard(self.inverted_index, collection=self.ranker)
+        return shard
+
+    def set_document_owner(self, file_name, owner):
+        """Record which user a document belongs to, before or after it is indexed; None makes it shared."""
+        self.set_document_owners({file_name: owner})
+
+    def set_document_owners(self, owners):
+        """Record the owners of several documents, e.g. from the UploadedFile table at startup.
+
+        Documents not mentioned keep their owner. Owner ids are stored as strings, like JWT identities.
+        """
+        if self.index_role == 'reader':
+            self.spool.submit("owners", owners={name: None if owner is None else str(owner)
+                                                for name, owner in owners.items()})
+            return
+        self.wait_until_ready()
+        with self.index_lock.write_lock():
+            for file_name, owner in owners.items():
+                owner = None if owner is None else str(owner)
+                previous = self.manifest.owner(file_name)
+                if owner == previous:
+                    continue
+
+                self.manifest.set_owner(file_name, owner)
+                if file_name in self.inverted_index:
+                    self.shard(previous).discard(file_name)
+                    self.shard(owner).add(file_name)
+                self.index_dirty = True
+                self.owners_generation += 1
+
+    def shards_for(self, user):
+        """Returns the shards a user's searches cover, or None for every document."""
+        if user is ALL_USERS:
+            return None
+        shards = [self.shards[None]]
+        if user is not None and str(user) in self.shards:
+            shards.insert(0, self.shards[str(user)])
+        return shards
+
+    def fetch_files_from_supabase(self):
+        """Pull new and changed files from the storage bucket and index them. Returns (changed, removed) names.
+
+        Only objects whose ETag changed are downloaded, so this is cheap to run on a schedule.
+        Readers leave this to the writer.
+        """
+        if self.storage_sync is None or self.index_role == 'reader':
+            return [], []
+
+        with span("storage.sync"):
+            changed, removed = self.storage_sync.sync()
+        for file_name in removed:
+            self.remove_document(file_name)
+        self.resolve_owners(changed)
+        if changed:
+            self.index_files(changed)
+        self.save_index()
+        return changed, removed
+
+    def resolve_owners(self, file_names):
+        """Record the owners of synced files before they are indexed, so no private file is ever shared.
+
+        Files that already have an owner keep it. The others, and any still waiting for their owner
+        to be known, are looked up with owner_lookup; those it does not know get UNKNOWN_OWNER.
+        """
+        unknown = [name for name, owner in self.manifest.owners.items() if owner == UNKNOWN_OWNER]
+        names = list(dict.fromkeys(
+            [name for name in file_names if self.manifest.owner(name) is None] + unknown))
+        if not names:
+            return
+        found = self.owner_lookup(names) if self.owner_lookup else {}
+        self.set_document_owners({name: found.get(name, UNKNOWN_OWNER) for name in names})
+
     def upload_document(self, file_path):
         """Uploads and saves a document to the 'data/' directory and indexes it."""
         try:
@@ -74,19 +568,14 @@ class INBOTChatbot:
             else:
                 logging.info(f"Document '{file_name}' already exists in '{self.documents_dir}', skipping copy.")
 
-            # Parse and index the document
-            parsed_text = self.parse_document(destination_path)
-            if parsed_text and not parsed_text.startswith("Error"):
-                cleaned_text = self.clean_parsed_text(parsed_text)
-                self.document_index[file_name] = cleaned_text
-
-                # Optionally, save to cache if required
-                if hasattr(self, 'save_document_cache'):
-                    self.save_document_cache()
+            # Parse and index the document, unless the manifest shows it was already indexed
+            if self.index_file(file_name):
+                self.save_index()
 
                 logging.info(f"Document '{file_name}' parsed, cleaned, and indexed successfully.")
                 return f"Document '{file_name}' uploaded and indexed successfully."
             else:
+                self.save_index()
                 logging.error(f"Failed to parse document '{file_name}'.")
                 return f"Error parsing document '{file_name}'."
         
@@ -96,132 +585,578 @@ class INBOTChatbot:
 
     def parse_document(self, file_path):
         """Parses the text from PDF, DOCX, and TXT files."""
-        ext = os.path.splitext(file_path)[1].lower()  # Get file extension
-        text = ""
-        
-        try:
-            # Parse based on file extension
-            if ext == ".pdf":
-                # Parse PDF file
-                with open(file_path, 'rb') as f:
-                    reader = PyPDF2.PdfReader(f)
-                    text = " ".join([page.extract_text() for page in reader.pages])
-                logging.info(f"Successfully parsed PDF document '{file_path}'.")
-
-            elif ext == ".docx":
-                # Parse DOCX file
-                doc = Document(file_path)
-                text = " ".join([para.text for para in doc.paragraphs])
-                logging.info(f"Successfully parsed DOCX document '{file_path}'.")
-            
-            elif ext == ".txt":
-                # Parse TXT file
-                with open(file_path, 'r') as f:
-                    text = f.read()
-                logging.info(f"Successfully parsed TXT document '{file_path}'.")
-            
-            else:
-                logging.warning(f"Unsupported file format for '{file_path}'.")
-                return "Unsupported file format."
-
-            return text
-        
-        except Exception as e:
-            logging.error(f"Error parsing document '{file_path}': {e}")
-            return f"Error parsing document: {e}"
+        return parse_document(file_path)
 
     def clean_parsed_text(self, text):
         """Cleans the parsed text by improving readability."""
-        try: 
-            # Lowercase the text to make it more readable and consistent
-            cleaned_text = text.lower()
+        return clean_parsed_text(text)
 
-            # Replace bullet points and strange characters with proper formatting
-            cleaned_text = cleaned_text.replace('•', '\n- ').replace('●', '\n- ')
+    def ask_question(self, question, user=ALL_USERS):
+        """Answer a question using document search with fallback to Groq API.
 
-            # Use regex to handle common issues:
-            # Add a space between lowercase and uppercase letters (for joined words)
-            cleaned_text = re.sub(r'([a-z])([A-Z])', r'\1 \2', cleaned_text)
+        user limits the search to that user's documents and the shared ones; see ALL_USERS.
+        """
+        try:
+            # Step 1: Search indexed documents, then the answer cache
+            prepared = self.prepare_answer(question, user)
 
-            # Add spaces around punctuation marks
-            cleaned_text = re.sub(r'(?<!\s)([.,!?%])', r' \1', cleaned_text)
+            # Step 2: Ask the Groq API if neither had the answer
+            return self.complete_answer(question, prepared)
 
-            # Remove any multiple spaces and normalize spaces
-            cleaned_text = re.sub(r'\s+', ' ', cleaned_text).strip()
-            
-            logging.info("Text cleaned successfully.")
-            return cleaned_text
-        
         except Exception as e:
-            logging.error(f"Error cleaning text: {e}")
-            return f"Error cleaning text: {e}"
+            logging.error(f"Error during question answering: {e}")
+            return ERROR_ANSWER
 
-    def ask_question(self, question):
-        """Answer a question using document search with fallback to Groq API."""
+    def ask_questions(self, questions, max_concurrency=8, user=ALL_USERS):
+        """Answer several questions at once, returning the answers in the order of the questions.
+
+        Questions that only differ in case or punctuation are answered once, all of them are
+        ranked against the index in one pass, and those that need Groq are sent concurrently,
+        at most max_concurrency at a time. A failure only affects its own question.
+        """
+        unique = {}  # normalized question -> first question asked that way
+        for question in questions:
+            unique.setdefault(normalize_question(question), question)
         try:
-            # Step 1: Search indexed documents for relevant information
-            search_results = self.search_documents(query=question)
-
-            if search_results and "No matches found" not in search_results:
-                logging.info(f"Answer found in documents for question: {question}")
-
-                # Clean and beautify the document search results
-                formatted_response = "📂 **Here’s what I found in the uploaded documents:**\n\n"
-                for line in search_results.splitlines():
-                    # Format results into bullet points with proper indentation
-                    if line.strip():
-                        formatted_response += f"   • {line.strip()}\n"
-
-                # Add a friendly closing remark
-                formatted_response += "\n✏️ **Feel free to ask more questions or request specific details!**"
-                return formatted_response
-
-            # Step 2: Fallback to Groq API if no document matches are found
-            chat_completion = client.chat.completions.create(
-                messages=[
-                    {"role": "user", "content": question}
-                ],
-                model="llama3-8b-8192",  # Groq model
-            )
-
-            api_response = chat_completion.choices[0].message.content.strip()
+            prepared = self.prepare_answers(list(unique.values()), user)
+        except Exception as e:
+            logging.error(f"Error during batch question answering: {e}")
+            return [ERROR_ANSWER] * len(questions)
+
+        def answer(question, prepared_answer):
+            try:
+                return self.complete_answer(question, prepared_answer)
+            except Exception as e:
+                logging.error(f"Error during question answering: {e}")
+                return ERROR_ANSWER
+
+        # Document and cached answers are ready; only the Groq calls need the threads
+        groq_calls = sum(1 for p in prepared if not p.document_answer and p.cached_answer is None)
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, groq_calls)),
+                                thread_name_prefix="inbot-batch") as executor:
+            answers = dict(zip(unique, executor.map(answer, unique.values(), prepared)))
+        return [answers[normalize_question(question)] for question in questions]
+
+    def complete_answer(self, question, prepared):
+        """Turns a PreparedAnswer into the final answer, asking Groq unless the documents or the cache answered."""
+        if prepared.document_answer:
+            return "".join(prepared.document_answer)
+
+        api_response = prepared.cached_answer
+        if api_response is None:
+            # Ask the Groq API, with the best passages as context in RAG mode
+            with span("groq"):
+                api_response = self.llm.complete(prepared.messages, GROQ_MODEL).strip()
+
+            self.answer_cache.set(prepared.cache_key, api_response)
             logging.info(f"Question asked to Groq API: {question}")
 
-            return f"🤖 **AI Assistant’s Response:**\n\n{api_response}\n\n✏️ **Let me know if there’s anything else I can assist with!**"
+        return f"{AI_ANSWER_HEADER}{api_response}{self.format_sources(prepared.sources)}{AI_ANSWER_FOOTER}"
+
+    def ask_question_stream(self, question, user=ALL_USERS):
+        """Answer a question like ask_question, yielding the response in pieces as soon as each is ready."""
+        try:
+            # Step 1: Search indexed documents, then the answer cache
+            prepared = self.prepare_answer(question, user)
+            if prepared.document_answer:
+                yield from prepared.document_answer
+                return
+
+            yield AI_ANSWER_HEADER
+            if prepared.cached_answer is not None:
+                yield prepared.cached_answer
+            else:
+                # Step 2: Stream the Groq completion token by token
+                # Timed from the request to the last token, including the client reading the stream
+                with span("groq.stream"):
+                    stream = self.llm.stream(prepared.messages, GROQ_MODEL)
+
+                    pieces = []
+                    for chunk in stream:
+                        token = self.stream_token(chunk, first=not pieces)
+                        if token:
+                            pieces.append(token)
+                            yield token
+
+                self.answer_cache.set(prepared.cache_key, "".join(pieces).strip())
+                logging.info(f"Question streamed from Groq API: {question}")
+
+            yield self.format_sources(prepared.sources)
+            yield AI_ANSWER_FOOTER
 
         except Exception as e:
-            logging.error(f"Error during question answering: {e}")
-            return "⚠️ **Error:** Unable to process your question at the moment. Please try again later."
+            logging.error(f"Error during streamed question answering: {e}")
+            yield ERROR_ANSWER
 
-    def search_documents(self, query, threshold=30):
-        """Searches through all documents for the query with fuzzy matching and highlights the term."""
-        results = []
+    async def ask_question_async(self, question, user=ALL_USERS):
+        """Answer a question like ask_question without tying up a thread while Groq generates."""
         try:
-            for file_name in os.listdir(self.documents_dir):
-                file_path = os.path.join(self.documents_dir, file_name)
-                document_text = self.parse_document(file_path)
+            # Step 1: Search and cache lookup run on the small search pool, never on the event loop
+            prepared = await self.run_blocking(self.prepare_answer, question, user)
 
-                # Use fuzzy matching to find the closest match to the query
-                match = process.extractOne(query.lower(), document_text.lower().split(), scorer=fuzz.token_set_ratio)
-                if match and match[1] >= threshold:  # Only accept matches above the threshold
-                    match_term = match[0]
+            # Step 2: Await the Groq API; thousands of these can be in flight on one thread
+            return await self.complete_answer_async(question, prepared)
 
-                    # Find the position of the matched term
-                    snippet_start = max(0, document_text.lower().find(match_term) - 100)
-                    snippet_end = snippet_start + 300
-                    snippet = document_text[snippet_start:snippet_end]
+        except Exception as e:
+            logging.error(f"Error during async question answering: {e}")
+            return ERROR_ANSWER
 
-                    # Highlight the matched term
-                    highlighted_snippet = snippet.replace(match_term, f"**{match_term}**")
+    async def ask_questions_async(self, questions, max_concurrency=8, user=ALL_USERS):
+        """Async version of ask_questions, with the Groq calls awaited concurrently on the event loop."""
+        unique = {}  # normalized question -> first question asked that way
+        for question in questions:
+            unique.setdefault(normalize_question(question), question)
+        try:
+            prepared = await self.run_blocking(self.prepare_answers, list(unique.values()), user)
+        except Exception as e:
+            logging.error(f"Error during async batch question answering: {e}")
+            return [ERROR_ANSWER] * len(questions)
+
+        limit = asyncio.Semaphore(max(1, max_concurrency))  # like the thread pool of ask_questions
+
+        async def answer(question, prepared_answer):
+            try:
+                async with limit:
+                    return await self.complete_answer_async(question, prepared_answer)
+            except Exception as e:
+                logging.error(f"Error during async question answering: {e}")
+                return ERROR_ANSWER
+
+        answers = await asyncio.gather(*(answer(q, p) for q, p in zip(unique.values(), prepared)))
+        answers = dict(zip(unique, answers))
+        return [answers[normalize_question(question)] for question in questions]
 
-                    results.append(f"📄 **Match found in** `{file_name}`:\n\n   - {highlighted_snippet.strip()}")
+    async def complete_answer_async(self, question, prepared):
+        """Async version of complete_answer."""
+        if prepared.document_answer:
+            return "".join(prepared.document_answer)
 
-            if results:
-                response = "\n\n".join(results)
-                return response
+        api_response = prepared.cached_answer
+        if api_response is None:
+            with span("groq"):
+                api_response = (await self.llm.complete_async(prepared.messages, GROQ_MODEL)).strip()
+
+            await self.run_blocking(self.answer_cache.set, prepared.cache_key, api_response)
+            logging.info(f"Question asked to Groq API: {question}")
+
+        return f"{AI_ANSWER_HEADER}{api_response}{self.format_sources(prepared.sources)}{AI_ANSWER_FOOTER}"
+
+    async def ask_question_stream_async(self, question, user=ALL_USERS):
+        """Async version of ask_question_stream, for serving streams from an event loop."""
+        try:
+            # Step 1: Search and cache lookup run on the small search pool, never on the event loop
+            prepared = await self.run_blocking(self.prepare_answer, question, user)
+            if prepared.document_answer:
+                for piece in prepared.document_answer:
+                    yield piece
+                return
+
+            yield AI_ANSWER_HEADER
+            if prepared.cached_answer is not None:
+                yield prepared.cached_answer
             else:
-                return "No matches found in uploaded documents."
+                # Step 2: Stream the Groq completion token by token
+                # Timed from the request to the last token, including the client reading the stream
+                with span("groq.stream"):
+                    stream = await self.llm.stream_async(prepared.messages, GROQ_MODEL)
+
+                    pieces = []
+                    async for chunk in stream:
+                        token = self.stream_token(chunk, first=not pieces)
+                        if token:
+                            pieces.append(token)
+                            yield token
+
+                await self.run_blocking(self.answer_cache.set, prepared.cache_key, "".join(pieces).strip())
+                logging.info(f"Question streamed from Groq API: {question}")
+
+            yield self.format_sources(prepared.sources)
+            yield AI_ANSWER_FOOTER
 
         except Exception as e:
-            logging.error(f"Error during document search for '{query}': {e}")
-            return f"Error during document search: {e}"
+            logging.error(f"Error during async streamed question answering: {e}")
+            yield ERROR_ANSWER
+
+    def prepare_answer(self, question, user=ALL_USERS):
+        """Runs the local steps of answering a question and returns a PreparedAnswer."""
+        return self.prepare_answers([question], user)[0]
+
+    def prepare_answers(self, questions, user=ALL_USERS):
+        """Runs the local steps of answering several questions, searching for all of them in one pass.
+
+        Returns a PreparedAnswer per question.
+        """
+        if self.answer_mode == 'rag':
+            prompts = self.build_rag_prompts(questions, user)
+        else:
+            prompts = []
+            for question, search_results in zip(questions, self.search_documents_many(questions, user=user)):
+                if search_results and "No matches found" not in search_results:
+                    logging.info(f"Answer found in documents for question: {question}")
+                    prompts.append(list(self.format_document_answer(search_results)))
+                else:
+                    prompts.append(([], [{"role": "user", "content": question}]))
+
+        prepared = []
+        for question, prompt in zip(questions, prompts):
+            if isinstance(prompt, list):  # answered from the documents
+                prepared.append(PreparedAnswer(prompt, None, None, None, []))
+                continue
+
+            # Reuse the answer to the same question if Groq answered it recently
+            sources, messages = prompt
+            cache_key = self.answer_cache_key(question, user)
+            api_response = self.answer_cache.get(cache_key)
+            if api_response is not None:
+                logging.info(f"Answered from cache: {question}")
+            prepared.append(PreparedAnswer(None, cache_key, api_response, messages, sources))
+        return prepared
+
+    def build_rag_prompt(self, question, user=ALL_USERS):
+        """Packs the best passages for the question into a prompt. Returns (sources, messages).
+
+        Without matching passages the question is sent on its own, as in snippets mode.
+        """
+        return self.build_rag_prompts([question], user)[0]
+
+    def build_rag_prompts(self, questions, user=ALL_USERS):
+        """Builds the RAG prompt of several questions, retrieving passages for all of them in one pass."""
+        # The passages are sliced under the same read lock as the search that found them
+        self.wait_until_ready(timeout=READY_TIMEOUT)
+        if self.index_role == 'reader':
+            self.refresh_snapshot()  # before the read lock: a snapshot swap takes the write lock
+        prompts = []
+        with self.index_lock.read_lock():
+            for question, passages in zip(questions, self.retrieve_many(questions, top_k=self.rag_top_k, user=user)):
+                with span("rag.pack"):
+                    sources, tokens = pack_passages(
+                        [(p["file_name"], p["start"], p["end"], p["score"]) for p in passages],
+                        self.context_tokens, self.document_index.slice)
+
+                if not sources:
+                    prompts.append(([], [{"role": "user", "content": question}]))
+                    continue
+                logging.info(f"RAG prompt for '{question}': {len(sources)} excerpts, about {tokens} context tokens.")
+                prompts.append((sources, build_messages(question, sources, display_name)))
+        return prompts
+
+    def format_sources(self, sources):
+        """Lists the documents an answer drew on, or returns an empty string if there are none."""
+        file_names = list(dict.fromkeys(source["file_name"] for source in sources))
+        if not file_names:
+            return ""
+        return SOURCES_HEADER + ", ".join(f"`{display_name(file_name)}`" for file_name in file_names)
+
+    def stream_token(self, chunk, first):
+        """Extracts the text of a streamed Groq chunk, trimming leading space like the non-streaming answer."""
+        token = chunk.choices[0].delta.content if chunk.choices else None
+        if token and first:
+            token = token.lstrip()
+        return token
+
+    async def run_blocking(self, func, *args):
+        """Run a blocking call on the search thread pool and await its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.search_executor, functools.partial(func, *args))
+
+    def format_document_answer(self, search_results):
+        """Yields the document search results formatted as a bulleted answer, one line at a time."""
+        # Clean and beautify the document search results
+        yield "📂 **Here’s what I found in the uploaded documents:**\n\n"
+        for line in search_results.splitlines():
+            # Format results into bullet points with proper indentation
+            if line.strip():
+                yield f"   • {line.strip()}\n"
+
+        # Add a friendly closing remark
+        yield "\n✏️ **Feel free to ask more questions or request specific details!**"
+
+    def answer_cache_key(self, question, user=ALL_USERS):
+        """Builds the answer cache key from the normalized question, the model, the answer mode, the index version
+        and the documents the user may see, so an ownership change never serves answers from documents
+        the user lost access to."""
+        mode = "rag:" if self.answer_mode == 'rag' else ""
+        return (f"{GROQ_MODEL}:{mode}{self.index_version()}:{user_scope(user)}-{self.visible_version(user)}:"
+                f"{normalize_question(question)}")
+
+    def visible_documents(self, user=ALL_USERS):
+        """Returns the names of the documents a user's searches cover."""
+        with self.index_lock.read_lock():
+            if self.index_role == 'reader':
+                if self.snapshot is None:
+                    return set()
+                if user is ALL_USERS:
+                    return set(self.snapshot.documents)
+                return set(self.snapshot.visible_documents(None if user is None else str(user)))
+            shards = self.shards_for(user)
+            if shards is None:
+                return set(self.inverted_index.doc_lengths)
+            return set().union(*(shard.documents for shard in shards))
+
+    def visible_version(self, user=ALL_USERS):
+        """Returns a digest of the names of the documents a user may see, the same in every worker."""
+        scope = user_scope(user)
+        with self.index_lock.read_lock():
+            generation = (self.inverted_index.generation, self.owners_generation)
+            cached = self._visible_versions.get(scope)
+            if cached is not None and cached[0] == generation:
+                return cached[1]
+            digest = hashlib.sha1("\n".join(sorted(self.visible_documents(user))).encode('utf-8')).hexdigest()[:12]
+            if any(version[0] != generation for version in self._visible_versions.values()):
+                self._visible_versions = {}  # every digest is stale once anything changed
+            self._visible_versions[scope] = (generation, digest)
+            return digest
+
+    def index_version(self):
+        """Returns a digest of the indexed documents' content hashes, stable across restarts and workers."""
+        if self.index_role == 'reader':
+            snapshot = self.snapshot
+            return snapshot.index_version if snapshot is not None else "empty"
+        with self.index_lock.read_lock():
+            generation = self.inverted_index.generation
+            if self._index_version[0] != generation:
+                digest = hashlib.sha1()
+                for file_name in sorted(self.manifest.names()):
+                    entry = self.manifest.get(file_name)
+                    digest.update(f"{file_name}\0{entry['sha256']}\0{entry['indexed']}\n".encode('utf-8'))
+                self._index_version = (generation, digest.hexdigest()[:16])
+            return self._index_version[1]
+
+    def register_metrics(self, registry):
+        """Expose the index size and cache hit rates as gauges and counters in a metrics registry."""
+        def cache_stats():
+            return {"answer": self.answer_cache.stats(), "search": self.search_cache.stats(),
+                    "stem": stem.cache_info()._asdict()}
+
+        for metric in (
+            # Read through self, since a snapshot reader swaps its index on every new snapshot
+            CallbackMetric("inbot_index_documents", "Documents in the search index.", lambda: len(self.inverted_index)),
+            CallbackMetric("inbot_index_terms", "Distinct terms in the search index.",
+                           lambda: len(self.inverted_index.postings)),
+            CallbackMetric("inbot_index_passages", "Passages the search ranks.",
+                           lambda: sum(len(spans) for spans in list(self.inverted_index.chunks.values()))),
+            CallbackMetric("inbot_document_store_bytes", "Bytes of cleaned text in the document store.",
+                           lambda: self.document_index.blob_size),
+            CallbackMetric("inbot_index_ready", "1 once the saved index is loaded.", lambda: int(self.ready.is_set())),
+            CallbackMetric("inbot_cache_hits_total", "Cache lookups that found an entry.",
+                           lambda: {name: stats["hits"] for name, stats in cache_stats().items()},
+                           labelnames=("cache",), kind="counter"),
+            CallbackMetric("inbot_cache_misses_total", "Cache lookups that found nothing.",
+                           lambda: {name: stats["misses"] for name, stats in cache_stats().items()},
+                           labelnames=("cache",), kind="counter"),
+            CallbackMetric("inbot_cache_hit_ratio", "Share of cache lookups that found an entry.",
+                           lambda: {name: stats["hits"] / max(1, stats["hits"] + stats["misses"])
+                                    for name, stats in cache_stats().items()},
+                           labelnames=("cache",)),
+            CallbackMetric("inbot_cache_entries", "Entries held by a cache.",
+                           lambda: {name: stats.get("size", stats.get("currsize")) for name, stats in cache_stats().items()},
+                           labelnames=("cache",)),
+            CallbackMetric("inbot_cache_evictions_total", "Entries a cache dropped to stay within its size.",
+                           lambda: {name: stats["evictions"] for name, stats in cache_stats().items()
+                                    if "evictions" in stats},
+                           labelnames=("cache",), kind="counter"),
+        ):
+            registry.register(metric)
+        self.llm.register_metrics(registry)
+
+    def search_documents(self, query, threshold=30, top_k=5, user=ALL_USERS):
+        """Searches the indexed passages for the query with BM25 ranking and highlights the matched terms."""
+        return self.search_documents_many([query], threshold=threshold, top_k=top_k, user=user)[0]
+
+    def search_documents_many(self, queries, threshold=30, top_k=5, user=ALL_USERS):
+        """Like search_documents for several queries, ranked together in one pass over the index."""
+        try:
+            responses = []
+            for passages in self.retrieve_many(queries, threshold=threshold, top_k=top_k, one_per_document=True,
+                                               user=user):
+                results = [
+                    f"📄 **Match found in** `{display_name(passage['file_name'])}`:\n\n   - {passage['highlighted']}"
+                    for passage in passages
+                ]
+                responses.append("\n\n".join(results) if results else "No matches found in uploaded documents.")
+            return responses
+
+        except Exception as e:
+            logging.error(f"Error during document search for {queries}: {e}")
+            return [f"Error during document search: {e}"] * len(queries)
+
+    def retrieve(self, query, threshold=30, top_k=5, one_per_document=False, user=ALL_USERS):
+        """Returns the top-k passages for the query across the user's documents, best first, with their BM25 scores."""
+        return self.retrieve_many([query], threshold, top_k, one_per_document, user)[0]
+
+    def retrieve_many(self, queries, threshold=30, top_k=5, one_per_document=False, user=ALL_USERS):
+        """Returns the top-k passages of each query, scoring all queries with one sparse matrix product per shard.
+
+        Queries answered recently come from the search cache; the passages returned may be shared
+        with other callers, so treat them as read-only.
+        """
+        self.wait_until_ready(timeout=READY_TIMEOUT)
+        if self.index_role == 'reader':
+            self.refresh_snapshot()
+        with span("search"), self.index_lock.read_lock():
+            # The index only changes under the write lock, so the generation holds for this whole search
+            generation = (self.inverted_index.generation, self.owners_generation)
+            if self.search_cache_generation != generation:
+                self.search_cache.clear()
+                self.search_cache_generation = generation
+
+            results = [None] * len(queries)
+            keys = [self.search_cache_key(query, threshold, top_k, one_per_document, user) for query in queries]
+            misses = {}  # cache key -> positions of the queries to search; repeats in a batch are searched once
+            for position, key in enumerate(keys):
+                passages = self.search_cache.get(key) if key not in misses else None
+                if passages is None:
+                    misses.setdefault(key, []).append(position)
+                else:
+                    results[position] = passages
+            if not misses:
+                return results
+
+            searched = self._retrieve_many([queries[positions[0]] for positions in misses.values()],
+                                           threshold, top_k, one_per_document, user)
+            for (key, positions), passages in zip(misses.items(), searched):
+                self.search_cache.set(key, passages)
+                for position in positions:
+                    results[position] = passages
+            return results
+
+    def search_cache_key(self, query, threshold, top_k, one_per_document, user):
+        """Builds the search cache key from the query's stemmed terms, the search settings and the user's scope.
+
+        Term order and stop words do not change BM25 results, so 'the expense limit' and 'limit of
+        expenses' share an entry. Embedding search reads the whole question, so it keys on the
+        normalized question instead.
+        """
+        if self.embedding_retriever:
+            terms = normalize_question(query)
+        else:
+            terms = " ".join(sorted(query_terms(query)))
+        return (terms, user_scope(user), threshold, top_k, one_per_document)
+
+    def _retrieve_many(self, queries, threshold, top_k, one_per_document, user):
+        with span("search.match_terms"):
+            fuzzy_matches = {}  # an unknown term shared by several queries is looked up once
+            term_lists = [self.match_query_terms(query, threshold, fuzzy_matches) for query in queries]
+
+        # Several passages of one document may rank high, so over-fetch when only the best one per document is kept
+        k = top_k * 4 if one_per_document else top_k
+        with span("search.rank"):
+            shards = self.shards_for(user)
+            if self.index_role == 'reader':
+                if self.snapshot is None:
+                    candidate_lists = [[] for _ in queries]
+                else:
+                    # Scatter-gather over the snapshot's shards, limited to the documents the user may see
+                    documents = None
+                    if user is not ALL_USERS:
+                        documents = self.snapshot.visible_documents(None if user is None else str(user))
+                    candidate_lists = self.snapshot.top_k_many(term_lists, k=k, documents=documents)
+            elif self.embedding_retriever:
+                documents = None if shards is None else set().union(*(shard.documents for shard in shards))
+                candidate_lists = self.embedding_retriever.search(queries, k=k, documents=documents)
+            elif shards is None:
+                candidate_lists = self.ranker.top_k_many(term_lists, k=k)
+            else:
+                # Only the user's shard and the shared one are scored; their weights use the statistics
+                # of the whole collection, so the scores compare and the best passages are merged by them
+                per_shard = [shard.ranker.top_k_many(term_lists, k=k) for shard in shards if len(shard)]
+                candidate_lists = [
+                    sorted((c for candidates in lists for c in candidates), key=lambda c: -c[3])[:k]
+                    for lists in zip(*per_shard)
+                ] if per_shard else [[] for _ in queries]
+
+        return [
+            self._passages(terms, candidates, top_k, one_per_document)
+            for terms, candidates in zip(term_lists, candidate_lists)
+        ]
+
+    def _passages(self, terms, candidates, top_k, one_per_document):
+        # Turns ranked (document name, start, end, score) candidates into highlighted passages
+        passages = []
+        seen_documents = set()
+        for file_name, start, end, score in candidates:
+            if one_per_document and file_name in seen_documents:
+                continue
+
+            # Only the passage is decoded from the text store, never the whole document
+            passage = self.document_index.slice(file_name, start, end)
+            if not passage:
+                continue
+            seen_documents.add(file_name)
+
+            # Highlighting only touches the occurrences inside this passage
+            passage_offsets = []
+            for term in terms:
+                offsets = self.inverted_index.lookup(term).get(file_name, ())
+                first = bisect_left(offsets, start)
+                last = bisect_left(offsets, end, first)
+                passage_offsets.extend(offset - start for offset in offsets[first:last])
+
+            passages.append({
+                "file_name": file_name,
+                "score": score,
+                "start": start,
+                "end": end,
+                "text": passage.strip(),
+                "highlighted": highlight_words(passage, passage_offsets).strip(),
+            })
+            if len(passages) == top_k:
+                break
+        return passages
+
+    def match_query_terms(self, query, threshold=30, fuzzy_matches=None):
+        """Maps query terms onto index terms, falling back to the closest fuzzy match for unknown terms.
+
+        Unknown terms are matched among the vocabulary terms within two edits, and the one with
+        the best fuzz.ratio is used if that ratio reaches the threshold. fuzzy_matches, if given,
+        is a dict remembering the fuzzy match of each unknown term, shared by the queries of a batch.
+        """
+        matched_terms = []
+        for term in query_terms(query):
+            if self.inverted_index.lookup(term):
+                matched_terms.append(term)
+                continue
+
+            if fuzzy_matches is not None and term in fuzzy_matches:
+                match = fuzzy_matches[term]
+            else:
+                from fuzzywuzzy import fuzz
+                match = self.fuzzy_vocabulary.best_match(term, fuzz.ratio)
+                if fuzzy_matches is not None:
+                    fuzzy_matches[term] = match
+            if match and match[1] >= threshold and match[0] not in matched_terms:
+                matched_terms.append(match[0])
+
+        return matched_terms
+
+
+def user_scope(user):
+    """Names the documents a user's searches cover, for cache keys."""
+    if user is ALL_USERS:
+        return "all"
+    if user is None:
+        return "shared"
+    return f"user-{user}"
+
+
+def owned_file_name(owner, file_name):
+    """Returns the name a user's upload is stored and indexed under, so users never overwrite each other's files.
+
+    secure_filename never starts a name with '_', so the owner prefix cannot be forged by an upload.
+    """
+    return f"{owner}{OWNER_SEPARATOR}{file_name}"
+
+
+def display_name(file_name):
+    """Returns the name a user uploaded a file as, without the owner prefix of owned_file_name."""
+    owner, separator, name = file_name.partition(OWNER_SEPARATOR)
+    return name if separator and owner.isdigit() and name else file_name
+
+
+def highlight_words(text, offsets):
+    """Wraps the words starting at the given offsets of the text in bold markers."""
+    for offset in sorted(set(offsets), reverse=True):
+        word = word_at(text, offset)
+        if word:
+            text = f"{text[:offset]}**{word}**{text[offset + len(word):]}"
+    return text
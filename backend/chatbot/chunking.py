@@ -0,0 +1,33 @@
+CHUNK_SIZE = 400     # characters per passage
+CHUNK_OVERLAP = 80   # characters shared by consecutive passages
+
+
+def chunk_spans(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """Splits text into overlapping passages and returns their (start, end) character offsets.
+
+    Boundaries are snapped to spaces so passages never cut a word in half, and the
+    overlap is capped at a quarter of the size so any offset falls in at most two passages.
+    """
+    overlap = min(overlap, size // 4)
+    spans = []
+    start = 0
+    text_length = len(text)
+
+    while start < text_length:
+        end = min(text_length, start + size)
+        if end < text_length:
+            # End on the last space of the second half of the window
+            space = text.rfind(' ', start + size // 2, end)
+            if space != -1:
+                end = space
+        spans.append((start, end))
+
+        if end >= text_length:
+            break
+
+        # Start the next passage at the first word inside the overlap
+        next_start = max(start + 1, end - overlap)
+        space = text.find(' ', next_start, end)
+        start = space + 1 if space != -1 else next_start
+
+    return spans
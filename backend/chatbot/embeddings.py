@@ -0,0 +1,335 @@
+import os
+import json
+import math
+import zlib
+import logging
+import threading
+from collections import Counter
+from functools import lru_cache
+import numpy as np
+
+from .text import analyze
+
+
+@lru_cache(maxsize=200000)
+def _feature_hash(feature):
+    # crc32 is stable across processes, unlike the salted built-in hash()
+    return zlib.crc32(feature.encode('utf-8'))
+
+
+class HashingEncoder:
+    """CPU-only text encoder that hashes stemmed words and word pairs into a fixed-size vector."""
+
+    def __init__(self, dim=256):
+        """Prepare an encoder producing vectors of dim dimensions."""
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def encode(self, texts):
+        """Returns a (len(texts), dim) float32 matrix of L2-normalised embeddings."""
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            terms = [term for term, _ in analyze(text)]
+            features = Counter(terms)
+            features.update(f"{first} {second}" for first, second in zip(terms, terms[1:]))
+            if not features:
+                continue
+
+            hashes = np.fromiter((_feature_hash(feature) for feature in features), dtype=np.uint32, count=len(features))
+            weights = np.fromiter((1 + math.log(count) for count in features.values()), dtype=np.float32, count=len(features))
+
+            # The top bit of the hash picks the sign, so collisions tend to cancel out
+            signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+            np.add.at(vectors[row], hashes % self.dim, signs * weights)
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+
+class VectorStore:
+    """Float32 embedding matrix kept in a memory-mapped file, with brute-force or IVF cosine top-k search."""
+
+    FORMAT_VERSION = 2
+
+    def __init__(self, store_dir, dim, ivf_min_rows=20000, nprobe=8):
+        """Prepare an empty store. IVF search kicks in once the store holds ivf_min_rows vectors (0 disables it)."""
+        self.store_dir = store_dir
+        self.vectors_path = os.path.join(store_dir, "vectors.f32")
+        self.meta_path = os.path.join(store_dir, "vectors.json")
+        self.dim = dim
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = nprobe
+
+        self.matrix = np.empty((0, dim), dtype=np.float32)  # a read-only memmap once loaded from disk
+        self.keys = []                                        # row -> (document name, start, end)
+        self.live = np.ones(0, dtype=bool)                    # False for rows of removed documents
+        self.doc_rows = {}                                    # document name -> rows
+        self.fingerprints = {}                                # document name -> checksum of the embedded text
+        self.ivf = None                                       # (centroids, rows grouped by list, list offsets)
+        self.saved_rows = 0                                   # rows already written to the vectors file
+
+    def __len__(self):
+        return int(self.live.sum())
+
+    def garbage(self):
+        """Returns the number of rows kept for removed documents until the next compact()."""
+        return len(self.keys) - len(self)
+
+    def documents(self):
+        """Returns the names of the documents with vectors in the store."""
+        return set(self.doc_rows)
+
+    def add(self, keys, vectors):
+        """Append normalised vectors with their (document name, start, end) keys."""
+        if not len(keys):
+            return
+        first_row = len(self.keys)
+        self.matrix = np.vstack([self.matrix, np.asarray(vectors, dtype=np.float32)])
+        self.live = np.concatenate([self.live, np.ones(len(keys), dtype=bool)])
+        for row, key in enumerate(keys, start=first_row):
+            self.keys.append(tuple(key))
+            self.doc_rows.setdefault(key[0], []).append(row)
+        self.ivf = None
+
+    def remove_document(self, doc_id):
+        """Hide every vector of a document. The rows are dropped for good by compact()."""
+        for row in self.doc_rows.pop(doc_id, ()):
+            self.live[row] = False
+        self.fingerprints.pop(doc_id, None)
+
+    def search(self, queries, k=5, documents=None):
+        """Returns, for each query vector, up to k (key, cosine score) pairs, best first.
+
+        documents, when given, limits the search to the vectors of those documents.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        live = self.live
+        if documents is not None:
+            live = np.zeros_like(self.live)
+            for doc_id in documents:
+                live[self.doc_rows.get(doc_id, [])] = True
+        if not len(self.keys) or not live.any():
+            return [[] for _ in queries]
+
+        if self.ivf_min_rows and len(self) >= self.ivf_min_rows:
+            return [self._search_ivf(query, k, None if documents is None else live) for query in queries]
+
+        # One matrix multiply scores every query against every vector
+        scores = queries @ self.matrix.T
+        scores[:, ~live] = -np.inf
+        return [self._top_rows(np.arange(len(self.keys)), row_scores, k) for row_scores in scores]
+
+    def _top_rows(self, rows, scores, k):
+        if len(rows) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        return [(self.keys[rows[i]], float(scores[i])) for i in order if np.isfinite(scores[i])]
+
+    def _search_ivf(self, query, k, allowed=None):
+        if self.ivf is None:
+            self.build_ivf()
+        centroids, list_rows, list_offsets = self.ivf
+
+        # Only the vectors of the lists closest to the query are scored
+        probes = np.argpartition(-(centroids @ query), min(self.nprobe, len(centroids)) - 1)[:self.nprobe]
+        rows = np.concatenate([list_rows[list_offsets[probe]:list_offsets[probe + 1]] for probe in probes])
+        if allowed is not None:
+            rows = rows[allowed[rows]]
+        if not len(rows):
+            return []
+        return self._top_rows(rows, self.matrix[rows] @ query, k)
+
+    def build_ivf(self, iterations=10, seed=0):
+        """Cluster the live vectors with spherical k-means into about sqrt(n) inverted lists."""
+        live_rows = np.flatnonzero(self.live)
+        num_lists = max(1, int(math.sqrt(len(live_rows))))
+        rng = np.random.default_rng(seed)
+
+        # Train on a sample, which is plenty for the coarse quantizer
+        sample = self.matrix[rng.choice(live_rows, size=min(len(live_rows), num_lists * 40), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=num_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            filled = np.bincount(assignment, minlength=num_lists) > 0
+            centroids[filled] = sums[filled]
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+        # Assign every live vector in blocks to bound the size of the score matrix
+        assignment = np.concatenate([
+            np.argmax(self.matrix[live_rows[i:i + 8192]] @ centroids.T, axis=1)
+            for i in range(0, len(live_rows), 8192)
+        ])
+        order = np.argsort(assignment, kind='stable')
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=num_lists))])
+        self.ivf = (centroids, live_rows[order], list_offsets)
+        logging.info(f"Built IVF index with {num_lists} lists over {len(live_rows)} vectors.")
+
+    def save(self, encoder_name):
+        """Append the rows added since the last save to the vectors file, then write the keys atomically.
+
+        Saved rows are never rewritten or renumbered, so searches go on during a save. Rows of
+        removed documents stay in the file, with no key, until compact().
+        """
+        os.makedirs(self.store_dir, exist_ok=True)
+        rows = len(self.keys)
+        with open(self.vectors_path, 'r+b' if os.path.exists(self.vectors_path) else 'wb') as f:
+            # Rows past the saved ones were appended by a save interrupted before its keys were written
+            f.truncate(self.saved_rows * self.dim * 4)
+            f.seek(0, os.SEEK_END)
+            np.ascontiguousarray(self.matrix[self.saved_rows:]).tofile(f)
+        self._write_meta(encoder_name, [key if live else None for key, live in zip(self.keys, self.live)])
+        self.saved_rows = rows
+
+        # The rows held in memory since the last save are replaced by the mapped file, numbered alike
+        if rows:
+            self.matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(rows, self.dim))
+
+    def compact(self, encoder_name):
+        """Rewrite the vectors file with only the live rows. Rows are renumbered, so no search may run meanwhile."""
+        os.makedirs(self.store_dir, exist_ok=True)
+        live_rows = np.flatnonzero(self.live)
+        tmp_path = f"{self.vectors_path}.tmp"
+        np.ascontiguousarray(self.matrix[live_rows]).tofile(tmp_path)
+        os.replace(tmp_path, self.vectors_path)
+        self._write_meta(encoder_name, [self.keys[row] for row in live_rows])
+        logging.info(f"Compacted vector store to {len(live_rows)} vectors.")
+        return self.load(encoder_name)
+
+    def _write_meta(self, encoder_name, keys):
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "version": self.FORMAT_VERSION,
+                "encoder": encoder_name,
+                "dim": self.dim,
+                "keys": keys,
+                "fingerprints": self.fingerprints,
+            }, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def load(self, encoder_name):
+        """Memory-map the saved matrix. Returns False if nothing usable was saved for this encoder."""
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get("version") != self.FORMAT_VERSION or meta.get("encoder") != encoder_name:
+                return False
+
+            # Rows of removed documents have no key
+            keys = [tuple(key) if key is not None else None for key in meta["keys"]]
+            matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(len(keys), self.dim)) \
+                if keys else np.empty((0, self.dim), dtype=np.float32)
+        except (OSError, ValueError, KeyError):
+            return False
+
+        self.matrix = matrix
+        self.keys = keys
+        self.live = np.array([key is not None for key in keys], dtype=bool)
+        self.doc_rows = {}
+        for row, key in enumerate(keys):
+            if key is not None:
+                self.doc_rows.setdefault(key[0], []).append(row)
+        self.fingerprints = meta.get("fingerprints", {})
+        self.ivf = None
+        self.saved_rows = len(keys)
+        return True
+
+
+class EmbeddingRetriever:
+    """Semantic passage retriever that keeps a vector store in sync with the inverted index's passages."""
+
+    def __init__(self, inverted_index, document_index, store_dir, encoder=None, **store_options):
+        """Prepare the retriever; vectors are loaded from store_dir or computed on first use."""
+        self.inverted_index = inverted_index
+        self.document_index = document_index
+        self.encoder = encoder or HashingEncoder()
+        self.store = VectorStore(store_dir, self.encoder.dim, **store_options)
+        self.store.load(self.encoder.name)
+        self.generation = None
+        self.dirty = False  # vectors were embedded or dropped since the last save
+        self.sync_lock = threading.Lock()  # concurrent searches must not embed the same passages twice
+
+    def sync(self):
+        """Embed the passages of new or changed documents and drop the vectors of removed ones.
+
+        Nothing is written to disk; save() does that, off the query path.
+        """
+        index = self.inverted_index
+        changed = False
+
+        for doc_id in self.store.documents() - set(index.chunks):
+            self.store.remove_document(doc_id)
+            changed = True
+
+        keys, texts, fingerprints = [], [], {}
+        for doc_id, spans in index.chunks.items():
+            # The content hash the text was stored under tells whether it changed, without reading it
+            fingerprint = self.document_index.digest(doc_id)
+            if fingerprint is None or self.store.fingerprints.get(doc_id) == fingerprint:
+                continue
+
+            text = self.document_index.get(doc_id)
+            self.store.remove_document(doc_id)
+            fingerprints[doc_id] = fingerprint
+            for start, end in spans:
+                keys.append((doc_id, start, end))
+                texts.append(text[start:end])
+
+        # Encoded in batches of 256 into one matrix, so the store is grown once rather than per batch
+        vectors = np.empty((len(texts), self.encoder.dim), dtype=np.float32)
+        for first in range(0, len(texts), 256):
+            vectors[first:first + 256] = self.encoder.encode(texts[first:first + 256])
+        self.store.add(keys, vectors)
+        self.store.fingerprints.update(fingerprints)
+
+        if texts or changed:
+            self.dirty = True
+            logging.info(f"Embedded {len(texts)} passages; the vector store holds {len(self.store)}.")
+
+        self.generation = index.generation
+
+    def save(self):
+        """Embed what changed in the inverted index, then append the new vectors to the saved store.
+
+        The inverted index must not change meanwhile, e.g. by holding its read lock.
+        """
+        with self.sync_lock:
+            if self.generation != self.inverted_index.generation:
+                self.sync()
+            if self.dirty:
+                self.store.save(self.encoder.name)
+                self.dirty = False
+
+    def compact(self, min_garbage=1024):
+        """Rewrite the saved vectors without the rows of removed documents once they outnumber the live ones.
+
+        Rows are renumbered, so no search may run meanwhile, e.g. by holding the index write lock.
+        """
+        with self.sync_lock:
+            if self.store.garbage() > max(len(self.store), min_garbage):
+                self.store.compact(self.encoder.name)
+                self.dirty = False
+
+    def search(self, queries, k=5, documents=None):
+        """Returns, for each query string, up to k (document name, start, end, score) passages, best first.
+
+        documents, when given, limits the search to those documents.
+        """
+        if self.generation != self.inverted_index.generation:
+            with self.sync_lock:
+                if self.generation != self.inverted_index.generation:
+                    self.sync()
+
+        query_vectors = self.encoder.encode(queries)
+        return [
+            [(*key, score) for key, score in matches if score > 0]
+            for matches in self.store.search(query_vectors, k, documents)
+        ]
+
+    def top_k(self, query, k=5):
+        """Returns up to k (document name, start, end, score) passages for one query string."""
+        return self.search([query], k)[0]
@@ -0,0 +1,137 @@
+import logging
+import threading
+
+
+def edit_distance(a, b, max_distance):
+    """Returns the optimal string alignment distance of a and b (edits plus adjacent transpositions),
+    or max_distance + 1 as soon as it is known to exceed max_distance."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    # Common prefix and suffix cost nothing; most typos leave little in between
+    while a and b and a[0] == b[0]:
+        a, b = a[1:], b[1:]
+    while a and b and a[-1] == b[-1]:
+        a, b = a[:-1], b[:-1]
+    if not a or not b:
+        return min(len(a) or len(b), max_distance + 1)
+
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i] * (len(b) + 1)
+        row_min = i
+        for j, char_b in enumerate(b, start=1):
+            value = previous[j - 1] if char_a == char_b else previous[j - 1] + 1
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if previous2 is not None and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b \
+                    and previous2[j - 2] + 1 < value:
+                value = previous2[j - 2] + 1
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return min(previous[-1], max_distance + 1)
+
+
+class FuzzyVocabulary:
+    """SymSpell-style deletion dictionary over the index vocabulary, for typo-tolerant term lookup.
+
+    Every term is stored under each string reachable by deleting up to max_distance characters
+    from its first prefix_length characters. A misspelled term then finds its neighbours by
+    looking up its own deletions, a few dozen dict probes instead of a scan of the vocabulary.
+    The dictionary follows the index incrementally: new terms are added, and terms that left
+    the index are skipped at lookup until enough pile up to rebuild.
+    """
+
+    def __init__(self, inverted_index, max_distance=2, prefix_length=7):
+        self.inverted_index = inverted_index
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.deletes = {}       # deletion -> term, or list of terms when several share it
+        self.terms = set()      # terms in the dictionary, including some no longer in the index
+        self.generation = None  # generation of the index the dictionary was updated to
+        self.build_lock = threading.Lock()
+
+    def variants(self, term):
+        """Returns the strings reachable by deleting up to max_distance characters from the term's prefix."""
+        level = {term[:self.prefix_length]}
+        variants = set(level)
+        for _ in range(self.max_distance):
+            level = {word[:i] + word[i + 1:] for word in level for i in range(len(word))}
+            variants |= level
+        return variants
+
+    def _add(self, term):
+        deletes = self.deletes
+        for variant in self.variants(term):
+            existing = deletes.get(variant)
+            if existing is None:
+                deletes[variant] = term
+            elif isinstance(existing, list):
+                existing.append(term)
+            else:
+                deletes[variant] = [existing, term]
+        self.terms.add(term)
+
+    def update(self):
+        """Bring the dictionary up to date with the index vocabulary."""
+        index = self.inverted_index
+        generation = index.generation
+        vocabulary = index.vocabulary()
+        stale = len(self.terms) - len(self.terms & vocabulary)
+        if stale > len(vocabulary) // 2:
+            self.deletes = {}
+            self.terms = set()
+        new_terms = vocabulary - self.terms
+        for term in new_terms:
+            self._add(term)
+        self.generation = generation
+        if new_terms:
+            logging.info(f"Fuzzy vocabulary updated with {len(new_terms)} terms, {len(self.deletes)} deletions.")
+
+    def ensure_built(self):
+        """Update the dictionary if the index changed since the last update."""
+        if self.generation != self.inverted_index.generation:
+            with self.build_lock:
+                if self.generation != self.inverted_index.generation:
+                    self.update()
+
+    def candidates(self, term):
+        """Returns {vocabulary term: edit distance} of the terms within max_distance edits of the term."""
+        self.ensure_built()
+        vocabulary = self.inverted_index.vocabulary()
+        found = {}
+        checked = set()
+        for variant in self.variants(term):
+            entry = self.deletes.get(variant)
+            if entry is None:
+                continue
+            for candidate in (entry if isinstance(entry, list) else (entry,)):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                if candidate not in vocabulary:
+                    continue
+                distance = edit_distance(term, candidate, self.max_distance)
+                if distance <= self.max_distance:
+                    found[candidate] = distance
+        return found
+
+    def best_match(self, term, scorer):
+        """Returns the (vocabulary term, score) nearest to the term by scorer(term, candidate), or None.
+
+        Ties go to the fewest edits, then the term found in the most documents.
+        """
+        found = self.candidates(term)
+        if not found:
+            return None
+        postings = self.inverted_index.postings
+        scored = [(scorer(term, candidate), -distance, len(postings.get(candidate, ())), candidate)
+                  for candidate, distance in found.items()]
+        score, _, _, match = max(scored)
+        return match, score
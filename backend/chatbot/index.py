@@ -0,0 +1,318 @@
+import gc
+import os
+import sys
+import json
+import logging
+from array import array
+from collections import namedtuple
+from contextlib import contextmanager
+from itertools import accumulate
+
+from .chunking import chunk_spans
+from .text import analyze
+
+
+@contextmanager
+def paused_garbage_collection():
+    """Pause the garbage collector while building many containers that all survive, like a loaded index.
+
+    Collections meanwhile would find nothing to free, yet rescan every object of the index each time.
+    """
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if collecting:
+            gc.enable()
+
+
+class InvertedIndex:
+    """Persistent inverted index mapping each term to its positions in every document, plus passage spans."""
+
+    FORMAT_VERSION = 3
+    COMPACT_AFTER = 256  # documents stored in segments before superseded ones may be compacted away
+
+    def __init__(self, index_dir):
+        """Prepare an empty index stored under index_dir."""
+        self.index_dir = index_dir
+        self.segments_dir = os.path.join(index_dir, "segments")
+        self.postings = {}     # term -> {document name -> array of character offsets, or a view of a loaded segment}
+        self.doc_terms = {}    # document name -> terms it contributes, for cheap removal
+        self.doc_lengths = {}  # document name -> number of indexed terms
+        self.chunks = {}       # document name -> [(start, end)] of its overlapping passages
+        self.generation = 0    # bumped on every change, so derived structures know when to rebuild
+        self.versions = {}     # document name -> generation it was last added at, for per-document updates
+        self.changed = set()   # documents added or replaced since the last checkpoint
+        self.removed = set()   # documents removed since the last checkpoint
+        self.rewrite = True    # whether the next segment replaces every saved one, e.g. after clear()
+        self.stored_documents = 0  # document entries in the saved segments, superseded ones included
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.doc_lengths
+
+    def clear(self):
+        """Drop every document from the index."""
+        self.postings = {}
+        self.doc_terms = {}
+        self.doc_lengths = {}
+        self.chunks = {}
+        self.versions = {}
+        self.generation += 1
+        self.changed, self.removed, self.rewrite = set(), set(), True
+
+    def add_document(self, doc_id, text, analysis=None):
+        """Index the cleaned text of a document, replacing any previous version.
+
+        analysis is the (term positions, passage spans) pair already computed by the ingestion
+        workers; without it the text is analyzed here.
+        """
+        self.remove_document(doc_id)
+
+        if analysis is not None:
+            positions, spans = analysis
+        else:
+            # Offsets are kept in typed arrays, 4 bytes each instead of a Python int object apiece
+            positions = {}
+            for term, offset in analyze(text):
+                offsets = positions.get(term)
+                if offsets is None:
+                    offsets = positions[term] = array('I')
+                offsets.append(offset)
+            spans = chunk_spans(text)
+
+        # Terms unpickled from an ingestion worker are new strings for every document; interned,
+        # all the term lists share the one string each, as after a load
+        terms = [sys.intern(term) for term in positions]
+        for term, offsets in zip(terms, positions.values()):
+            self.postings.setdefault(term, {})[doc_id] = offsets
+
+        self.doc_terms[doc_id] = terms
+        self.doc_lengths[doc_id] = sum(len(offsets) for offsets in positions.values())
+        self.chunks[doc_id] = spans
+        self.generation += 1
+        self.versions[doc_id] = self.generation
+        self.changed.add(doc_id)
+        self.removed.discard(doc_id)
+
+    def remove_document(self, doc_id):
+        """Remove a document's postings from the index."""
+        for term in self.doc_terms.pop(doc_id, ()):
+            term_postings = self.postings.get(term)
+            if term_postings is None:
+                continue
+            term_postings.pop(doc_id, None)
+            if not term_postings:
+                del self.postings[term]
+        self.chunks.pop(doc_id, None)
+        self.versions.pop(doc_id, None)
+        if self.doc_lengths.pop(doc_id, None) is not None:
+            self.generation += 1
+            self.changed.discard(doc_id)
+            self.removed.add(doc_id)
+
+    def lookup(self, term):
+        """Returns the postings {document name: array of offsets} for a stemmed term."""
+        return self.postings.get(term, {})
+
+    def vocabulary(self):
+        """Returns every term present in the index."""
+        return self.postings.keys()
+
+    def checkpoint(self):
+        """Returns the changes since the last checkpoint, for write_segment, and starts recording anew.
+
+        Only references to the changed documents' postings are taken, which is cheap, so this is
+        the part of a save to run under the index lock; the postings are never modified in place,
+        so write_segment may serialize them after the lock is released. Returns None when there
+        is nothing to write.
+        """
+        if not (self.changed or self.removed or self.rewrite):
+            return None
+        documents = []
+        for doc_id in (self.doc_lengths if self.rewrite else self.changed):
+            terms = self.doc_terms[doc_id]
+            documents.append((doc_id, self.doc_lengths[doc_id], self.chunks[doc_id],
+                              terms, [self.postings[term][doc_id] for term in terms]))
+        changes = IndexChanges(documents, sorted(self.removed), self.rewrite, len(self))
+        self.changed, self.removed, self.rewrite = set(), set(), False
+        return changes
+
+    def save(self):
+        """Write the changes since the last save to disk. Call with the index locked against writers."""
+        self.write_segment(self.checkpoint())
+
+    def restore(self, changes):
+        """Hand back the changes of a checkpoint that could not be written, so the next save writes them.
+
+        The next segment then holds the whole index, rather than these changes merged with the
+        ones made since.
+        """
+        if changes is not None:
+            self.rewrite = True
+
+    def write_segment(self, changes):
+        """Append the changes taken by checkpoint() to the saved index as a new segment.
+
+        A segment holds the postings of the documents added or changed, and the names of those
+        removed, so a save costs as much as what changed rather than the whole index. Loading
+        replays the segments in order. A checkpoint after clear(), or segments mostly made of
+        superseded documents, start a new base segment that earlier ones are deleted for.
+        Concurrent calls must be serialized by the caller.
+        """
+        if changes is None:
+            return
+        os.makedirs(self.segments_dir, exist_ok=True)
+        number = self._write_segment(changes.documents, changes.removed, base=changes.base)
+        if changes.base:
+            self._drop_segments_before(number)
+            self.stored_documents = 0
+        self.stored_documents += len(changes.documents) + len(changes.removed)
+        logging.info(f"Saved {len(changes.documents)} changed and {len(changes.removed)} removed documents "
+                     f"to inverted index segment {number}.")
+
+        # Superseded and removed documents are only dropped from disk by rewriting the segments
+        if self.stored_documents > max(2 * changes.live_documents, self.COMPACT_AFTER):
+            self.compact()
+
+    def compact(self):
+        """Rewrite the saved segments as one base segment holding only the live documents.
+
+        Works from the files alone, so the in-memory index needs no lock. Concurrent calls must
+        be serialized by the caller, like write_segment.
+        """
+        documents = self._read_segments()
+        if documents is None:
+            return
+        number = self._write_segment([(doc_id, *entry) for doc_id, entry in documents.items()], [], base=True)
+        self._drop_segments_before(number)
+        self.stored_documents = len(documents)
+        logging.info(f"Compacted inverted index to segment {number} with {len(documents)} documents.")
+
+    def load(self):
+        """Load the index from disk. Returns False if no usable index exists."""
+        with paused_garbage_collection():
+            return self._load()
+
+    def _load(self):
+        documents = self._read_segments()
+        if documents is None:
+            return False
+
+        self.clear()
+        # Terms and document names are interned, so every posting shares one string of each
+        postings = self.postings
+        for doc_id, (length, spans, terms, offsets) in documents.items():
+            doc_id = sys.intern(doc_id)
+            for term, term_offsets in zip(terms, offsets):
+                term_postings = postings.get(term)
+                if term_postings is None:
+                    term_postings = postings[term] = {}
+                term_postings[doc_id] = term_offsets
+            self.doc_terms[doc_id] = terms
+            self.doc_lengths[doc_id] = length
+            self.chunks[doc_id] = spans
+        self.versions = dict.fromkeys(self.doc_lengths, self.generation)
+        self.changed, self.removed, self.rewrite = set(), set(), False
+        logging.info(f"Loaded inverted index with {len(self)} documents from '{self.segments_dir}'.")
+        return True
+
+    def _segment_numbers(self):
+        # Numbers of the complete segments, in order; a segment is complete once its header exists
+        try:
+            names = os.listdir(self.segments_dir)
+        except FileNotFoundError:
+            return []
+        return sorted(int(name[:-5]) for name in names if name.endswith(".json") and name[:-5].isdigit())
+
+    def _segment_path(self, number, extension):
+        return os.path.join(self.segments_dir, f"{number:08d}.{extension}")
+
+    def _write_segment(self, documents, removed, base):
+        # The offsets of all documents go to one .bin file, then the header naming them is put
+        # in place atomically, which makes the segment part of the index
+        numbers = self._segment_numbers()
+        number = numbers[-1] + 1 if numbers else 1
+        # Each distinct term is written once; documents list the numbers of their terms
+        term_ids, entries, offsets = {}, [], []
+        for doc_id, length, spans, doc_terms, doc_offsets in documents:
+            ids = [term_ids.setdefault(term, len(term_ids)) for term in doc_terms]
+            entries.append([doc_id, length, [list(span) for span in spans], ids, [len(o) for o in doc_offsets]])
+            offsets.extend(doc_offsets)
+        header = {
+            "version": self.FORMAT_VERSION,
+            "base": base,
+            "terms": list(term_ids),
+            "documents": entries,
+            "removed": removed,
+        }
+
+        # The offsets are uint32 buffers, joined as raw bytes without converting each one
+        with open(self._segment_path(number, "bin"), 'wb') as f:
+            f.write(b"".join(offsets))
+        tmp_path = os.path.join(self.segments_dir, f".{number:08d}.json.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(header, separators=(',', ':')))  # dumps encodes in C, dump in Python
+        os.replace(tmp_path, self._segment_path(number, "json"))
+        return number
+
+    def _drop_segments_before(self, number):
+        for earlier in self._segment_numbers():
+            if earlier < number:
+                for extension in ("json", "bin"):
+                    try:
+                        os.remove(self._segment_path(earlier, extension))
+                    except FileNotFoundError:
+                        pass
+
+    def _read_segments(self):
+        # Replays the segments from the last base one on. Returns {document name: (length, spans,
+        # terms, offsets of each term)}, or None if there are no usable segments
+        numbers = self._segment_numbers()
+        if not numbers:
+            return None
+        documents = {}
+        try:
+            headers = []
+            for number in numbers:
+                with open(self._segment_path(number, "json"), 'r', encoding='utf-8') as f:
+                    header = json.load(f)
+                if header.get("version") != self.FORMAT_VERSION:
+                    logging.warning(f"Ignoring inverted index segment {number} with unknown format version.")
+                    return None
+                if header["base"]:
+                    headers = []
+                headers.append((number, header))
+
+            self.stored_documents = 0
+            for number, header in headers:
+                # Offsets are used in place, as slices of the segment's buffer
+                with open(self._segment_path(number, "bin"), 'rb') as f:
+                    offsets = memoryview(f.read()).cast('I')
+                terms = [sys.intern(term) for term in header["terms"]]
+                position = 0
+                for doc_id in header["removed"]:
+                    documents.pop(doc_id, None)
+                for doc_id, length, spans, term_ids, counts in header["documents"]:
+                    bounds = list(accumulate(counts, initial=position))
+                    position = bounds[-1]
+                    documents[doc_id] = (length, [tuple(span) for span in spans],
+                                         list(map(terms.__getitem__, term_ids)),
+                                         [offsets[first:last] for first, last in zip(bounds, bounds[1:])])
+                self.stored_documents += len(header["documents"]) + len(header["removed"])
+            return documents
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.error(f"Error loading inverted index segments from '{self.segments_dir}': {e}")
+            return None
+
+
+class IndexChanges(namedtuple("IndexChanges", ["documents", "removed", "base", "live_documents"])):
+    """Changes to an inverted index taken by InvertedIndex.checkpoint, to be written as a segment.
+
+    documents holds (name, length, passage spans, terms, offsets of each term) tuples of the
+    documents added or changed, removed the names of those removed, base tells whether the
+    segment replaces all earlier ones, and live_documents is the size of the index at the time.
+    """
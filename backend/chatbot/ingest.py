@@ -0,0 +1,194 @@
+import os
+import time
+import logging
+from array import array
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from .chunking import chunk_spans
+from .metrics import observe_span
+from .parsing import iter_document_parts, clean_text, UnsupportedFormatError
+from .text import analyze, load_stemmer
+
+# Outcome of ingesting one file: the cleaned text and its (term positions, passage spans),
+# or None and the reason it failed, plus the seconds spent parsing, cleaning and analyzing
+IngestResult = namedtuple("IngestResult", ["file_path", "cleaned_text", "error", "analysis", "timings"],
+                          defaults=[None, None])
+
+
+def parse_and_clean(file_path):
+    """Parse, clean and analyze one file. Runs inside a worker process.
+
+    Returns (cleaned_text, error, analysis, timings). Pages or paragraphs stream through
+    cleaning and tokenizing one at a time, so only the cleaned text and term positions grow
+    with the document, never several raw copies of it. The worker cannot record metrics
+    itself, so the time spent in each stage is returned for the pipeline to record.
+    """
+    parts = []
+    positions = {}  # term -> array of character offsets in the cleaned text
+    length = 0
+    timings = {"parse": 0.0, "clean": 0.0, "analyze": 0.0}
+    lap = time.perf_counter()
+    try:
+        for raw_part in iter_document_parts(file_path):
+            now = time.perf_counter()
+            timings["parse"] += now - lap
+            lap = now
+
+            part = clean_text(raw_part)
+            now = time.perf_counter()
+            timings["clean"] += now - lap
+            lap = now
+            if not part:
+                continue
+            if parts:
+                length += 1  # the space the parts are joined with
+
+            for term, offset in analyze(part):
+                offsets = positions.get(term)
+                if offsets is None:
+                    offsets = positions[term] = array('I')
+                offsets.append(length + offset)
+
+            parts.append(part)
+            length += len(part)
+            now = time.perf_counter()
+            timings["analyze"] += now - lap
+            lap = now
+    except UnsupportedFormatError:
+        return None, "Unsupported file format.", None, None
+    except Exception as e:
+        timings["parse"] += time.perf_counter() - lap
+        return None, f"Error parsing document: {e}", None, timings
+
+    if not parts:
+        return None, "No text could be extracted.", None, timings
+
+    cleaned_text = " ".join(parts)
+    del parts
+    analysis = (positions, chunk_spans(cleaned_text))
+    timings["analyze"] += time.perf_counter() - lap
+    logging.debug(f"Parsed and cleaned '{file_path}' ({len(cleaned_text)} characters).")
+    return cleaned_text, None, analysis, timings
+
+
+class IngestionPipeline:
+    """Fans document parsing and cleaning out across a pool of worker processes."""
+
+    def __init__(self, max_workers=None, timeout=120, progress_every=100):
+        """Set up the pipeline. With max_workers=0 files are parsed inline, without a pool or timeouts."""
+        self.max_workers = (os.cpu_count() or 1) if max_workers is None else max_workers
+        self.timeout = timeout                # seconds one file may take before it is abandoned
+        self.progress_every = progress_every  # log progress every N files
+        self.executor = None
+
+    def _get_executor(self):
+        # The pool is started on first use and kept for later batches and single uploads
+        if self.executor is None:
+            # Workers are forked: a fork while another thread is importing NLTK copies its locks held
+            # by a thread the worker does not have, so the worker's first stem would wait forever
+            load_stemmer()
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self.executor
+
+    def _reset_executor(self):
+        """Kill the worker processes, after a hang or a crash, so work continues on a fresh pool."""
+        executor, self.executor = self.executor, None
+        if executor is None:
+            return
+
+        # A hung parser never returns, so its process has to be terminated
+        processes = list((getattr(executor, '_processes', None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    def close(self):
+        """Shut the worker pool down."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def run(self, file_paths, progress=None):
+        """Parses and cleans files in parallel, yielding an IngestResult per file as soon as it completes.
+
+        A file that exceeds the timeout or crashes its worker fails on its own; the other files
+        in flight are retried on a fresh pool. progress(done, total, result) is called per file.
+        """
+        file_paths = list(file_paths)
+        total = len(file_paths)
+        done = 0
+
+        for result in self._run_inline(file_paths) if self.max_workers <= 0 else self._run_pool(file_paths):
+            done += 1
+            for stage, seconds in (result.timings or {}).items():
+                observe_span(stage, seconds, "error" if result.error else "ok")
+            if result.error:
+                logging.error(f"Failed to ingest '{result.file_path}': {result.error}")
+            if progress:
+                progress(done, total, result)
+            if done % self.progress_every == 0 or done == total:
+                logging.info(f"Ingested {done}/{total} documents.")
+            yield result
+
+    def _run_inline(self, file_paths):
+        for file_path in file_paths:
+            yield IngestResult(file_path, *parse_and_clean(file_path))
+
+    def _run_pool(self, file_paths):
+        queue = deque(file_paths)
+        suspects = deque()  # files in flight when a worker crashed, retried one at a time
+        running = {}        # future -> (file path, deadline, whether it ran alone)
+
+        while queue or suspects or running:
+            # Step 1: Keep one file per worker in flight, so a deadline starts close to when parsing does.
+            # Suspects run alone, so a crash can be pinned on the file that caused it.
+            if suspects:
+                if not running:
+                    self._submit(running, suspects.popleft(), isolated=True)
+            else:
+                while queue and len(running) < self.max_workers:
+                    self._submit(running, queue.popleft(), isolated=False)
+
+            next_deadline = min(deadline for _, deadline, _ in running.values())
+            finished, _ = wait(running, timeout=max(0, next_deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+
+            # Step 2: Collect finished files
+            pool_broken = False
+            for future in finished:
+                file_path, _, isolated = running.pop(future)
+                try:
+                    yield IngestResult(file_path, *future.result())
+                except BrokenProcessPool:
+                    pool_broken = True
+                    if isolated:
+                        yield IngestResult(file_path, None, "The parser crashed on this file.")
+                    else:
+                        suspects.append(file_path)
+                except Exception as e:
+                    yield IngestResult(file_path, None, f"Error during ingestion: {e}")
+
+            # Step 3: Abandon files past their deadline
+            now = time.monotonic()
+            expired = [future for future, (_, deadline, _) in running.items() if deadline <= now]
+            for future in expired:
+                file_path, _, _ = running.pop(future)
+                yield IngestResult(file_path, None, f"Parsing timed out after {self.timeout} seconds.")
+
+            # Step 4: Replace a pool with hung or dead workers, requeueing the files that were still fine
+            if expired or pool_broken:
+                for file_path, _, isolated in running.values():
+                    (suspects if isolated else queue).appendleft(file_path)
+                running = {}
+                self._reset_executor()
+
+    def _submit(self, running, file_path, isolated):
+        try:
+            future = self._get_executor().submit(parse_and_clean, file_path)
+        except (BrokenProcessPool, RuntimeError):
+            # The pool died between batches, so start a new one
+            self._reset_executor()
+            future = self._get_executor().submit(parse_and_clean, file_path)
+        running[future] = (file_path, time.monotonic() + self.timeout, isolated)
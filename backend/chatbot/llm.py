@@ -0,0 +1,324 @@
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+from functools import cached_property
+
+from .metrics import CallbackMetric
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the LLM while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Stops calls to a failing service for a while, then lets one probe call through to test it.
+
+    Closed: calls go through, and failure_threshold consecutive failures open the circuit.
+    Open: calls fail at once with CircuitOpenError for reset_timeout seconds.
+    Half open: a single probe goes through; its success closes the circuit, its failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0      # consecutive failures while closed
+        self.opened_at = 0.0
+        self.probing = False   # a half-open probe is in flight
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through now."""
+        with self.lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    raise CircuitOpenError("LLM circuit breaker is open")
+                self.state = self.HALF_OPEN
+                self.probing = False
+            if self.state == self.HALF_OPEN:
+                if self.probing:
+                    raise CircuitOpenError("LLM circuit breaker is half open, waiting for the probe call")
+                self.probing = True
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                logging.info("LLM circuit breaker closed.")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def abandon_call(self):
+        """Forget a call that ended without an outcome, e.g. cancelled, so another probe may go through."""
+        with self.lock:
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logging.warning(f"LLM circuit breaker opened after {self.failures} failures.")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class SingleFlight:
+    """Runs one call per key at a time; callers arriving while it is in flight share its result."""
+
+    def __init__(self):
+        self.calls = {}  # key -> Future of the call in flight, or (event loop, key) -> asyncio task
+        self.lock = threading.Lock()
+        self.coalesced = 0  # calls answered by another caller's request
+
+    def do(self, key, func):
+        """Returns func(), or the result of the identical call already in flight."""
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+    async def do_async(self, key, func):
+        """Returns await func(), or the result of the identical call already in flight on this event loop."""
+        loop = asyncio.get_running_loop()
+        key = (loop, key)  # a task can only be awaited on its own loop
+        with self.lock:
+            task = self.calls.get(key)
+            if task is None:
+                # The call runs as its own task, so cancelling the caller that started it leaves it running for the others
+                task = self.calls[key] = asyncio.ensure_future(func())
+                task.add_done_callback(lambda done: self._finish_async(key, done))
+            else:
+                self.coalesced += 1
+        # Shielded, so a caller giving up does not cancel the call for everyone else
+        return await asyncio.shield(task)
+
+    def _finish_async(self, key, task):
+        with self.lock:
+            del self.calls[key]
+        if not task.cancelled():
+            task.exception()  # nobody may be waiting for it, so its exception counts as retrieved
+
+
+def is_retryable(error):
+    """True for errors worth retrying: timeouts, dropped connections, rate limits and server errors."""
+    import groq
+
+    if isinstance(error, groq.APIConnectionError):  # includes APITimeoutError
+        return True
+    return isinstance(error, groq.APIStatusError) and (error.status_code in (408, 409, 429) or error.status_code >= 500)
+
+
+class LLMGateway:
+    """The one way to the Groq API: pooled keep-alive connections, timeouts, jittered retries,
+    a circuit breaker, and single-flight coalescing of identical completions.
+
+    The Groq clients are created on first use, so importing and constructing stay fast and offline.
+    """
+
+    def __init__(self, api_key=None, timeout=30.0, connect_timeout=5.0, max_retries=2, backoff=0.5, max_backoff=8.0,
+                 max_connections=20, max_keepalive_connections=10, keepalive_expiry=30.0,
+                 failure_threshold=5, reset_timeout=30.0):
+        """Prepare the gateway.
+
+        timeout bounds each attempt in seconds, connect_timeout the connection set-up. A failed
+        attempt is retried up to max_retries times after a random wait of up to backoff * 2**attempt
+        seconds, capped at max_backoff, or after the Retry-After the API asked for. Only errors
+        is_retryable accepts are retried and count towards failure_threshold.
+        """
+        self.api_key = api_key
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.single_flight = SingleFlight()
+        self.counters = {"calls": 0, "retries": 0, "failures": 0, "rejected": 0}
+        self.counters_lock = threading.Lock()
+
+    def _client_options(self):
+        import httpx
+
+        limits = httpx.Limits(max_connections=self.max_connections,
+                              max_keepalive_connections=self.max_keepalive_connections,
+                              keepalive_expiry=self.keepalive_expiry)
+        options = {
+            "api_key": self.api_key or os.environ.get("GROQ_API_KEY"),
+            "timeout": httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            "max_retries": 0,  # retried here, under the circuit breaker
+        }
+        return options, limits
+
+    @cached_property
+    def client(self):
+        """The Groq client, sharing one connection pool across threads."""
+        from groq import Groq, DefaultHttpxClient
+
+        options, limits = self._client_options()
+        return Groq(http_client=DefaultHttpxClient(limits=limits), **options)
+
+    @cached_property
+    def async_client(self):
+        """The asyncio Groq client, sharing one connection pool across coroutines."""
+        from groq import AsyncGroq, DefaultAsyncHttpxClient
+
+        options, limits = self._client_options()
+        return AsyncGroq(http_client=DefaultAsyncHttpxClient(limits=limits), **options)
+
+    def _count(self, name):
+        with self.counters_lock:
+            self.counters[name] += 1
+
+    def _retry_delay(self, attempt, error):
+        """Seconds to wait before retrying after a failed attempt (0 for the first one)."""
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        response = getattr(error, "response", None)
+        try:
+            retry_after = float(response.headers.get("retry-after"))
+            delay = max(delay, min(retry_after, self.max_backoff))
+        except (AttributeError, TypeError, ValueError):
+            pass
+        return delay
+
+    def _before_attempt(self):
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            self._count("rejected")
+            raise
+        self._count("calls")
+
+    def _after_failure(self, attempt, error):
+        """Record a failed attempt. Returns the seconds to wait before retrying, or None to give up."""
+        if not is_retryable(error):
+            self.breaker.record_success()  # the API answered; the request itself was at fault
+            return None
+        self.breaker.record_failure()
+        self._count("failures")
+        if attempt >= self.max_retries:
+            return None
+        self._count("retries")
+        logging.warning(f"Groq call failed ({type(error).__name__}: {error}), retry {attempt + 1} of {self.max_retries}.")
+        return self._retry_delay(attempt, error)
+
+    def call(self, func):
+        """Run func() under the circuit breaker, retrying retryable errors."""
+        attempt = 0
+        while True:
+            self._before_attempt()
+            try:
+                result = func()
+            except Exception as e:
+                delay = self._after_failure(attempt, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+            except BaseException:
+                self.breaker.abandon_call()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+
+    async def call_async(self, func):
+        """Async version of call, for a func returning an awaitable."""
+        attempt = 0
+        while True:
+            self._before_attempt()
+            try:
+                result = await func()
+            except Exception as e:
+                delay = self._after_failure(attempt, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+            except BaseException:
+                self.breaker.abandon_call()  # cancelled, so a half-open probe must not stay in flight forever
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+
+    @staticmethod
+    def request_key(messages, model):
+        """Identifies a completion request, so identical concurrent requests can share one call."""
+        payload = json.dumps([model, messages], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def complete(self, messages, model):
+        """Returns the text of the chat completion, sharing the call with identical requests in flight."""
+        def create():
+            completion = self.call(lambda: self.client.chat.completions.create(messages=messages, model=model))
+            return completion.choices[0].message.content
+
+        return self.single_flight.do(self.request_key(messages, model), create)
+
+    async def complete_async(self, messages, model):
+        """Async version of complete."""
+        async def create():
+            completion = await self.call_async(
+                lambda: self.async_client.chat.completions.create(messages=messages, model=model))
+            return completion.choices[0].message.content
+
+        return await self.single_flight.do_async(self.request_key(messages, model), create)
+
+    def stream(self, messages, model):
+        """Starts a streamed chat completion and returns its chunk iterator.
+
+        Only starting the stream is retried; streams are never shared, since each caller reads its own.
+        """
+        return self.call(lambda: self.client.chat.completions.create(messages=messages, model=model, stream=True))
+
+    async def stream_async(self, messages, model):
+        """Async version of stream, returning an async chunk iterator."""
+        return await self.call_async(
+            lambda: self.async_client.chat.completions.create(messages=messages, model=model, stream=True))
+
+    def register_metrics(self, registry):
+        """Expose call, retry and coalescing counters and the breaker state in a metrics registry."""
+        def counters():
+            with self.counters_lock:
+                return dict(self.counters, coalesced=self.single_flight.coalesced)
+
+        states = (CircuitBreaker.CLOSED, CircuitBreaker.HALF_OPEN, CircuitBreaker.OPEN)
+        for metric in (
+            CallbackMetric("inbot_llm_events_total",
+                           "Groq API attempts, retries, retryable failures, calls refused by the open circuit "
+                           "and calls coalesced into an identical one in flight.",
+                           counters, labelnames=("event",), kind="counter"),
+            CallbackMetric("inbot_llm_circuit_state", "Groq circuit breaker state: 0 closed, 1 half open, 2 open.",
+                           lambda: states.index(self.breaker.state)),
+        ):
+            registry.register(metric)
@@ -0,0 +1,73 @@
+import threading
+from contextlib import contextmanager
+
+
+class ReadWriteLock:
+    """Lets many readers share the index while a writer gets exclusive access.
+
+    Waiting writers block new readers, so a stream of searches cannot starve indexing.
+    Both sides are re-entrant, and the writing thread may also read, which keeps nested
+    index calls simple.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0           # threads currently reading
+        self.writer = None         # thread currently writing
+        self.writer_depth = 0      # re-entrant acquisitions by the writer
+        self.waiting_writers = 0
+        self.local = threading.local()  # per-thread read depth
+
+    @contextmanager
+    def read_lock(self):
+        """Hold the lock for reading."""
+        depth = getattr(self.local, 'depth', 0)
+        if depth or self.writer is threading.current_thread():
+            # Nested reads, and reads by the writer, already hold the lock
+            self.local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self.local.depth = depth
+            return
+
+        with self.condition:
+            while self.writer is not None or self.waiting_writers:
+                self.condition.wait()
+            self.readers += 1
+        self.local.depth = 1
+        try:
+            yield
+        finally:
+            self.local.depth = 0
+            with self.condition:
+                self.readers -= 1
+                if not self.readers:
+                    self.condition.notify_all()
+
+    def reading(self):
+        """True if the current thread holds the lock for reading, and so cannot take it for writing."""
+        return getattr(self.local, 'depth', 0) > 0 and self.writer is not threading.current_thread()
+
+    @contextmanager
+    def write_lock(self):
+        """Hold the lock for writing."""
+        current = threading.current_thread()
+        with self.condition:
+            if self.writer is current:
+                self.writer_depth += 1
+            else:
+                self.waiting_writers += 1
+                while self.writer is not None or self.readers:
+                    self.condition.wait()
+                self.waiting_writers -= 1
+                self.writer = current
+                self.writer_depth = 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writer_depth -= 1
+                if not self.writer_depth:
+                    self.writer = None
+                    self.condition.notify_all()
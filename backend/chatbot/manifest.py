@@ -0,0 +1,113 @@
+import os
+import json
+import hashlib
+import logging
+
+
+class DocumentManifest:
+    """Records every processed document with its path, mtime, size and content hash."""
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, manifest_path):
+        """Prepare an empty manifest stored at manifest_path."""
+        self.manifest_path = manifest_path
+        self.entries = {}  # document name -> {"path", "mtime_ns", "size", "sha256", "indexed"}
+        self.owners = {}   # document name -> id of the user it belongs to; documents without one are shared
+
+    def __contains__(self, file_name):
+        return file_name in self.entries
+
+    def clear(self):
+        """Forget every document."""
+        self.entries = {}
+        self.owners = {}
+
+    def names(self):
+        """Returns the names of every document in the manifest."""
+        return list(self.entries)
+
+    def get(self, file_name):
+        """Returns the manifest entry of a document, or None."""
+        return self.entries.get(file_name)
+
+    def is_unchanged(self, file_name, stat):
+        """Checks whether a file still has the mtime and size recorded for it."""
+        entry = self.entries.get(file_name)
+        return bool(entry) and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size
+
+    def record(self, file_name, file_path, stat, digest, indexed):
+        """Store the current state of a processed document."""
+        self.entries[file_name] = {
+            "path": file_path,
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": digest,
+            "indexed": indexed,
+        }
+
+    def remove(self, file_name):
+        """Forget a document and its owner. Returns its last entry, or None."""
+        self.owners.pop(file_name, None)
+        return self.entries.pop(file_name, None)
+
+    def owner(self, file_name):
+        """Returns the id of the user a document belongs to, or None if it is shared."""
+        return self.owners.get(file_name)
+
+    def set_owner(self, file_name, owner):
+        """Record the user a document belongs to, possibly before it is indexed; None makes it shared."""
+        if owner is None:
+            self.owners.pop(file_name, None)
+        else:
+            self.owners[file_name] = owner
+
+    def copy(self):
+        """Returns a copy to save while this manifest goes on changing. Entries are replaced, never modified."""
+        manifest = DocumentManifest(self.manifest_path)
+        manifest.entries = dict(self.entries)
+        manifest.owners = dict(self.owners)
+        return manifest
+
+    def save(self):
+        """Write the manifest to disk atomically."""
+        os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+        payload = {"version": self.FORMAT_VERSION, "documents": self.entries, "owners": self.owners}
+
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def load(self):
+        """Load the manifest from disk. Returns False if no usable manifest exists."""
+        self.entries = {}
+        self.owners = {}
+        if not os.path.exists(self.manifest_path):
+            return False
+
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+
+            if payload.get("version") != self.FORMAT_VERSION:
+                logging.warning(f"Ignoring manifest '{self.manifest_path}' with unknown format version.")
+                return False
+
+            self.entries = payload["documents"]
+            self.owners = payload["owners"]
+            return True
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f"Error loading manifest '{self.manifest_path}': {e}")
+            self.entries = {}
+            self.owners = {}
+            return False
+
+    @staticmethod
+    def file_digest(file_path, chunk_size=1024 * 1024):
+        """Computes the SHA-256 of a file without reading it into memory at once."""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
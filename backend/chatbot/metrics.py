@@ -0,0 +1,180 @@
+import time
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+# Upper bounds, in seconds, of the latency histogram buckets: 0.5 ms up to 60 s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Latency histogram with labels, rendered in the Prometheus text format."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """Create a histogram; observations are counted per combination of label values."""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        """Record one observation under the given label values."""
+        bucket = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labelvalues)
+            if series is None:
+                series = self.series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bucket] += 1
+            series[-1] += value
+
+    def collect(self):
+        """Yields the lines of the histogram in the Prometheus text format."""
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self.lock:
+            series = {labelvalues: list(counts) for labelvalues, counts in self.series.items()}
+        for labelvalues, counts in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, [("le", _format_value(bound))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {_format_value(counts[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class CallbackMetric:
+    """Gauge or counter whose value is read from a function each time the metrics are rendered.
+
+    func returns a number, or {label value or tuple of label values: number} when the
+    metric has labels. Values that already live elsewhere, such as index sizes or cache
+    counters, are exposed this way without keeping a second copy up to date.
+    """
+
+    def __init__(self, name, documentation, func, labelnames=(), kind="gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+
+    def collect(self):
+        """Yields the lines of the metric in the Prometheus text format."""
+        try:
+            values = self.func()
+        except Exception as e:
+            logging.error(f"Error collecting metric {self.name}: {e}")
+            return
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labelvalues, value in values.items():
+            if not isinstance(labelvalues, tuple):
+                labelvalues = (labelvalues,)
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"
+
+
+class MetricsRegistry:
+    """The set of metrics exposed at /metrics."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric, replacing any earlier one of the same name. Returns the metric."""
+        with self.lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = [line for metric in metrics for line in metric.collect()]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Every timed operation: parsing, cleaning, searching, Groq calls, storage I/O, DB queries...
+SPAN_SECONDS = REGISTRY.register(Histogram(
+    "inbot_span_seconds", "Duration of instrumented operations.", labelnames=("span", "outcome")))
+
+# Whole HTTP requests, so the spans can be put in proportion
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "inbot_http_request_seconds", "Duration of HTTP requests.", labelnames=("method", "route", "status")))
+
+span_logger = logging.getLogger("inbot.spans")
+
+
+def observe_span(name, seconds, outcome="ok"):
+    """Record the duration of an operation that was timed elsewhere, e.g. in an ingestion worker."""
+    SPAN_SECONDS.observe(seconds, name, outcome)
+    if span_logger.isEnabledFor(logging.DEBUG):
+        span_logger.debug("span", extra={"span": name, "seconds": seconds, "outcome": outcome})
+
+
+@contextmanager
+def span(name):
+    """Time the enclosed block as the operation name; an exception counts it with outcome 'error'."""
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        observe_span(name, time.perf_counter() - started, outcome)
+
+
+def timed(name):
+    """Decorator timing every call of a function as the operation name."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_engine(engine):
+    """Time every query an SQLAlchemy engine runs as the 'db.query' span."""
+    from sqlalchemy import event
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("inbot_query_started", []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        observe_span("db.query", time.perf_counter() - conn.info["inbot_query_started"].pop())
+
+    def handle_error(context):
+        started = context.connection.info.get("inbot_query_started") if context.connection is not None else None
+        if started:
+            observe_span("db.query", time.perf_counter() - started.pop(), "error")
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
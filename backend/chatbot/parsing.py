@@ -0,0 +1,114 @@
+import os
+import re
+import logging
+
+# Messages returned by parse_document instead of text when a file cannot be read
+PARSE_FAILURE_PREFIXES = ("Error", "Unsupported file format")
+
+
+def is_parse_failure(parsed_text):
+    """Checks whether parse_document failed, judging by its return value."""
+    return not parsed_text or parsed_text.startswith(PARSE_FAILURE_PREFIXES)
+
+
+# PDF pages and DOCX paragraphs are parsed one at a time; TXT files are read in blocks of this many characters
+TXT_BLOCK_SIZE = 1 << 20
+
+# Bullet characters, which the cleaner turns into '-'
+BULLETS = frozenset("•●")
+
+# Words of cleaned text: a bullet on its own, or a run of non-space characters that ends
+# before the next '.', ',', '!', '?' or '%', which start words of their own
+CLEAN_WORD_PATTERN = re.compile(r"[•●]|[^\s•●][^\s•●.,!?%]*")
+
+
+class UnsupportedFormatError(ValueError):
+    """Raised for files that are not PDF, DOCX or TXT."""
+
+
+def iter_document_parts(file_path):
+    """Yields the raw text of a document piece by piece: PDF pages, DOCX paragraphs or blocks of a TXT file.
+
+    Pieces end at whitespace in the document, so joining them with spaces only changes whitespace.
+    Raises UnsupportedFormatError for other file types.
+    """
+    ext = os.path.splitext(file_path)[1].lower()  # Get file extension
+
+    if ext == ".pdf":
+        # The parser libraries are imported only when a file needs them
+        import PyPDF2
+        with open(file_path, 'rb') as f:
+            reader = PyPDF2.PdfReader(f)
+            for page in reader.pages:
+                yield page.extract_text()
+                # Forget the objects parsed for this page, so memory does not grow with the page count
+                reader.resolved_objects.clear()
+
+    elif ext == ".docx":
+        from docx import Document
+        for para in Document(file_path).paragraphs:
+            yield para.text
+
+    elif ext == ".txt":
+        with open(file_path, 'r') as f:
+            tail = ""
+            for block in iter(lambda: f.read(TXT_BLOCK_SIZE), ''):
+                block = tail + block
+
+                # Hold a word cut off at the end of the block back for the next one
+                cut = len(block)
+                while cut and not block[cut - 1].isspace():
+                    cut -= 1
+                if not cut:
+                    cut = len(block)
+                tail = block[cut:]
+                yield block[:cut]
+            if tail:
+                yield tail
+
+    else:
+        raise UnsupportedFormatError(f"Unsupported file format for '{file_path}'.")
+
+
+def parse_document(file_path):
+    """Parses the text from PDF, DOCX, and TXT files."""
+    ext = os.path.splitext(file_path)[1].lower()  # Get file extension
+
+    try:
+        if ext == ".txt":
+            # Parse TXT file
+            with open(file_path, 'r') as f:
+                text = f.read()
+        else:
+            text = " ".join(iter_document_parts(file_path))
+        logging.debug(f"Successfully parsed {ext[1:].upper()} document '{file_path}'.")
+        return text
+
+    except UnsupportedFormatError:
+        logging.warning(f"Unsupported file format for '{file_path}'.")
+        return "Unsupported file format."
+
+    except Exception as e:
+        logging.error(f"Error parsing document '{file_path}': {e}")
+        return f"Error parsing document: {e}"
+
+
+def clean_text(text):
+    """Lowercases text, turns bullets into '-', splits punctuation off words and collapses whitespace.
+
+    Everything happens in one regex pass, and the result of cleaning pieces of a document
+    joined with spaces is the same as cleaning the whole document.
+    """
+    return " ".join("-" if word in BULLETS else word for word in CLEAN_WORD_PATTERN.findall(text.lower()))
+
+
+def clean_parsed_text(text):
+    """Cleans the parsed text by improving readability."""
+    try:
+        cleaned_text = clean_text(text)
+        logging.debug("Text cleaned successfully.")
+        return cleaned_text
+
+    except Exception as e:
+        logging.error(f"Error cleaning text: {e}")
+        return f"Error cleaning text: {e}"
@@ -0,0 +1,129 @@
+import os
+import sys
+import time
+import logging
+import threading
+from collections import Counter
+
+
+class SamplingProfiler:
+    """Statistical profiler that samples the stacks of every thread from a background thread.
+
+    Nothing is hooked into the code being profiled, so it costs one stack walk per thread
+    per interval while running and nothing at all while stopped. Samples are aggregated as
+    collapsed stacks ("outer;inner;leaf count"), the input format of flame graph tools.
+    """
+
+    MIN_INTERVAL, MAX_INTERVAL = 0.001, 1.0
+    OTHER_STACKS = ("[other stacks]",)  # where samples go once max_stacks distinct stacks are kept
+
+    def __init__(self, interval=0.01, max_depth=64, max_stacks=10000, max_labels=10000):
+        """Prepare a profiler taking a sample every interval seconds; start() begins sampling.
+
+        The interval is clamped to 1 ms..1 s. At most max_stacks distinct stacks and max_labels
+        frame labels are kept, so a long run over generated code cannot grow without bound.
+        """
+        self.interval = self._clamp(interval)
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+        self.max_labels = max_labels
+        self.stacks = Counter()  # tuple of frame labels, outermost first -> samples
+        self.samples = 0
+        self.started_at = None
+        self.sampling_seconds = 0.0  # time spent taking samples, i.e. the profiler's own overhead
+        self.labels = {}  # code object -> "function (file:line)"
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    @classmethod
+    def _clamp(cls, interval):
+        return min(max(interval, cls.MIN_INTERVAL), cls.MAX_INTERVAL)
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, interval=None):
+        """Start sampling, or change the interval of a running profiler."""
+        if interval:
+            self.interval = self._clamp(interval)
+        if self.running:
+            return
+        self.stopped.clear()
+        self.started_at = time.time()
+        self.thread = threading.Thread(target=self._run, name="inbot-profiler", daemon=True)
+        self.thread.start()
+        logging.info(f"Sampling profiler started, one sample every {self.interval * 1000:.1f} ms.")
+
+    def stop(self):
+        """Stop sampling; the samples taken so far are kept until reset()."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+            logging.info(f"Sampling profiler stopped after {self.samples} samples.")
+
+    def reset(self):
+        """Drop every sample taken so far."""
+        with self.lock:
+            self.stacks.clear()
+            self.samples = 0
+            self.sampling_seconds = 0.0
+            self.started_at = time.time() if self.running else None
+
+    def _label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            if len(self.labels) < self.max_labels:
+                self.labels[code] = label
+        return label
+
+    def _run(self):
+        own_thread = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            started = time.perf_counter()
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stacks.append(tuple(reversed(stack)))
+            with self.lock:
+                for stack in stacks:
+                    if stack not in self.stacks and len(self.stacks) >= self.max_stacks:
+                        stack = self.OTHER_STACKS
+                    self.stacks[stack] += 1
+                self.samples += 1
+                self.sampling_seconds += time.perf_counter() - started
+
+    def collapsed(self, min_count=1):
+        """Returns the samples as collapsed stacks, most frequent first."""
+        with self.lock:
+            stacks = self.stacks.most_common()
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in stacks if count >= min_count)
+
+    def top(self, n=20):
+        """Returns the n functions most often on top of a stack, as (label, share of samples) pairs."""
+        leaves = Counter()
+        with self.lock:
+            for stack, count in self.stacks.items():
+                if stack:
+                    leaves[stack[-1]] += count
+        total = sum(leaves.values())
+        return [(label, count / total) for label, count in leaves.most_common(n)] if total else []
+
+    def status(self):
+        """Returns whether the profiler runs, its interval, sample count and overhead."""
+        with self.lock:
+            return {
+                "running": self.running,
+                "interval": self.interval,
+                "samples": self.samples,
+                "started_at": self.started_at,
+                "sampling_seconds": round(self.sampling_seconds, 4),
+            }
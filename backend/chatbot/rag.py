@@ -0,0 +1,72 @@
+import re
+
+# Words and single punctuation marks; roughly how an LLM tokenizer splits English text
+TOKEN_PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Instructions sent with every retrieval-augmented prompt
+RAG_SYSTEM_PROMPT = (
+    "You are INBOT, an assistant that answers questions about internal company documents. "
+    "Answer using only the numbered excerpts provided. Cite the excerpts you use as [1], [2], ... "
+    "If the excerpts do not contain the answer, say so briefly."
+)
+
+
+def count_tokens(text):
+    """Estimates the number of LLM tokens in a text, erring on the high side.
+
+    Every word or punctuation mark counts as one token, plus one more per 8 characters of a
+    long word. This is much cheaper than running a real tokenizer and close enough to budget by.
+    """
+    return sum(1 + (len(piece) - 1) // 8 for piece in TOKEN_PIECE_PATTERN.findall(text))
+
+
+def pack_passages(passages, budget, slice_text):
+    """Selects passages, best first, until their token estimate would exceed the budget.
+
+    passages are (document name, start, end, score) tuples and slice_text(name, start, end)
+    returns the text of a span. Overlapping passages of a document are merged into one
+    excerpt, so shared text is sent and counted once. Returns (excerpts, tokens used), where
+    each excerpt is a dict with file_name, start, end, score and text.
+    """
+    excerpts = []
+    used = 0
+    for file_name, start, end, score in passages:
+        # Merge into an excerpt of the same document the passage overlaps or touches
+        excerpt = next((e for e in excerpts if e["file_name"] == file_name
+                        and start <= e["end"] and end >= e["start"]), None)
+        if excerpt is not None:
+            start, end = min(start, excerpt["start"]), max(end, excerpt["end"])
+            if (start, end) == (excerpt["start"], excerpt["end"]):
+                continue
+
+        text = slice_text(file_name, start, end)
+        if not text or not text.strip():
+            continue
+        tokens = count_tokens(text)
+        extra = tokens - (excerpt["tokens"] if excerpt else 0)
+        if used + extra > budget:
+            continue
+
+        used += extra
+        if excerpt is None:
+            excerpt = {"file_name": file_name, "score": score}
+            excerpts.append(excerpt)
+        excerpt.update(start=start, end=end, text=text.strip(), tokens=tokens)
+
+    return [{key: value for key, value in e.items() if key != "tokens"} for e in excerpts], used
+
+
+def build_messages(question, excerpts, display_name=None):
+    """Builds the chat messages asking the question about the numbered excerpts.
+
+    display_name, if given, maps the stored file names to the names the user knows them by.
+    """
+    display_name = display_name or (lambda file_name: file_name)
+    context = "\n\n".join(
+        f"[{number}] ({display_name(excerpt['file_name'])})\n{excerpt['text']}"
+        for number, excerpt in enumerate(excerpts, start=1)
+    )
+    return [
+        {"role": "system", "content": RAG_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Excerpts:\n\n{context}\n\nQuestion: {question}"},
+    ]
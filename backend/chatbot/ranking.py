@@ -0,0 +1,320 @@
+import logging
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from .index import paused_garbage_collection
+
+
+def query_matrix(term_lists, term_rows, num_terms=None):
+    """Returns a sparse (queries x terms) CSR matrix with a 1 for every known term of each query.
+
+    num_terms, by default the number of term rows, is the width of the matrix; rows past it
+    are ignored, e.g. terms a shared vocabulary gained after the weight matrix was built.
+    """
+    from scipy import sparse
+
+    num_terms = len(term_rows) if num_terms is None else num_terms
+    query_rows, rows = [], []
+    for query_row, terms in enumerate(term_lists):
+        for term in set(terms):
+            row = term_rows.get(term)
+            if row is not None and row < num_terms:
+                query_rows.append(query_row)
+                rows.append(row)
+
+    return sparse.csr_matrix(
+        (np.ones(len(query_rows), dtype=np.float32), (query_rows, rows)),
+        shape=(len(term_lists), num_terms),
+    )
+
+
+def score_queries(queries, weights):
+    """Returns the (queries x passages) CSR score matrix of a query matrix against a weight matrix."""
+    scores = (queries @ weights).tocsr()
+    scores.sort_indices()
+    return scores
+
+
+def top_columns(scores, query_row, k, allowed=None):
+    """Returns the columns of the k highest positive scores of a query row and those scores, best first.
+
+    allowed, a boolean array over the columns, excludes the passages it marks False.
+    """
+    first, last = scores.indptr[query_row], scores.indptr[query_row + 1]
+    columns, values = scores.indices[first:last], scores.data[first:last]
+    keep = values > 0
+    if allowed is not None:
+        keep &= allowed[columns]
+    columns, values = columns[keep], values[keep]
+    if len(columns) > k:
+        best = np.argpartition(-values, k - 1)[:k]
+        columns, values = columns[best], values[best]
+
+    order = np.argsort(-values, kind='stable')
+    return columns[order], values[order]
+
+
+class DocumentTerms(namedtuple("DocumentTerms", ["version", "passages", "rows", "columns", "frequencies", "lengths"])):
+    """Term frequencies of the passages of one document, counted by PassageTerms.
+
+    Entry i says that term row rows[i] occurs frequencies[i] times in the document's passage
+    columns[i]; lengths holds the number of term occurrences of each passage.
+    """
+
+
+class PassageTerms:
+    """Term frequencies of every passage of an inverted index, kept per document and shared by its rankers.
+
+    Terms keep the row they are first given, so a document's counts stay valid as others come
+    and go, and an update only counts the documents added or changed since the last one. The
+    collection statistics BM25 weights terms by, the passage frequency of every term and the
+    average passage length, are adjusted by the same documents.
+    """
+
+    def __init__(self, inverted_index):
+        self.inverted_index = inverted_index
+        self.term_rows = {}   # term -> row, never reassigned; terms no longer indexed keep an empty row
+        self.documents = {}   # document name -> DocumentTerms
+        self.passage_frequencies = np.zeros(0, dtype=np.int64)  # row -> passages containing the term
+        self.num_passages = 0
+        self.total_length = 0
+        self.idf = np.zeros(0, dtype=np.float32)  # row -> inverse passage frequency over the whole index
+        self.average_length = 0.0
+        self.generation = None  # generation of the index counted
+        self.lock = threading.Lock()
+
+    def update(self):
+        """Count the documents that changed since the last update. Call with the lock held."""
+        index = self.inverted_index
+        if self.generation == index.generation:
+            return
+        with paused_garbage_collection():
+            self._update()
+
+    def _update(self):
+        index = self.inverted_index
+        for doc_id in self.documents.keys() - index.chunks.keys():
+            self._account(self.documents.pop(doc_id), -1)
+        for doc_id, spans in index.chunks.items():
+            version = index.versions.get(doc_id)
+            counted = self.documents.get(doc_id)
+            if counted is not None and counted.version == version:
+                continue
+            if counted is not None:
+                self._account(counted, -1)
+            counted = self.documents[doc_id] = self._count(doc_id, spans, version)
+            self._account(counted, 1)
+
+        # Inverse passage frequency per term, never negative
+        frequencies = self.passage_frequencies.astype(np.float32)
+        self.idf = np.log1p((self.num_passages - frequencies + 0.5) / (frequencies + 0.5))
+        self.average_length = self.total_length / self.num_passages if self.num_passages else 0.0
+        self.generation = index.generation
+
+    def _account(self, counted, sign):
+        # Adds a document's passages to the collection statistics, or takes them out
+        num_terms = len(self.term_rows)
+        if len(self.passage_frequencies) < num_terms:
+            self.passage_frequencies = np.pad(self.passage_frequencies, (0, num_terms - len(self.passage_frequencies)))
+        self.passage_frequencies += sign * np.bincount(counted.rows, minlength=num_terms)
+        self.num_passages += sign * len(counted.lengths)
+        self.total_length += sign * int(counted.lengths.sum())
+
+    def _count(self, doc_id, spans, version):
+        # Counts the occurrences of every term in every passage of a document
+        index = self.inverted_index
+        passages = [(doc_id, start, end) for start, end in spans]
+        if not spans:
+            empty = np.empty(0, dtype=np.int32)
+            return DocumentTerms(version, passages, empty, empty, np.empty(0, dtype=np.float32), empty)
+        starts = np.fromiter((start for start, _ in spans), dtype=np.int64, count=len(spans))
+        ends = np.fromiter((end for _, end in spans), dtype=np.int64, count=len(spans))
+
+        # Gather every term occurrence of the document; the offsets are uint32 buffers, joined as raw bytes
+        terms = index.doc_terms.get(doc_id, ())
+        buffers = [index.postings[term][doc_id] for term in terms]
+        term_rows = self.term_rows
+        rows = np.repeat(
+            np.fromiter((term_rows.setdefault(term, len(term_rows)) for term in terms), dtype=np.int64, count=len(terms)),
+            np.fromiter(map(len, buffers), dtype=np.int64, count=len(buffers)))
+        offsets = np.frombuffer(b"".join(buffers), dtype=np.uint32).astype(np.int64)
+
+        # Each occurrence belongs to the passage starting before it, and to the
+        # previous passage as well when it falls inside their overlap
+        passage = np.searchsorted(starts, offsets, side='right') - 1
+        previous = passage - 1
+        in_previous = (previous >= 0) & (offsets < ends[np.maximum(previous, 0)])
+        rows = np.concatenate((rows, rows[in_previous]))
+        columns = np.concatenate((passage, previous[in_previous]))
+
+        # Repeated (term, passage) pairs are counted, which turns occurrences into term frequencies
+        pairs, frequencies = np.unique(rows * len(spans) + columns, return_counts=True)
+        rows, columns = np.divmod(pairs, len(spans))
+        lengths = np.bincount(columns, weights=frequencies, minlength=len(spans)).astype(np.int32)
+        return DocumentTerms(version, passages, rows.astype(np.int32), columns.astype(np.int32),
+                             frequencies.astype(np.float32), lengths)
+
+
+class BM25Ranker:
+    """Okapi BM25 scorer over a precomputed sparse term-passage weight matrix."""
+
+    def __init__(self, inverted_index, k1=1.5, b=0.75, shard=None, collection=None):
+        """Prepare a ranker for an inverted index. The matrix is built on first use.
+
+        With a shard, the ranker covers only the shard's documents. Its term statistics, the
+        inverse passage frequencies and the average passage length, come from the whole index
+        when a collection ranker over it is given, so the scores of different shards compare;
+        otherwise from the shard's documents alone. Rankers of one collection share the
+        per-document term frequencies they are built from.
+        """
+        self.inverted_index = inverted_index
+        self.k1 = k1
+        self.b = b
+        self.shard = shard
+        self.collection = collection
+        self.passage_terms = collection.passage_terms if collection is not None else PassageTerms(inverted_index)
+        self.generation = None  # generation of the index or shard the matrix was built from
+        self.term_rows = {}     # term -> row of the weight matrix
+        self.passages = []      # column -> (document name, start, end)
+        self.weights = None     # scipy.sparse CSR matrix, terms x passages
+        self.build_lock = threading.Lock()  # concurrent searches must not rebuild the matrix twice
+
+    def build(self):
+        """Compute the BM25 weight of every (term, passage) pair from the per-document term frequencies.
+
+        Only documents that changed since the last build are counted again; the matrix is then
+        assembled from the counts in a few vectorized passes.
+        """
+        from scipy import sparse  # imported on first build, keeping it off the startup path
+
+        index = self.inverted_index
+        generation = self.current_generation()
+        passage_terms = self.passage_terms
+        with passage_terms.lock:
+            passage_terms.update()
+            if self.shard is None:
+                documents = list(index.chunks)
+            else:
+                # Only the shard's documents are assembled, so the build scales with the shard
+                documents = sorted(doc_id for doc_id in self.shard.documents if doc_id in index.chunks)
+            counts = [passage_terms.documents[doc_id] for doc_id in documents]
+            self.term_rows = passage_terms.term_rows
+            num_terms = len(self.term_rows)
+            collection_statistics = self.shard is None or self.collection is not None
+            if collection_statistics:
+                idf, average_length = passage_terms.idf[:num_terms], passage_terms.average_length
+
+        self.passages = [passage for counted in counts for passage in counted.passages]
+        num_passages = len(self.passages)
+        first_columns = np.cumsum([0] + [len(counted.lengths) for counted in counts[:-1]])
+        if counts:
+            rows = np.concatenate([counted.rows for counted in counts])
+            columns = np.concatenate([counted.columns for counted in counts]) + np.repeat(
+                first_columns, [len(counted.columns) for counted in counts])
+            frequencies = np.concatenate([counted.frequencies for counted in counts])
+            passage_lengths = np.concatenate([counted.lengths for counted in counts]).astype(np.float32)
+        else:
+            rows = columns = np.empty(0, dtype=np.int32)
+            frequencies = passage_lengths = np.empty(0, dtype=np.float32)
+
+        if not collection_statistics:
+            average_length = passage_lengths.mean() if num_passages else 0.0
+            passage_frequencies = np.bincount(rows, minlength=num_terms).astype(np.float32)
+            idf = np.log1p((num_passages - passage_frequencies + 0.5) / (passage_frequencies + 0.5))
+
+        # Saturated, length-normalised term frequency times idf, all in one vectorized pass
+        if average_length:
+            norms = self.k1 * (1 - self.b + self.b * passage_lengths[columns] / average_length)
+        else:
+            norms = np.full(len(rows), self.k1, dtype=np.float32)
+        values = idf[rows] * frequencies * (self.k1 + 1) / (frequencies + norms)
+
+        self.weights = sparse.csr_matrix(
+            (values.astype(np.float32), (rows, columns)),
+            shape=(num_terms, num_passages),
+        )
+        self.generation = generation
+        logging.info(f"Built BM25 matrix for {num_passages} passages and {num_terms} terms.")
+
+    def current_generation(self):
+        """Returns the generation of the index, or of the shard, this ranker covers.
+
+        A shard ranker weighted by collection statistics also follows the index generation.
+        """
+        if self.shard is None:
+            return self.inverted_index.generation
+        if self.collection is not None:
+            return self.shard.generation, self.inverted_index.generation
+        return self.shard.generation
+
+    def ensure_built(self):
+        """Rebuild the matrix if the index or shard changed since it was built."""
+        if self.generation != self.current_generation():
+            with self.build_lock:
+                if self.generation != self.current_generation():
+                    self.build()
+
+    def score(self, terms):
+        """Returns the BM25 score of every passage for the given terms, as an array indexed by column."""
+        self.ensure_built()
+
+        num_terms = self.weights.shape[0]
+        rows = [row for row in map(self.term_rows.get, set(terms)) if row is not None and row < num_terms]
+        if not rows or not self.passages:
+            return np.zeros(len(self.passages), dtype=np.float32)
+
+        # Summing the selected rows touches only the postings of the query terms
+        return np.asarray(self.weights[rows].sum(axis=0)).ravel()
+
+    def score_many(self, term_lists):
+        """Returns the BM25 scores of several queries as a sparse (queries x passages) CSR matrix.
+
+        All queries are scored with one sparse matrix product, which walks the postings of
+        every distinct term once however many queries share it.
+        """
+        self.ensure_built()
+        return score_queries(query_matrix(term_lists, self.term_rows, self.weights.shape[0]), self.weights)
+
+    def top_k(self, terms, k=5):
+        """Returns up to k (document name, start, end, score) passages with the highest positive scores."""
+        return self.top_k_many([terms], k)[0]
+
+    def top_k_many(self, term_lists, k=5):
+        """Returns, for each list of query terms, up to k (document name, start, end, score) passages, best first."""
+        scores = self.score_many(term_lists)
+
+        results = []
+        for query_row in range(len(term_lists)):
+            columns, values = top_columns(scores, query_row, k)
+            results.append([(*self.passages[column], float(value)) for column, value in zip(columns, values)])
+        return results
+
+
+class DocumentShard:
+    """A subset of the indexed documents, e.g. those of one user, ranked by a BM25 matrix of its own.
+
+    Searches limited to the shard only pay for its documents, and its matrix is rebuilt only
+    when one of them changes, or when the collection statistics its weights use do.
+    """
+
+    def __init__(self, inverted_index, collection=None, **ranker_options):
+        """Prepare an empty shard; collection is the ranker whose term statistics its scores use, see BM25Ranker."""
+        self.documents = set()
+        self.generation = 0  # bumped whenever a document joins, changes or leaves the shard
+        self.ranker = BM25Ranker(inverted_index, shard=self, collection=collection, **ranker_options)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, doc_id):
+        """Add a document, or note that its content changed."""
+        self.documents.add(doc_id)
+        self.generation += 1
+
+    def discard(self, doc_id):
+        """Remove a document if it is in the shard."""
+        if doc_id in self.documents:
+            self.documents.remove(doc_id)
+            self.generation += 1
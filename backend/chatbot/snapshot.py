@@ -0,0 +1,364 @@
+import os
+import json
+import time
+import heapq
+import shutil
+import logging
+import itertools
+from collections.abc import Mapping
+import numpy as np
+
+from .store import DocumentStore
+from .ranking import query_matrix, score_queries, top_columns
+
+FORMAT_VERSION = 1
+CURRENT_FILE = "CURRENT"  # names the live snapshot; replaced atomically to swap snapshots
+
+# Every snapshot opened by a process gets its own generation, so structures derived from one
+# (like the fuzzy vocabulary) notice the swap
+_generations = itertools.count(1)
+
+
+def _save_array(directory, name, values, dtype):
+    np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(values, dtype=dtype))
+
+
+def write_snapshot(snapshot_dir, inverted_index, document_store, manifest, ranker, index_version,
+                   num_shards=1, keep=3):
+    """Write the saved index as a new immutable snapshot under snapshot_dir and make it the current one.
+
+    A snapshot holds everything a search needs as flat arrays that readers memory-map, so
+    every worker shares one copy through the page cache: the terms, their postings, the
+    passages, the BM25 weight matrix split into num_shards document ranges, and the texts.
+    Call with the index lock held and after the document store was saved. Returns the name
+    of the new snapshot.
+    """
+    ranker.ensure_built()
+    started = time.perf_counter()
+    version = f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10 ** 9:09d}-{index_version}"
+    tmp_dir = os.path.join(snapshot_dir, f".tmp-{version}")
+    os.makedirs(tmp_dir)
+
+    # Documents in passage order, so each shard is a contiguous range of documents and passages
+    documents, passage_docs = [], []
+    doc_ids = {}
+    for doc_id, _, _ in ranker.passages:
+        if doc_id not in doc_ids:
+            doc_ids[doc_id] = len(documents)
+            documents.append(doc_id)
+        passage_docs.append(doc_ids[doc_id])
+    for doc_id in inverted_index.doc_lengths:
+        if doc_id not in doc_ids:
+            doc_ids[doc_id] = len(documents)
+            documents.append(doc_id)
+    passage_docs = np.asarray(passage_docs, dtype=np.int32)
+
+    _save_array(tmp_dir, "passage_docs", passage_docs, np.int32)
+    _save_array(tmp_dir, "passage_starts", [start for _, start, _ in ranker.passages], np.int64)
+    _save_array(tmp_dir, "passage_ends", [end for _, _, end in ranker.passages], np.int64)
+    _save_array(tmp_dir, "doc_lengths", [inverted_index.doc_lengths.get(doc_id, 0) for doc_id in documents], np.int64)
+
+    # Postings as CSR: the documents of term row r are posting_docs[term_ptr[r]:term_ptr[r + 1]],
+    # sorted by document number, and the offsets of the i-th of them are positions[posting_ptr[i]:posting_ptr[i + 1]]
+    # Terms no longer indexed keep an empty row in the ranker; the snapshot leaves them out
+    terms = sorted((term for term in ranker.term_rows if term in inverted_index.postings), key=ranker.term_rows.get)
+    term_rows = [ranker.term_rows[term] for term in terms]
+    term_ptr, posting_docs, posting_ptr, positions = [0], [], [0], []
+    for term in terms:
+        term_postings = inverted_index.postings.get(term, {})
+        for doc_number, doc_id in sorted((doc_ids[doc_id], doc_id) for doc_id in term_postings if doc_id in doc_ids):
+            offsets = term_postings[doc_id]
+            posting_docs.append(doc_number)
+            positions.append(np.frombuffer(offsets, dtype=np.uint32) if len(offsets) else np.empty(0, np.uint32))
+            posting_ptr.append(posting_ptr[-1] + len(offsets))
+        term_ptr.append(len(posting_docs))
+    _save_array(tmp_dir, "term_ptr", term_ptr, np.int64)
+    _save_array(tmp_dir, "posting_docs", posting_docs, np.int32)
+    _save_array(tmp_dir, "posting_ptr", posting_ptr, np.int64)
+    _save_array(tmp_dir, "positions", np.concatenate(positions) if positions else [], np.uint32)
+
+    # Shards split the passages into ranges of about equal size, never splitting a document
+    num_passages = len(passage_docs)
+    bounds = [0]
+    for shard in range(1, num_shards if num_passages else 1):
+        cut = int(np.searchsorted(passage_docs, passage_docs[shard * num_passages // num_shards]))
+        if bounds[-1] < cut < num_passages:
+            bounds.append(cut)
+    bounds.append(num_passages)
+    weights = ranker.weights[term_rows].tocsc() if ranker.weights is not None else None
+    shards = []
+    for number, (first, last) in enumerate(zip(bounds, bounds[1:])):
+        shard_weights = weights[:, first:last].tocsr() if weights is not None else None
+        _save_array(tmp_dir, f"shard-{number}-data", shard_weights.data if shard_weights is not None else [], np.float32)
+        _save_array(tmp_dir, f"shard-{number}-indices", shard_weights.indices if shard_weights is not None else [], np.int32)
+        _save_array(tmp_dir, f"shard-{number}-indptr",
+                    shard_weights.indptr if shard_weights is not None else np.zeros(len(terms) + 1), np.int64)
+        shards.append([first, last])
+
+    document_store.export(os.path.join(tmp_dir, "documents"))
+    meta = {
+        "version": FORMAT_VERSION,
+        "name": version,
+        "created_at": time.time(),
+        "index_version": index_version,
+        "terms": terms,
+        "documents": documents,
+        "shards": shards,
+        "owners": {doc_id: owner for doc_id, owner in manifest.owners.items() if doc_id in doc_ids},
+        # Every file the indexer has seen, with its content hash and whether it could be indexed
+        "files": {name: [manifest.get(name)["sha256"], manifest.get(name)["indexed"]] for name in manifest.names()},
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, separators=(',', ':'))
+
+    # The directory appears complete under its final name, then the pointer moves to it
+    os.rename(tmp_dir, os.path.join(snapshot_dir, version))
+    pointer_tmp = os.path.join(snapshot_dir, f".{CURRENT_FILE}.tmp")
+    with open(pointer_tmp, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(pointer_tmp, os.path.join(snapshot_dir, CURRENT_FILE))
+    logging.info(f"Wrote index snapshot '{version}' with {len(documents)} documents in {len(shards)} shards "
+                 f"in {(time.perf_counter() - started) * 1000:.0f} ms.")
+
+    prune_snapshots(snapshot_dir, keep)
+    return version
+
+
+def prune_snapshots(snapshot_dir, keep=3):
+    """Delete all but the keep newest snapshots, and leftovers of interrupted writes.
+
+    Readers that already mapped an older snapshot keep reading it; its files only go away
+    once they are unmapped.
+    """
+    names = sorted(name for name in os.listdir(snapshot_dir) if not name.startswith('.') and name != CURRENT_FILE)
+    stale = names[:-keep] if keep else names
+    stale += [name for name in os.listdir(snapshot_dir) if name.startswith('.tmp-')]
+    for name in stale:
+        shutil.rmtree(os.path.join(snapshot_dir, name), ignore_errors=True)
+
+
+def current_snapshot(snapshot_dir):
+    """Returns the name of the current snapshot, or None if none was written yet."""
+    try:
+        with open(os.path.join(snapshot_dir, CURRENT_FILE), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class TermPostings(Mapping):
+    """The postings {document name: offsets} of one term of a snapshot, read from the mapped arrays."""
+
+    def __init__(self, snapshot, row):
+        self.snapshot = snapshot
+        self.first, self.last = int(snapshot.term_ptr[row]), int(snapshot.term_ptr[row + 1])
+
+    def __len__(self):
+        return self.last - self.first
+
+    def __iter__(self):
+        documents = self.snapshot.documents
+        return (documents[number] for number in self.snapshot.posting_docs[self.first:self.last])
+
+    def __getitem__(self, doc_id):
+        snapshot = self.snapshot
+        number = snapshot.doc_ids.get(doc_id)
+        if number is not None:
+            i = self.first + int(np.searchsorted(snapshot.posting_docs[self.first:self.last], number))
+            if i < self.last and snapshot.posting_docs[i] == number:
+                return snapshot.positions[snapshot.posting_ptr[i]:snapshot.posting_ptr[i + 1]]
+        raise KeyError(doc_id)
+
+
+class SnapshotPostings(Mapping):
+    """term -> TermPostings of a snapshot, standing in for InvertedIndex.postings."""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __len__(self):
+        return len(self.snapshot.term_rows)
+
+    def __iter__(self):
+        return iter(self.snapshot.term_rows)
+
+    def __contains__(self, term):
+        return term in self.snapshot.term_rows
+
+    def __getitem__(self, term):
+        return TermPostings(self.snapshot, self.snapshot.term_rows[term])
+
+    def keys(self):
+        return self.snapshot.term_rows.keys()
+
+
+class SnapshotChunks(Mapping):
+    """document name -> [(start, end)] passage spans of a snapshot, standing in for InvertedIndex.chunks."""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.ranges = {}  # document number -> (first passage, last passage)
+        docs = snapshot.passage_docs
+        if len(docs):
+            changes = np.flatnonzero(np.diff(docs)) + 1
+            starts = np.concatenate([[0], changes])
+            ends = np.concatenate([changes, [len(docs)]])
+            self.ranges = {int(docs[start]): (int(start), int(end)) for start, end in zip(starts, ends)}
+
+    def __len__(self):
+        return len(self.snapshot.documents)
+
+    def __iter__(self):
+        return iter(self.snapshot.documents)
+
+    def __getitem__(self, doc_id):
+        number = self.snapshot.doc_ids[doc_id]
+        first, last = self.ranges.get(number, (0, 0))
+        return list(zip(self.snapshot.passage_starts[first:last].tolist(), self.snapshot.passage_ends[first:last].tolist()))
+
+
+class IndexSnapshot:
+    """A snapshot written by write_snapshot, memory-mapped read-only.
+
+    It offers the read side of InvertedIndex (lookup, vocabulary, postings, chunks,
+    doc_lengths), the texts as a DocumentStore, and top_k_many ranking that scores every
+    shard and merges their best passages.
+    """
+
+    def __init__(self, snapshot_dir, name):
+        """Open snapshot name under snapshot_dir. Raises OSError or ValueError if it is missing or unusable."""
+        path = os.path.join(snapshot_dir, name)
+        with open(os.path.join(path, "meta.json"), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unknown snapshot format version {meta.get('version')}")
+
+        def load(array_name):
+            return np.load(os.path.join(path, f"{array_name}.npy"), mmap_mode='r')
+
+        self.name = name
+        self.path = path
+        self.generation = next(_generations)
+        self.index_version = meta["index_version"]
+        self.owners = meta["owners"]
+        self.files = meta["files"]
+        self.documents = meta["documents"]
+        self.doc_ids = {doc_id: number for number, doc_id in enumerate(self.documents)}
+        self.term_rows = {term: row for row, term in enumerate(meta["terms"])}
+        self._visible = {}  # owner -> documents visible to them
+
+        self.passage_docs = load("passage_docs")
+        self.passage_starts = load("passage_starts")
+        self.passage_ends = load("passage_ends")
+        self.term_ptr = load("term_ptr")
+        self.posting_docs = load("posting_docs")
+        self.posting_ptr = load("posting_ptr")
+        self.positions = load("positions")
+        self.doc_lengths = dict(zip(self.documents, load("doc_lengths").tolist()))
+        self.postings = SnapshotPostings(self)
+        self.chunks = SnapshotChunks(self)
+
+        from scipy import sparse
+        self.shards = []  # (first passage, last passage, CSR weights of the shard's passages)
+        for number, (first, last) in enumerate(meta["shards"]):
+            weights = sparse.csr_matrix(
+                (load(f"shard-{number}-data"), load(f"shard-{number}-indices"), load(f"shard-{number}-indptr")),
+                shape=(len(self.term_rows), last - first), copy=False)
+            self.shards.append((first, last, weights))
+
+        self.text = DocumentStore(os.path.join(path, "documents"))
+        if not self.text.load():
+            raise ValueError(f"Snapshot '{name}' has no usable document store")
+        self.text.map()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.doc_ids
+
+    def lookup(self, term):
+        """Returns the postings {document name: offsets} of a term, like InvertedIndex.lookup."""
+        row = self.term_rows.get(term)
+        return TermPostings(self, row) if row is not None else {}
+
+    def vocabulary(self):
+        """Returns every term of the snapshot."""
+        return self.term_rows.keys()
+
+    def top_k_many(self, term_lists, k=5, documents=None):
+        """Returns, for each list of query terms, up to k (document name, start, end, score) passages, best first.
+
+        Each shard ranks its own passages and the k best of all of them are kept, which equals
+        ranking the whole matrix since the weights were computed over the whole index.
+        documents, when given, limits the results to those documents.
+        """
+        allowed = None
+        if documents is not None:
+            allowed = np.zeros(len(self.documents), dtype=bool)
+            allowed[[self.doc_ids[doc_id] for doc_id in documents if doc_id in self.doc_ids]] = True
+
+        queries = query_matrix(term_lists, self.term_rows)
+        best = [[] for _ in term_lists]  # (score, passage) candidates of every shard
+        for first, last, weights in self.shards:
+            scores = score_queries(queries, weights)
+            shard_allowed = allowed[self.passage_docs[first:last]] if allowed is not None else None
+            for query_row in range(len(term_lists)):
+                columns, values = top_columns(scores, query_row, k, shard_allowed)
+                best[query_row].extend(zip(values.tolist(), (first + columns).tolist()))
+
+        results = []
+        for candidates in best:
+            top = heapq.nlargest(k, candidates, key=lambda candidate: candidate[0])
+            results.append([
+                (self.documents[self.passage_docs[passage]], int(self.passage_starts[passage]),
+                 int(self.passage_ends[passage]), score)
+                for score, passage in top
+            ])
+        return results
+
+    def visible_documents(self, owner):
+        """Returns the documents that are shared or belong to owner (a user id string, or None for shared only)."""
+        visible = self._visible.get(owner)
+        if visible is None:
+            visible = self._visible[owner] = frozenset(
+                doc_id for doc_id in self.documents if self.owners.get(doc_id) in (None, owner))
+        return visible
+
+
+class IndexSpool:
+    """A directory of index changes requested by reader processes, applied in order by the writer.
+
+    Each request is one small JSON file, written under a temporary name and renamed into
+    place, so the writer never sees half a request.
+    """
+
+    def __init__(self, spool_dir):
+        self.spool_dir = spool_dir
+        self.counter = itertools.count()
+
+    def submit(self, operation, **fields):
+        """Queue a request, e.g. submit("index", files=[...]) or submit("remove", file=...)."""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        name = f"{time.time_ns():020d}-{os.getpid()}-{next(self.counter)}.json"
+        tmp_path = os.path.join(self.spool_dir, f".{name}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(fields, operation=operation), f)
+        os.replace(tmp_path, os.path.join(self.spool_dir, name))
+
+    def pending(self):
+        """Returns the queued (path, request) pairs, oldest first. Delete each file once it is applied."""
+        try:
+            names = sorted(name for name in os.listdir(self.spool_dir) if name.endswith('.json'))
+        except FileNotFoundError:
+            return []
+        requests = []
+        for name in names:
+            path = os.path.join(self.spool_dir, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    requests.append((path, json.load(f)))
+            except (OSError, ValueError) as e:
+                logging.error(f"Dropping unreadable index request '{path}': {e}")
+                os.remove(path)
+        return requests
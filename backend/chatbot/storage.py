@@ -0,0 +1,357 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import mimetypes
+import threading
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import span
+
+
+class StorageError(RuntimeError):
+    """Raised when the storage service rejects a request or cannot be reached."""
+
+
+class SupabaseStorage:
+    """Client for one Supabase Storage bucket, speaking the REST API over a pooled HTTP connection."""
+
+    LIST_PAGE_SIZE = 1000
+
+    def __init__(self, url, key, bucket='files', timeout=30, max_connections=8, transport=None):
+        """Connect to the storage API of the Supabase project at url.
+
+        One httpx client is shared by every call, so connections are kept alive and reused.
+        transport is handed to httpx, e.g. an httpx.MockTransport standing in for the API.
+        """
+        import httpx  # only needed when Supabase is configured
+
+        self.httpx = httpx
+        self.bucket = bucket
+        self.http = httpx.Client(
+            base_url=f"{url.rstrip('/')}/storage/v1",
+            headers={"Authorization": f"Bearer {key}", "apikey": key},
+            timeout=httpx.Timeout(timeout, connect=5),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=transport,
+        )
+
+    def _request(self, method, path, **kwargs):
+        try:
+            with span(f"storage.{method.lower()}"):
+                response = self.http.request(method, path, **kwargs)
+        except self.httpx.HTTPError as e:
+            raise StorageError(f"Storage request {method} {path} failed: {e}") from e
+        if response.is_error:
+            raise StorageError(f"Storage request {method} {path} failed with {response.status_code}: {response.text}")
+        return response
+
+    def list_objects(self):
+        """Returns {object name: {"etag", "size"}} for every file in the bucket."""
+        objects = {}
+        offset = 0
+        while True:
+            page = self._request("POST", f"/object/list/{self.bucket}", json={
+                "prefix": "",
+                "limit": self.LIST_PAGE_SIZE,
+                "offset": offset,
+                "sortBy": {"column": "name", "order": "asc"},
+            }).json()
+
+            for item in page:
+                # Folders are listed without an id or metadata
+                metadata = item.get("metadata") or {}
+                if item.get("id") is None or "eTag" not in metadata:
+                    continue
+                objects[item["name"]] = {"etag": metadata["eTag"], "size": metadata.get("size")}
+
+            if len(page) < self.LIST_PAGE_SIZE:
+                return objects
+            offset += len(page)
+
+    def download(self, name, f):
+        """Stream an object into the binary file object f."""
+        path = f"/object/{self.bucket}/{quote(name)}"
+        try:
+            with span("storage.download"), self.http.stream("GET", path) as response:
+                if response.is_error:
+                    response.read()
+                    raise StorageError(f"Download of '{name}' failed with {response.status_code}: {response.text}")
+                for chunk in response.iter_bytes(1 << 20):
+                    f.write(chunk)
+        except self.httpx.HTTPError as e:
+            raise StorageError(f"Download of '{name}' failed: {e}") from e
+
+    def upload(self, name, f, content_type=None):
+        """Upload the binary file object f as an object, replacing any object with the same name."""
+        content_type = content_type or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self._request("POST", f"/object/{self.bucket}/{quote(name)}", content=f.read(),
+                      headers={"Content-Type": content_type, "x-upsert": "true"})
+
+    def remove(self, names):
+        """Delete objects from the bucket."""
+        self._request("DELETE", f"/object/{self.bucket}", json={"prefixes": list(names)})
+
+    def close(self):
+        """Close the pooled connections."""
+        self.http.close()
+
+
+class LocalStorage:
+    """Stand-in for SupabaseStorage backed by a local directory, for development and tests.
+
+    ETags are MD5 digests of the content, as Supabase reports them for simple uploads.
+    """
+
+    def __init__(self, root_dir):
+        """Use root_dir as the bucket, creating it if needed."""
+        self.root_dir = root_dir
+        self.etags = {}  # object name -> (mtime_ns, size, etag), so unchanged files are not hashed again
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _path(self, name):
+        if os.path.basename(name) != name or name in ('', '.', '..'):
+            raise StorageError(f"Invalid object name '{name}'")
+        return os.path.join(self.root_dir, name)
+
+    def list_objects(self):
+        """Returns {object name: {"etag", "size"}} for every file in the bucket."""
+        objects = {}
+        for entry in os.scandir(self.root_dir):
+            if not entry.is_file() or entry.name.startswith('.'):
+                continue
+            stat = entry.stat()
+            cached = self.etags.get(entry.name)
+            if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                etag = cached[2]
+            else:
+                etag = f'"{file_digest(entry.path, "md5")}"'
+                self.etags[entry.name] = (stat.st_mtime_ns, stat.st_size, etag)
+            objects[entry.name] = {"etag": etag, "size": stat.st_size}
+        return objects
+
+    def download(self, name, f):
+        """Copy an object into the binary file object f."""
+        try:
+            with open(self._path(name), 'rb') as source:
+                shutil.copyfileobj(source, f, 1 << 20)
+        except OSError as e:
+            raise StorageError(f"Download of '{name}' failed: {e}") from e
+
+    def upload(self, name, f, content_type=None):
+        """Store the binary file object f as an object, replacing any object with the same name."""
+        path = self._path(name)
+        # A dot-file, which list_objects skips, so a partial upload is never listed as an object
+        fd, tmp_path = tempfile.mkstemp(dir=self.root_dir, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as target:
+                shutil.copyfileobj(f, target, 1 << 20)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            raise StorageError(f"Upload of '{name}' failed: {e}") from e
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def remove(self, names):
+        """Delete objects from the bucket. Missing objects are ignored."""
+        for name in names:
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                raise StorageError(f"Removal of '{name}' failed: {e}") from e
+
+    def close(self):
+        pass
+
+
+def file_digest(file_path, algorithm='sha256'):
+    """Returns the hex digest of a file's content, read in chunks."""
+    digest = hashlib.new(algorithm)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StorageSync:
+    """Mirrors a storage bucket into the documents directory, downloading only objects whose ETag changed.
+
+    Downloaded content is kept in a content-addressed cache (objects/<sha256>), so a document
+    that goes missing locally, or an object renamed or copied in the bucket, is restored
+    without touching the network.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, storage, documents_dir, mirror_dir, download_workers=4):
+        """Prepare a mirror of storage kept under mirror_dir, with files copied out to documents_dir."""
+        self.storage = storage
+        self.documents_dir = documents_dir
+        self.mirror_dir = mirror_dir
+        self.objects_dir = os.path.join(mirror_dir, "objects")
+        self.state_path = os.path.join(mirror_dir, "state.json")
+        self.download_workers = download_workers
+        self.objects = {}  # object name -> {"etag", "size", "sha256"} as of the last sync
+        self.lock = threading.Lock()  # one sync at a time
+        self.load()
+
+    def load(self):
+        """Restore the state of the last sync. Returns False if there was none."""
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get("version") != self.FORMAT_VERSION:
+                return False
+            self.objects = state["objects"]
+            return True
+        except (OSError, ValueError, KeyError):
+            self.objects = {}
+            return False
+
+    def save(self):
+        """Write the sync state to disk atomically."""
+        os.makedirs(self.mirror_dir, exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": self.FORMAT_VERSION, "objects": self.objects}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def forget(self, name):
+        """Stop tracking an object, e.g. after it was deleted through the API."""
+        with self.lock:
+            if self.objects.pop(name, None) is not None:
+                self.save()
+
+    def _blob_path(self, digest):
+        return os.path.join(self.objects_dir, digest)
+
+    def _document_path(self, name):
+        return os.path.join(self.documents_dir, name)
+
+    def sync(self):
+        """Bring the documents directory in line with the bucket. Returns (changed names, removed names).
+
+        Files that were never in the bucket, such as uploads still being pushed, are left alone.
+        """
+        with self.lock:
+            remote = self.storage.list_objects()
+            known_blobs = {entry["etag"]: entry["sha256"] for entry in self.objects.values()}
+            changed, removed, to_fetch = [], [], []
+
+            for name, info in remote.items():
+                entry = self.objects.get(name)
+                if entry and entry["etag"] == info["etag"]:
+                    if not os.path.exists(self._document_path(name)) and self._restore(name, entry["sha256"]):
+                        changed.append(name)
+                    continue
+
+                # An ETag we already hold content for needs no download
+                digest = known_blobs.get(info["etag"])
+                if digest and self._restore(name, digest):
+                    self.objects[name] = {**info, "sha256": digest}
+                    changed.append(name)
+                else:
+                    to_fetch.append(name)
+
+            # Objects sharing an ETag, i.e. copies, are downloaded once
+            first_names = {}
+            for name in to_fetch:
+                first_names.setdefault(remote[name]["etag"], name)
+            with ThreadPoolExecutor(max_workers=self.download_workers) as executor:
+                fetched = dict(zip(first_names, executor.map(lambda n: self._fetch(n, remote[n]["etag"]), first_names.values())))
+
+            for name in to_fetch:
+                digest = fetched[remote[name]["etag"]]
+                if digest is None:
+                    continue
+                if not self._matches(name, digest):
+                    self._restore(name, digest)
+                    changed.append(name)
+                elif self.objects.get(name, {}).get("sha256") != digest:
+                    # Already in place, e.g. uploaded from here, but new to the mirror
+                    changed.append(name)
+                self.objects[name] = {**remote[name], "sha256": digest}
+
+            for name in [name for name in self.objects if name not in remote]:
+                del self.objects[name]
+                try:
+                    os.remove(self._document_path(name))
+                except FileNotFoundError:
+                    pass
+                removed.append(name)
+
+            self._collect_garbage()
+            if changed or removed or to_fetch:
+                self.save()
+            logging.info(f"Storage sync: {len(remote)} objects, {len(first_names)} fetched, "
+                         f"{len(changed)} changed, {len(removed)} removed.")
+            return changed, removed
+
+    def _fetch(self, name, etag):
+        """Put an object's content in the cache and return its sha256, or None if it could not be fetched."""
+        # An ETag is the MD5 of simple uploads, so a local copy that matches it can be used as is
+        local_path = self._document_path(name)
+        try:
+            use_local = os.path.exists(local_path) and f'"{file_digest(local_path, "md5")}"' == etag
+        except OSError:
+            use_local = False
+
+        os.makedirs(self.objects_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.objects_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if use_local:
+                    with open(local_path, 'rb') as source:
+                        shutil.copyfileobj(source, f, 1 << 20)
+                else:
+                    self.storage.download(name, f)
+            return self._add_blob(tmp_path)
+        except (StorageError, OSError) as e:
+            logging.error(f"Failed to fetch '{name}' from storage: {e}")
+            return None
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _add_blob(self, file_path):
+        # Move a file into the cache under its content hash
+        digest = file_digest(file_path)
+        blob_path = self._blob_path(digest)
+        if not os.path.exists(blob_path):
+            os.replace(file_path, blob_path)
+        return digest
+
+    def _matches(self, name, digest):
+        try:
+            return file_digest(self._document_path(name)) == digest
+        except OSError:
+            return False
+
+    def _restore(self, name, digest):
+        """Copy cached content out to the documents directory. Returns False if it is not cached."""
+        blob_path = self._blob_path(digest)
+        if not os.path.exists(blob_path):
+            return False
+
+        # Copied rather than linked, so writing the document can never corrupt the cache. The copy is
+        # a hidden file until complete, which scans of the documents directory skip
+        os.makedirs(self.documents_dir, exist_ok=True)
+        tmp_path = self._document_path(f".{name}.sync")
+        shutil.copyfile(blob_path, tmp_path)
+        os.replace(tmp_path, self._document_path(name))
+        return True
+
+    def _collect_garbage(self):
+        # Drop cached content no object refers to any more
+        if not os.path.isdir(self.objects_dir):
+            return
+        referenced = {entry["sha256"] for entry in self.objects.values()}
+        for entry in os.scandir(self.objects_dir):
+            if entry.is_file() and not entry.name.endswith(".tmp") and entry.name not in referenced:
+                os.remove(entry.path)
@@ -0,0 +1,226 @@
+import os
+import mmap
+import shutil
+import json
+import hashlib
+import logging
+from array import array
+
+
+class DocumentStore:
+    """Keeps the cleaned text of every document packed in one memory-mapped file.
+
+    Texts are stored as UTF-8 one after another and read back by offset, so passages are
+    decoded straight from the mapping without materialising whole documents. Only the small
+    per-document entries stay in memory; the page cache holds the text itself.
+    """
+
+    FORMAT_VERSION = 1
+    CHECKPOINT_EVERY = 256  # characters between byte-offset checkpoints of non-ASCII texts
+
+    def __init__(self, store_dir):
+        """Prepare an empty store under store_dir. Nothing is read until load() is called."""
+        self.store_dir = store_dir
+        self.blob_path = os.path.join(store_dir, "documents.bin")
+        self.meta_path = os.path.join(store_dir, "documents.json")
+        # document name -> (byte offset, byte length, character length, sha256, checkpoints or None)
+        self.entries = {}
+        self.locations = {}  # sha256 -> entry, so identical texts are stored once
+        self.blob_size = 0   # bytes written to the blob file, referenced or not
+        self.blob = None     # read-only mmap of the blob file
+        self.mapped_size = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def clear(self):
+        """Forget every document. The blob file is rewritten on the next save."""
+        self.entries = {}
+        self.locations = {}
+
+    def get(self, name, default=None):
+        """Returns the whole cleaned text of a document, or default if it is not stored."""
+        entry = self.entries.get(name)
+        if entry is None:
+            return default
+        offset, length = entry[0], entry[1]
+        return self._read(offset, offset + length).decode('utf-8')
+
+    def __getitem__(self, name):
+        text = self.get(name)
+        if text is None:
+            raise KeyError(name)
+        return text
+
+    def slice(self, name, start, end):
+        """Returns text[start:end] of a document, decoding only that part. None if it is not stored."""
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        offset, length, chars, _, checkpoints = entry
+        start, end = max(0, min(start, chars)), max(0, min(end, chars))
+        if start >= end:
+            return ""
+
+        # ASCII text has one byte per character
+        if checkpoints is None:
+            return self._read(offset + start, offset + end).decode('ascii')
+
+        # Otherwise decode from the checkpoint at or before start to the one at or after end
+        first = start // self.CHECKPOINT_EVERY
+        last = -(-end // self.CHECKPOINT_EVERY)
+        first_byte = checkpoints[first]
+        last_byte = checkpoints[last] if last < len(checkpoints) else length
+        text = self._read(offset + first_byte, offset + last_byte).decode('utf-8')
+        base = first * self.CHECKPOINT_EVERY
+        return text[start - base:end - base]
+
+    def digest(self, name):
+        """Returns the content hash a document's text was stored under, or None if it is not stored."""
+        entry = self.entries.get(name)
+        return entry[3] if entry else None
+
+    def put(self, name, text, digest=None):
+        """Store the cleaned text of a document under a content hash, by default the text's own SHA-256.
+
+        Documents with the same digest share their bytes.
+        """
+        data = text.encode('utf-8')
+        digest = digest or hashlib.sha256(data).hexdigest()
+        if digest in self.locations:
+            self.entries[name] = self.locations[digest]
+            return
+
+        checkpoints = None
+        if len(data) != len(text):
+            checkpoints = array('I')
+            position = 0
+            for first in range(0, len(text), self.CHECKPOINT_EVERY):
+                checkpoints.append(position)
+                position += len(text[first:first + self.CHECKPOINT_EVERY].encode('utf-8'))
+
+        # New text is appended to the blob right away, so it can be read before the next save
+        os.makedirs(self.store_dir, exist_ok=True)
+        with open(self.blob_path, 'ab') as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(data)
+        self.blob_size = offset + len(data)
+        self.entries[name] = self.locations[digest] = (offset, len(data), len(text), digest, checkpoints)
+
+    def __setitem__(self, name, text):
+        self.put(name, text)
+
+    def pop(self, name, default=None):
+        """Forget a document. Its bytes are reclaimed when the store is compacted on save."""
+        return self.entries.pop(name, default)
+
+    def _read(self, start, end):
+        if end > self.mapped_size:
+            self._map()
+        return self.blob[start:end]
+
+    def _map(self):
+        # Map the blob again after it grew. The old mapping is left to the garbage collector,
+        # since a concurrent reader may still be slicing it
+        with open(self.blob_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size:
+                self.blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.mapped_size = size
+
+    def map(self):
+        """Map the blob now rather than on the first read, e.g. before its directory may be removed."""
+        self._map()
+
+    def live_bytes(self):
+        """Returns the number of blob bytes still referenced by a document."""
+        return sum(length for _, length in {entry[:2] for entry in self.entries.values()})
+
+    def save(self):
+        """Write the document entries to disk, first compacting the blob if most of it is unreferenced."""
+        os.makedirs(self.store_dir, exist_ok=True)
+        garbage = self.blob_size - self.live_bytes()
+        if garbage > (1 << 20) and garbage > self.blob_size // 2:
+            self._compact()
+
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "version": self.FORMAT_VERSION,
+                "blob_size": self.blob_size,
+                "entries": {
+                    name: [offset, length, chars, digest, checkpoints.tolist() if checkpoints is not None else None]
+                    for name, (offset, length, chars, digest, checkpoints) in self.entries.items()
+                },
+            }, f, separators=(',', ':'))
+        os.replace(tmp_path, self.meta_path)
+
+    def export(self, store_dir):
+        """Write a read-only copy of the saved store under store_dir, e.g. for an index snapshot.
+
+        The blob is hard-linked rather than copied where the filesystem allows. That is safe
+        because the blob only grows by appends, and compaction replaces it with a new file.
+        """
+        os.makedirs(store_dir, exist_ok=True)
+        blob_path = os.path.join(store_dir, "documents.bin")
+        try:
+            os.link(self.blob_path, blob_path)
+        except FileNotFoundError:
+            open(blob_path, 'wb').close()  # nothing stored yet
+        except OSError:
+            shutil.copyfile(self.blob_path, blob_path)
+        shutil.copyfile(self.meta_path, os.path.join(store_dir, "documents.json"))
+
+    def _compact(self):
+        """Rewrite the blob with only the referenced texts."""
+        tmp_path = f"{self.blob_path}.tmp"
+        moved = {}  # old (offset, length) -> new offset
+        entries = {}
+        with open(tmp_path, 'wb') as f:
+            for name, (offset, length, chars, digest, checkpoints) in self.entries.items():
+                if (offset, length) not in moved:
+                    moved[(offset, length)] = f.tell()
+                    f.write(self._read(offset, offset + length))
+                entries[name] = (moved[(offset, length)], length, chars, digest, checkpoints)
+            size = f.tell()
+
+        self.blob, self.mapped_size = None, 0
+        os.replace(tmp_path, self.blob_path)
+        self.entries = entries
+        self.locations = {entry[3]: entry for entry in entries.values()}
+        self.blob_size = size
+        logging.info(f"Compacted document store to {size} bytes.")
+
+    def load(self):
+        """Load the document entries and map the blob. Returns False if no usable store exists."""
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get("version") != self.FORMAT_VERSION:
+                return False
+
+            # Bytes past the saved size belong to texts added after the last save; they are
+            # left in place, since other workers may have the file mapped, and compacted away later
+            blob_size = os.path.getsize(self.blob_path)
+            if blob_size < meta["blob_size"]:
+                return False
+
+            self.entries = {
+                name: (offset, length, chars, digest, array('I', checkpoints) if checkpoints is not None else None)
+                for name, (offset, length, chars, digest, checkpoints) in meta["entries"].items()
+            }
+            self.locations = {entry[3]: entry for entry in self.entries.values()}
+            self.blob_size = blob_size
+            self.blob, self.mapped_size = None, 0
+            return True
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logging.error(f"Error loading document store '{self.meta_path}': {e}")
+            self.clear()
+            return False
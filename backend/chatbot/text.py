@@ -0,0 +1,73 @@
+import re
+import threading
+from functools import lru_cache
+
+# Word characters make up a term; punctuation and whitespace separate terms
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Common English words that carry no meaning for document search
+STOP_WORDS = frozenset("""
+a about above after again against all am an and any are as at be because been
+before being below between both but by can could did do does doing down during
+each few for from further had has have having he her here hers herself him
+himself his how i if in into is it its itself just me more most my myself no nor
+not now of off on once only or other our ours ourselves out over own same she
+should so some such than that the their theirs them themselves then there these
+they this those through to too under until up very was we were what when where
+which while who whom why will with would you your yours yourself yourselves
+""".split())
+
+
+_stemmer = None
+_stemmer_lock = threading.Lock()
+
+
+def load_stemmer():
+    """Returns the Porter stemmer, importing NLTK the first time; the import alone takes about a second."""
+    global _stemmer
+    if _stemmer is None:
+        with _stemmer_lock:
+            if _stemmer is None:
+                from nltk.stem import PorterStemmer
+                _stemmer = PorterStemmer()
+    return _stemmer
+
+
+@lru_cache(maxsize=100000)
+def stem(word):
+    """Reduces a word to its Porter stem, e.g. 'policies' -> 'polici'."""
+    return load_stemmer().stem(word)
+
+
+def tokenize(text):
+    """Yields (word, offset) pairs for every searchable word in the text."""
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        word = match.group(0)
+        if word not in STOP_WORDS:
+            yield word, match.start()
+
+
+def analyze(text):
+    """Yields (term, offset) pairs, where each term is the stem of a searchable word."""
+    for word, offset in tokenize(text):
+        yield stem(word), offset
+
+
+def query_terms(query):
+    """Returns the distinct terms of a query, in order of appearance."""
+    terms = []
+    for term, _ in analyze(query):
+        if term not in terms:
+            terms.append(term)
+    return terms
+
+
+def word_at(text, offset):
+    """Returns the word starting at a character offset of the text."""
+    match = TOKEN_PATTERN.match(text, offset)
+    return match.group(0) if match else ""
+
+
+def normalize_question(question):
+    """Lowercases a question and drops punctuation and extra spaces, so trivial variants compare equal."""
+    return " ".join(TOKEN_PATTERN.findall(question.lower()))
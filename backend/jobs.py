@@ -0,0 +1,111 @@
+import time
+import uuid
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+
+class JobQueue:
+    """Runs slow work such as document indexing on background threads and tracks each job's status."""
+
+    def __init__(self, num_workers=1, max_finished=1000):
+        """Start the worker threads. Only the newest max_finished finished jobs are kept for status lookups."""
+        self.tasks = queue.Queue()
+        self.jobs = OrderedDict()  # job id -> job record, oldest first
+        self.max_finished = max_finished
+        self.lock = threading.Lock()
+
+        self.workers = []
+        for number in range(num_workers):
+            worker = threading.Thread(target=self._work, name=f"inbot-job-worker-{number}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, func, *args, owner=None, **kwargs):
+        """Queue func(*args, **kwargs) and return the id of the new job."""
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self.jobs[job_id] = {
+                "id": job_id,
+                "owner": owner,
+                "status": "queued",
+                "result": None,
+                "error": None,
+                "created_at": datetime.utcnow().isoformat(),
+                "finished_at": None,
+            }
+        self.tasks.put((job_id, func, args, kwargs))
+        return job_id
+
+    def get(self, job_id):
+        """Returns a copy of a job's record, or None if it is unknown."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def pending(self):
+        """Returns the number of jobs that are queued or running."""
+        with self.lock:
+            return sum(1 for job in self.jobs.values() if job["status"] in ("queued", "running"))
+
+    def join(self):
+        """Block until every queued job has finished."""
+        self.tasks.join()
+
+    def _update(self, job_id, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields)
+
+    def _work(self):
+        while True:
+            job_id, func, args, kwargs = self.tasks.get()
+            self._update(job_id, status="running")
+            try:
+                result = func(*args, **kwargs)
+                self._update(job_id, status="succeeded", result=result, finished_at=datetime.utcnow().isoformat())
+            except Exception as e:
+                logging.error(f"Background job {job_id} failed: {e}")
+                self._update(job_id, status="failed", error=str(e), finished_at=datetime.utcnow().isoformat())
+            finally:
+                self._prune()
+                self.tasks.task_done()
+
+    def _prune(self):
+        # Forget the oldest finished jobs once there are too many of them
+        with self.lock:
+            finished = [job_id for job_id, job in self.jobs.items() if job["finished_at"]]
+            for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+                del self.jobs[job_id]
+
+
+class PeriodicTask:
+    """Calls a function on a background thread every few seconds, e.g. to sync files from storage."""
+
+    def __init__(self, interval, func, name="inbot-periodic"):
+        """Prepare the task; nothing runs until start() is called."""
+        self.interval = interval
+        self.func = func
+        self.name = name
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Run func now and then every interval seconds until stop() is called."""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Stop after the current run, if any."""
+        self.stopped.set()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            started = time.monotonic()
+            try:
+                self.func()
+            except Exception as e:
+                logging.error(f"Periodic task {self.name} failed: {e}")
+            self.stopped.wait(max(0.0, self.interval - (time.monotonic() - started)))
@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pytest
+
+# The tests import the backend packages the way app.py does, from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_API_KEY", "test")
+
+DOCUMENTS = {
+    "holidays.txt": "The holiday calendar lists every public holiday. Employees get twenty holiday days a year.",
+    "expenses.txt": "The expense limit for travel is five hundred euros. Expense reports need a manager approval.",
+    "security.txt": "Badges open the office doors. Report a lost badge to the security desk at once.",
+}
+
+
+class StubLLM:
+    """Stands in for the LLMGateway, answering every completion with a fixed text."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def complete(self, messages, model):
+        self.calls += 1
+        return f"Stub answer to: {messages[-1]['content'][-40:]}"
+
+    async def complete_async(self, messages, model):
+        return self.complete(messages, model)
+
+    def register_metrics(self, registry):
+        pass
+
+
+@pytest.fixture
+def make_chatbot(tmp_path):
+    """Returns a function building an INBOTChatbot over a few small text documents in tmp_path."""
+    from chatbot import INBOTChatbot
+
+    bots = []
+
+    def make(documents=None, documents_dir=None, **options):
+        documents_dir = documents_dir or str(tmp_path / "docs")
+        os.makedirs(documents_dir, exist_ok=True)
+        for name, text in (DOCUMENTS if documents is None else documents).items():
+            with open(os.path.join(documents_dir, name), "w", encoding="utf-8") as f:
+                f.write(text)
+        options.setdefault("ingest_workers", 0)
+        options.setdefault("llm", StubLLM())
+        bot = INBOTChatbot(documents_dir=documents_dir, **options)
+        bots.append(bot)
+        return bot
+
+    yield make
+    for bot in bots:
+        bot.ingestion.close()
+        bot.search_executor.shutdown(wait=False)
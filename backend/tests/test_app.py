@@ -0,0 +1,144 @@
+import io
+import os
+import json
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import StubLLM
+
+
+@pytest.fixture(scope="module")
+def inbot(tmp_path_factory):
+    """Imports the app and its ASGI entry point against a throwaway database and working directory."""
+    workspace = tmp_path_factory.mktemp("inbot")
+    patch = pytest.MonkeyPatch()
+    patch.setenv("INBOT_DATABASE_URL", f"sqlite:///{workspace / 'inbot.db'}")
+    patch.setenv("INBOT_LOCAL_STORAGE_DIR", str(workspace / "data" / "storage"))
+    patch.setenv("INBOT_STORAGE_SYNC_INTERVAL", str(24 * 3600))
+    patch.delenv("WEB_CONCURRENCY", raising=False)
+    patch.chdir(workspace)
+
+    import app as inbot_app
+    import asgi
+    from flask_jwt_extended import create_access_token
+
+    inbot_app.chatbot.llm = StubLLM()
+    assert inbot_app.chatbot.wait_until_ready(30)
+    inbot_app.job_queue.join()
+
+    def token(user_id):
+        with inbot_app.app.app_context():
+            return create_access_token(identity=str(user_id))
+
+    yield SimpleNamespace(module=inbot_app, asgi=asgi, client=inbot_app.app.test_client(), token=token)
+
+    inbot_app.storage_sync_task.stop()
+    inbot_app.activity_log.stop()
+    inbot_app.chatbot.ingestion.close()
+    patch.undo()
+
+
+def call(inbot, path, payload, user=None, token=None):
+    """POSTs a JSON payload to the ASGI application. Returns the status and decoded body."""
+    headers = [(b"content-type", b"application/json")]
+    token = token or (inbot.token(user) if user is not None else None)
+    if token:
+        headers.append((b"authorization", f"Bearer {token}".encode("latin-1")))
+    scope = {"type": "http", "method": "POST", "path": path, "headers": headers, "query_string": b""}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": json.dumps(payload).encode("utf-8"), "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(inbot.asgi.application(scope, receive, send))
+    return sent[0]["status"], json.loads(b"".join(message.get("body", b"") for message in sent[1:]))
+
+
+def upload(inbot, user, name, text):
+    response = inbot.client.post(
+        "/api/upload", data={"file": (io.BytesIO(text.encode("utf-8")), name)},
+        headers={"Authorization": f"Bearer {inbot.token(user)}"}, content_type="multipart/form-data")
+    assert response.status_code == 202
+    inbot.module.job_queue.join()
+    job = inbot.client.get(f"/api/jobs/{response.get_json()['job_id']}",
+                           headers={"Authorization": f"Bearer {inbot.token(user)}"}).get_json()["job"]
+    assert job["status"] == "succeeded", job["error"]
+
+
+def test_async_ask_searches_only_the_users_own_uploads(inbot):
+    upload(inbot, 1, "parking.txt", "Visitors book parking spaces through the reception desk.")
+
+    status, body = call(inbot, "/api/ask", {"question": "parking spaces reception"}, user=1)
+    assert status == 200 and "`parking.txt`" in body["response"]
+
+    for user in (2, None):
+        status, body = call(inbot, "/api/ask", {"question": "parking spaces reception"}, user=user)
+        assert status == 200 and "parking.txt" not in body["response"]
+
+    # The Flask route answers the same
+    response = inbot.client.post("/api/ask", json={"question": "parking spaces reception"},
+                                 headers={"Authorization": f"Bearer {inbot.token(1)}"})
+    assert response.get_json() == {"response": call(inbot, "/api/ask", {"question": "parking spaces reception"}, user=1)[1]["response"]}
+
+
+def test_async_batch_answers_in_the_order_of_the_questions(inbot):
+    upload(inbot, 3, "canteen.txt", "The canteen serves vegetarian lunches from noon.")
+    upload(inbot, 3, "gym.txt", "The gym opens at seven and closes at nine.")
+
+    status, body = call(inbot, "/api/ask/batch", {"questions": ["gym opens", "canteen vegetarian lunches"]}, user=3)
+    assert status == 200
+    assert ["`gym.txt`" in body["responses"][0], "`canteen.txt`" in body["responses"][1]] == [True, True]
+
+    assert call(inbot, "/api/ask/batch", {"questions": []}, user=3)[0] == 400
+
+
+def test_async_routes_reject_bad_tokens_and_questions(inbot):
+    assert call(inbot, "/api/ask", {"question": "anything"}, token="not-a-token")[0] == 401
+    assert call(inbot, "/api/chat", {"question": "  "}, user=1)[0] == 400
+    assert call(inbot, "/api/ask", ["not", "an", "object"])[0] == 400
+
+
+def test_users_uploading_the_same_file_name_keep_their_own(inbot):
+    upload(inbot, 4, "plan.txt", "The relocation plan moves the archive in April.")
+    upload(inbot, 5, "plan.txt", "The hiring plan adds two engineers in May.")
+
+    assert "`plan.txt`" in call(inbot, "/api/ask", {"question": "relocation archive"}, user=4)[1]["response"]
+    assert "`plan.txt`" in call(inbot, "/api/ask", {"question": "hiring engineers"}, user=5)[1]["response"]
+    assert "plan.txt" not in call(inbot, "/api/ask", {"question": "relocation archive"}, user=5)[1]["response"]
+
+    response = inbot.client.delete("/api/files/plan.txt", headers={"Authorization": f"Bearer {inbot.token(4)}"})
+    assert response.status_code == 200
+    assert "plan.txt" not in call(inbot, "/api/ask", {"question": "relocation archive"}, user=4)[1]["response"]
+    assert "`plan.txt`" in call(inbot, "/api/ask", {"question": "hiring engineers"}, user=5)[1]["response"]
+    assert os.listdir(inbot.module.UPLOAD_FOLDER).count("5__plan.txt") == 1
+
+
+def test_only_profiler_admins_control_the_profiler(inbot, monkeypatch):
+    monkeypatch.setattr(inbot.module, "PROFILER_ADMINS", {"6"})
+    for path in ("/api/profiler", "/api/profiler/stacks"):
+        assert inbot.client.get(path, headers={"Authorization": f"Bearer {inbot.token(7)}"}).status_code == 403
+
+    response = inbot.client.post("/api/profiler", json={"enabled": True, "interval": 0.00001},
+                                 headers={"Authorization": f"Bearer {inbot.token(6)}"})
+    inbot.module.profiler.stop()
+    assert response.status_code == 200 and response.get_json()["interval"] == 0.001
+
+
+def test_flask_routes_check_tokens_through_the_cache(inbot):
+    from auth.utils import token_cache
+
+    token = inbot.token(8)
+    headers = {"Authorization": f"Bearer {token}"}
+    hits = token_cache.counters["hits"]
+    assert inbot.client.get("/api/files", headers=headers).status_code == 200
+    assert inbot.client.get("/api/files", headers=headers).status_code == 200
+    assert token_cache.counters["hits"] > hits
+
+    token_cache.revoke(token)
+    assert inbot.client.get("/api/files", headers=headers).status_code != 200
+    assert call(inbot, "/api/ask", {"question": "anything"}, token=token)[0] == 401
@@ -0,0 +1,80 @@
+import time
+
+import jwt
+import pytest
+from flask_bcrypt import Bcrypt
+
+from auth.utils import PasswordHasher, VerifiedTokenCache, RevokedTokenError
+
+
+def test_password_hasher_verifies_and_asks_to_rehash_on_a_new_cost():
+    hasher = PasswordHasher(Bcrypt(), rounds=4)
+    password_hash = hasher.hash("Secret-123")
+    assert hasher.check(password_hash, "Secret-123")
+    assert not hasher.check(password_hash, "Secret-124")
+    assert not hasher.needs_rehash(password_hash)
+
+    hasher.rounds = 5
+    assert hasher.needs_rehash(password_hash)
+    assert hasher.check(password_hash, "Secret-123")  # old hashes still verify until they are rehashed
+    assert not hasher.needs_rehash(hasher.hash("Secret-123"))
+    assert hasher.needs_rehash("not a bcrypt hash")
+
+
+SECRET = "test-secret-of-at-least-32-bytes!"
+
+
+def make_token(**claims):
+    return jwt.encode({"sub": "1", **claims}, SECRET, algorithm="HS256")
+
+
+def decoder(calls):
+    def decode(token):
+        calls.append(token)
+        return jwt.decode(token, SECRET, algorithms=["HS256"])
+    return decode
+
+
+def test_token_cache_reuses_claims_until_the_token_or_ttl_expires(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    cache = VerifiedTokenCache(ttl=300)
+    calls = []
+    short_lived = make_token(exp=1060)
+    long_lived = make_token(exp=10 ** 10)
+
+    for _ in range(2):
+        assert cache.claims(short_lived, lambda token: {"sub": "1", "exp": 1060}) == {"sub": "1", "exp": 1060}
+        cache.claims(long_lived, decoder(calls))
+    assert len(calls) == 1 and cache.counters == {"hits": 2, "misses": 2}
+
+    now[0] = 1061  # past the short-lived token's expiry
+    with pytest.raises(jwt.ExpiredSignatureError):
+        cache.claims(short_lived, decoder([]))
+    cache.claims(long_lived, decoder(calls))
+    assert len(calls) == 1
+
+    now[0] = 1301  # past the ttl
+    cache.claims(long_lived, decoder(calls))
+    assert len(calls) == 2
+
+
+def test_token_cache_evicts_the_least_recently_used():
+    cache = VerifiedTokenCache(max_entries=2)
+    calls = []
+    first, second, third = (make_token(n=n) for n in range(3))
+    for token in (first, second, first, third):
+        cache.claims(token, decoder(calls))
+    cache.claims(first, decoder(calls))
+    cache.claims(second, decoder(calls))
+    assert calls == [first, second, third, second]
+
+
+def test_revoked_tokens_are_refused():
+    cache = VerifiedTokenCache()
+    token = make_token(exp=int(time.time()) + 60)
+    cache.claims(token, decoder([]))
+    cache.revoke(token)
+    with pytest.raises(RevokedTokenError):
+        cache.claims(token, decoder([]))
+    assert cache.stats()["size"] == 0
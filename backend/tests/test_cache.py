@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+from chatbot.cache import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = TTLCache(ttl=60)
+    cache.set("question", "answer")
+    clock[0] += 59
+    assert cache.get("question") == "answer"
+    clock[0] += 1
+    assert cache.get("question", "missing") == "missing"
+    assert len(cache) == 0
+    assert cache.stats()["expirations"] == 1 and cache.stats()["hits"] == 1
+
+
+def test_the_least_recently_used_entry_is_evicted_at_capacity():
+    cache = TTLCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # b is now the least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_clear_invalidates_memory_and_disk(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = TTLCache(path=path)
+    cache.set("question", {"answer": 42})
+
+    # Another worker finds the entry on disk
+    assert TTLCache(path=path).get("question") == {"answer": 42}
+
+    cache.clear()
+    assert cache.get("question") is None
+    assert TTLCache(path=path).get("question") is None
+
+
+def test_expired_entries_are_not_read_back_from_disk(tmp_path, clock):
+    path = str(tmp_path / "cache.db")
+    TTLCache(ttl=60, path=path).set("question", "answer")
+    clock[0] += 61
+    cache = TTLCache(ttl=60, path=path)
+    assert cache.get("question") is None
+    assert cache.stats()["expirations"] == 1
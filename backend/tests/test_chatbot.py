@@ -0,0 +1,113 @@
+import os
+import asyncio
+import threading
+
+from chatbot.chatbot import ERROR_ANSWER
+
+
+def test_ask_question_async_answers_from_documents(make_chatbot):
+    bot = make_chatbot()
+    answer = asyncio.run(bot.ask_question_async("What is the expense limit?"))
+    assert answer != ERROR_ANSWER
+    assert "expenses.txt" in answer
+
+
+def test_ask_questions_async_keeps_question_order(make_chatbot):
+    bot = make_chatbot()
+    answers = asyncio.run(bot.ask_questions_async(["lost badge", "holiday calendar"]))
+    assert "security.txt" in answers[0]
+    assert "holidays.txt" in answers[1]
+
+
+def test_ask_questions_async_runs_one_at_a_time_below_one(make_chatbot):
+    bot = make_chatbot()
+    answers = asyncio.run(asyncio.wait_for(bot.ask_questions_async(["lost badge"], max_concurrency=0), 10))
+    assert "security.txt" in answers[0]
+
+
+def test_ask_question_async_falls_back_to_llm(make_chatbot):
+    bot = make_chatbot()
+    answer = asyncio.run(bot.ask_question_async("zzyzx qwertyuiop"))
+    assert answer != ERROR_ANSWER
+    assert "Stub answer" in answer
+    assert bot.llm.calls == 1
+
+
+def test_snapshot_reader_answers_with_rag_after_a_new_snapshot(make_chatbot, tmp_path):
+    writer = make_chatbot(index_role='writer')
+    reader = make_chatbot(documents={}, documents_dir=writer.documents_dir, index_role='reader',
+                          answer_mode='rag', snapshot_poll=0)
+    assert reader.snapshot is not None
+
+    # A new snapshot the reader has not switched to yet, so answering swaps it in
+    with open(os.path.join(writer.documents_dir, "parking.txt"), "w", encoding="utf-8") as f:
+        f.write("Parking permits for the garage are handed out by the facilities team.")
+    assert writer.index_file("parking.txt")
+    writer.save_index()
+
+    answers = []
+    thread = threading.Thread(target=lambda: answers.append(reader.ask_question("Who hands out parking permits?")),
+                              daemon=True)  # a deadlocked thread must not keep the test run alive
+    thread.start()
+    thread.join(10)
+    assert answers, "the reader deadlocked"
+    answer = answers[0]
+    assert answer != ERROR_ANSWER
+    assert "parking.txt" in answer
+    assert len(reader.snapshot) == 4
+
+
+def test_answer_cache_key_follows_ownership_changes(make_chatbot):
+    bot = make_chatbot()
+    bot.set_document_owner("expenses.txt", 7)
+    before = bot.answer_cache_key("What is the expense limit?", user=7)
+    assert bot.answer_cache_key("What is the expense limit?", user=8) != before
+
+    bot.set_document_owner("expenses.txt", 8)
+    assert bot.answer_cache_key("What is the expense limit?", user=7) != before
+    bot.set_document_owner("expenses.txt", 7)
+    assert bot.answer_cache_key("What is the expense limit?", user=7) == before  # same documents, same key
+
+
+def test_owned_file_names_keep_users_apart_and_display_as_uploaded():
+    from chatbot.chatbot import owned_file_name, display_name
+
+    assert owned_file_name(1, "report.pdf") != owned_file_name(2, "report.pdf")
+    assert display_name(owned_file_name(1, "report.pdf")) == "report.pdf"
+    assert display_name("shared__notes.txt") == "shared__notes.txt"
+
+
+def found(bot, query, user=None):
+    """Names of the documents of the passages a search returns."""
+    options = {} if user is None else {"user": user}
+    return {passage["file_name"] for passage in bot.retrieve(query, **options)}
+
+
+def test_search_cache_is_invalidated_by_uploads_and_removals(make_chatbot):
+    bot = make_chatbot()
+    assert "parking.txt" not in found(bot, "parking permits garage")
+    assert found(bot, "lost badge security desk") == {"security.txt"}
+    hits = bot.search_cache.stats()["hits"]
+    assert found(bot, "lost badge security desk") == {"security.txt"}
+    assert bot.search_cache.stats()["hits"] == hits + 1
+
+    with open(os.path.join(bot.documents_dir, "parking.txt"), "w", encoding="utf-8") as f:
+        f.write("Parking permits for the garage are handed out by the facilities team.")
+    assert bot.index_file("parking.txt")
+    assert "parking.txt" in found(bot, "parking permits garage")
+
+    bot.remove_document("security.txt")
+    assert "security.txt" not in found(bot, "lost badge security desk")
+
+
+def test_search_cache_keeps_each_users_results_apart(make_chatbot):
+    bot = make_chatbot()
+    bot.set_document_owner("expenses.txt", 7)
+    assert found(bot, "expense limit travel", user=7) == {"expenses.txt"}
+    assert "expenses.txt" not in found(bot, "expense limit travel", user=8)
+    assert found(bot, "expense limit travel", user=7) == {"expenses.txt"}
+
+    # Handing the document to another user invalidates the entries cached for both
+    bot.set_document_owner("expenses.txt", 8)
+    assert "expenses.txt" not in found(bot, "expense limit travel", user=7)
+    assert found(bot, "expense limit travel", user=8) == {"expenses.txt"}
@@ -0,0 +1,36 @@
+from chatbot.chunking import chunk_spans
+
+WORDS = " ".join(f"word{number:03d}" for number in range(200))  # 1599 characters of 7-letter words
+
+
+def test_short_and_empty_texts():
+    assert chunk_spans("") == []
+    assert chunk_spans("a few words") == [(0, 11)]
+
+
+def test_passages_cover_the_text_and_overlap():
+    spans = chunk_spans(WORDS, size=100, overlap=20)
+    assert spans[0][0] == 0 and spans[-1][1] == len(WORDS)
+    for (start, end), (next_start, next_end) in zip(spans, spans[1:]):
+        assert end - start <= 100
+        assert start < next_start < end < next_end  # consecutive passages share some text
+        assert end - next_start <= 20
+
+
+def test_boundaries_never_cut_a_word():
+    for start, end in chunk_spans(WORDS, size=100, overlap=20):
+        assert start == 0 or WORDS[start - 1] == " "
+        assert end == len(WORDS) or WORDS[end] == " "
+
+
+def test_overlap_is_capped_at_a_quarter_of_the_size():
+    spans = chunk_spans(WORDS, size=100, overlap=90)
+    assert all(end - next_start <= 25 for (_, end), (next_start, _) in zip(spans, spans[1:]))
+
+    # Any offset falls in at most two passages
+    for offset in range(len(WORDS)):
+        assert sum(start <= offset < end for start, end in spans) <= 2
+
+
+def test_text_without_spaces_is_cut_at_the_size():
+    assert chunk_spans("x" * 250, size=100, overlap=20) == [(0, 100), (80, 180), (160, 250)]
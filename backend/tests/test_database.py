@@ -0,0 +1,47 @@
+import sqlite3
+
+from sqlalchemy import create_engine, inspect, text
+
+from auth.database import upgrade_database, MIGRATIONS
+
+# The schema of databases made by earlier versions, which recreated their tables on every start
+OLD_SCHEMA = """
+CREATE TABLE user (id INTEGER NOT NULL, name VARCHAR(100) NOT NULL, email VARCHAR(100) NOT NULL,
+    password_hash VARCHAR(200) NOT NULL, PRIMARY KEY (id), UNIQUE (email));
+CREATE TABLE uploaded_file (id INTEGER NOT NULL, filename VARCHAR(255) NOT NULL, filepath VARCHAR(255) NOT NULL,
+    uploaded_at DATETIME, PRIMARY KEY (id));
+INSERT INTO user (id, name, email, password_hash) VALUES (1, 'Ada', 'ada@example.com', 'hash');
+INSERT INTO uploaded_file (id, filename, filepath, uploaded_at) VALUES (1, 'plan.txt', 'data/plan.txt', NULL);
+"""
+
+
+def columns(engine, table):
+    return {column["name"] for column in inspect(engine).get_columns(table)}
+
+
+def indexes(engine, table):
+    return {index["name"] for index in inspect(engine).get_indexes(table)}
+
+
+def test_new_database_gets_the_whole_schema(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'new.db'}")
+    assert upgrade_database(engine) == len(MIGRATIONS)
+    assert "user_id" in columns(engine, "uploaded_file")
+    assert {"ix_uploaded_file_user_filename", "ix_uploaded_file_user_uploaded_at"} <= indexes(engine, "uploaded_file")
+    assert upgrade_database(engine) == 0
+
+
+def test_existing_database_keeps_its_data_and_gains_columns_and_indexes(tmp_path):
+    path = tmp_path / "old.db"
+    with sqlite3.connect(path) as connection:
+        connection.executescript(OLD_SCHEMA)
+    engine = create_engine(f"sqlite:///{path}")
+
+    assert upgrade_database(engine) == len(MIGRATIONS)
+    assert {"user_id", "uploaded_at"} <= columns(engine, "uploaded_file")
+    assert {"bio", "avatar", "created_at"} <= columns(engine, "user")
+    assert {"ix_uploaded_file_user_filename", "ix_uploaded_file_user_uploaded_at"} <= indexes(engine, "uploaded_file")
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT filename FROM uploaded_file")).scalars().all() == ["plan.txt"]
+        assert connection.execute(text("SELECT email FROM user")).scalars().all() == ["ada@example.com"]
+
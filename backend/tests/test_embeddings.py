@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+
+from chatbot.embeddings import VectorStore
+
+
+def unit_vectors(count, dim=4, seed=0):
+    vectors = np.random.default_rng(seed).random((count, dim), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_vector_store_saves_by_appending_rows(tmp_path):
+    store = VectorStore(str(tmp_path), dim=4)
+    store.add([("a.txt", 0, 10), ("a.txt", 10, 20)], unit_vectors(2))
+    store.save("test")
+    with open(store.vectors_path, 'rb') as f:
+        first_save = f.read()
+
+    store.remove_document("a.txt")
+    store.add([("b.txt", 0, 10)], unit_vectors(1, seed=1))
+    store.save("test")
+    with open(store.vectors_path, 'rb') as f:
+        assert f.read()[:len(first_save)] == first_save
+    assert os.path.getsize(store.vectors_path) == 3 * 4 * 4
+
+    loaded = VectorStore(str(tmp_path), dim=4)
+    assert loaded.load("test")
+    assert loaded.documents() == {"b.txt"} and len(loaded) == 1 and loaded.garbage() == 2
+    assert loaded.search(unit_vectors(1, seed=1), k=3)[0][0][0] == ("b.txt", 0, 10)
+
+    loaded.compact("test")
+    assert os.path.getsize(store.vectors_path) == 4 * 4 and loaded.garbage() == 0
+    assert loaded.search(unit_vectors(1, seed=1), k=3)[0][0][0] == ("b.txt", 0, 10)
+
+
+def test_vector_store_drops_rows_of_an_interrupted_save(tmp_path):
+    store = VectorStore(str(tmp_path), dim=4)
+    store.add([("a.txt", 0, 10)], unit_vectors(1))
+    store.save("test")
+    with open(store.vectors_path, 'ab') as f:
+        f.write(b"\0" * 16)  # rows appended by a save that never wrote its keys
+
+    loaded = VectorStore(str(tmp_path), dim=4)
+    assert loaded.load("test")
+    loaded.add([("b.txt", 0, 10)], unit_vectors(1, seed=1))
+    loaded.save("test")
+    assert os.path.getsize(store.vectors_path) == 2 * 4 * 4
+    assert loaded.search(unit_vectors(1, seed=1), k=1)[0][0][0] == ("b.txt", 0, 10)
+
+
+def test_embedding_searches_leave_saving_to_the_index(make_chatbot):
+    bot = make_chatbot(retriever='embedding')
+    store = bot.embedding_retriever.store
+    assert store.documents() == {"holidays.txt", "expenses.txt", "security.txt"}
+    saved_size = os.path.getsize(store.vectors_path)
+
+    with open(os.path.join(bot.documents_dir, "parking.txt"), "w", encoding="utf-8") as f:
+        f.write("Parking permits for the garage are handed out by the facilities team.")
+    assert bot.index_file("parking.txt")
+    bot.embedding_retriever.search(["parking permits"], k=1)
+    assert "parking.txt" in store.documents() and os.path.getsize(store.vectors_path) == saved_size
+
+    bot.save_index()
+    assert os.path.getsize(store.vectors_path) > saved_size and not bot.embedding_retriever.dirty
@@ -0,0 +1,42 @@
+from chatbot.fuzzy import FuzzyVocabulary, edit_distance
+from chatbot.index import InvertedIndex
+
+
+def test_edit_distance_counts_transpositions_as_one_edit():
+    assert edit_distance("holiday", "holiday", 2) == 0
+    assert edit_distance("hoilday", "holiday", 2) == 1   # adjacent transposition
+    assert edit_distance("holliday", "holiday", 2) == 1  # insertion
+    assert edit_distance("holday", "holiday", 2) == 1    # deletion
+    assert edit_distance("halidey", "holiday", 2) == 2   # two substitutions
+    assert edit_distance("expense", "holiday", 2) == 3   # anything past max_distance is max_distance + 1
+    assert edit_distance("holidayseason", "holiday", 2) == 3
+
+
+def fuzzy_vocabulary(tmp_path, **documents):
+    index = InvertedIndex(str(tmp_path))
+    for name, text in documents.items():
+        index.add_document(name, text)
+    return index, FuzzyVocabulary(index)
+
+
+def test_lookup_finds_transpositions_and_insertions(tmp_path):
+    index, vocabulary = fuzzy_vocabulary(tmp_path, a="holiday calendar", b="expense report")
+    assert vocabulary.candidates("calednar") == {"calendar": 1}
+    assert vocabulary.candidates("expensse") == {"expens": 2}  # against the stemmed term
+    assert vocabulary.best_match("reportt", lambda term, candidate: 90) == ("report", 90)
+
+
+def test_lookup_of_an_unrelated_term_finds_nothing(tmp_path):
+    _, vocabulary = fuzzy_vocabulary(tmp_path, a="holiday calendar", b="expense report")
+    assert vocabulary.candidates("kubernetes") == {}
+    assert vocabulary.best_match("kubernetes", lambda term, candidate: 100) is None
+
+
+def test_lookup_follows_index_changes(tmp_path):
+    index, vocabulary = fuzzy_vocabulary(tmp_path, a="holiday calendar")
+    assert vocabulary.candidates("calednar") == {"calendar": 1}
+
+    index.remove_document("a")
+    index.add_document("b", "parking garage")
+    assert vocabulary.candidates("calednar") == {}
+    assert vocabulary.candidates("garaeg") == {"garag": 1}
@@ -0,0 +1,98 @@
+import os
+import json
+import pickle
+import threading
+from array import array
+
+from chatbot.index import InvertedIndex
+
+
+def snapshot(index):
+    return ({term: {doc_id: list(offsets) for doc_id, offsets in postings.items()}
+             for term, postings in index.postings.items()}, index.doc_lengths, index.chunks)
+
+
+def reloaded(index_dir):
+    index = InvertedIndex(index_dir)
+    assert index.load()
+    return index
+
+
+def test_saves_append_only_the_changed_documents(tmp_path):
+    index = InvertedIndex(str(tmp_path))
+    index.add_document("a.txt", "Alpha quarterly report for the board.")
+    index.add_document("b.txt", "Beta release notes and the board minutes.")
+    index.save()
+    index.add_document("c.txt", "Gamma budget for the board.")
+    index.add_document("a.txt", "Alpha annual report.")
+    index.remove_document("b.txt")
+    index.save()
+
+    with open(os.path.join(index.segments_dir, "00000002.json"), encoding="utf-8") as f:
+        header = json.load(f)
+    assert sorted(doc_id for doc_id, *_ in header["documents"]) == ["a.txt", "c.txt"]
+    assert header["removed"] == ["b.txt"]
+    assert snapshot(reloaded(str(tmp_path))) == snapshot(index)
+
+
+def test_documents_from_workers_share_one_string_per_term(tmp_path):
+    index = InvertedIndex(str(tmp_path))
+    for doc_id in ("a.txt", "b.txt"):
+        # As the ingestion workers send it back: pickled, with its own copy of every term
+        analysis = pickle.loads(pickle.dumps(({"quarterli": array('I', [0])}, [(0, 9)])))
+        index.add_document(doc_id, "Quarterly", analysis)
+
+    assert index.doc_terms["a.txt"][0] is index.doc_terms["b.txt"][0]
+    assert next(iter(index.postings)) is index.doc_terms["b.txt"][0]
+
+
+def test_segments_are_compacted_once_mostly_superseded(tmp_path, monkeypatch):
+    monkeypatch.setattr(InvertedIndex, "COMPACT_AFTER", 4)
+    index = InvertedIndex(str(tmp_path))
+    for version in range(6):
+        index.add_document("a.txt", f"Alpha report number {version}.")
+        index.save()
+
+    assert len(os.listdir(index.segments_dir)) < 2 * 6
+    assert snapshot(reloaded(str(tmp_path))) == snapshot(index)
+
+
+def test_clear_starts_a_new_base_segment(tmp_path):
+    index = InvertedIndex(str(tmp_path))
+    index.add_document("a.txt", "Alpha report.")
+    index.save()
+    index.clear()
+    index.add_document("b.txt", "Beta report.")
+    index.save()
+
+    assert sorted(os.listdir(index.segments_dir)) == ["00000002.bin", "00000002.json"]
+    assert list(reloaded(str(tmp_path)).doc_lengths) == ["b.txt"]
+
+
+def test_save_index_serializes_without_the_write_lock(make_chatbot):
+    bot = make_chatbot()
+    bot.index_dirty = True
+    writing, written = threading.Event(), threading.Event()
+    write_segment = bot.inverted_index.write_segment
+
+    def slow_write_segment(changes):
+        writing.set()
+        assert written.wait(5)
+        write_segment(changes)
+
+    bot.inverted_index.write_segment = slow_write_segment
+    saver = threading.Thread(target=bot.save_index)
+    saver.start()
+    assert writing.wait(5)
+    try:
+        # Indexing goes on while the segment is written
+        remover = threading.Thread(target=bot.remove_document, args=("holidays.txt",), daemon=True)
+        remover.start()
+        remover.join(5)
+        assert not remover.is_alive()
+    finally:
+        written.set()
+        saver.join(5)
+
+    bot.save_index()
+    assert "holidays.txt" not in reloaded(bot.index_dir)
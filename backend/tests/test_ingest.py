@@ -0,0 +1,54 @@
+import os
+import time
+
+import pytest
+
+from chatbot import ingest
+from chatbot.ingest import IngestionPipeline
+
+
+def fake_parse_and_clean(file_path):
+    """Stands in for parse_and_clean in the forked workers: hangs or crashes on files named so."""
+    name = os.path.basename(file_path)
+    if name.startswith("hang"):
+        time.sleep(60)
+    if name.startswith("crash"):
+        os._exit(1)
+    return f"text of {name}", None, None, None
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    monkeypatch.setattr(ingest, "parse_and_clean", fake_parse_and_clean)
+    pipeline = IngestionPipeline(max_workers=2, timeout=1)
+    yield pipeline
+    pipeline.close()
+
+
+def outcomes(pipeline, file_paths):
+    return {result.file_path: result.cleaned_text or result.error for result in pipeline.run(file_paths)}
+
+
+def test_a_hung_file_times_out_alone(pipeline):
+    started = time.monotonic()
+    assert outcomes(pipeline, ["a.txt", "hang.txt", "b.txt", "c.txt"]) == {
+        "a.txt": "text of a.txt",
+        "hang.txt": "Parsing timed out after 1 seconds.",
+        "b.txt": "text of b.txt",
+        "c.txt": "text of c.txt",
+    }
+    assert time.monotonic() - started < 10
+
+    # The pool was replaced and goes on serving
+    assert outcomes(pipeline, ["d.txt"]) == {"d.txt": "text of d.txt"}
+
+
+def test_a_crashing_file_is_isolated_and_the_others_are_retried(pipeline):
+    assert outcomes(pipeline, ["a.txt", "crash.txt", "b.txt", "c.txt", "d.txt"]) == {
+        "a.txt": "text of a.txt",
+        "crash.txt": "The parser crashed on this file.",
+        "b.txt": "text of b.txt",
+        "c.txt": "text of c.txt",
+        "d.txt": "text of d.txt",
+    }
+    assert outcomes(pipeline, ["e.txt"]) == {"e.txt": "text of e.txt"}
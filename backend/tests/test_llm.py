@@ -0,0 +1,174 @@
+import asyncio
+import threading
+
+import groq
+import httpx
+import pytest
+
+from chatbot import llm
+from chatbot.llm import CircuitBreaker, CircuitOpenError, LLMGateway, SingleFlight
+
+REQUEST = httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions")
+
+
+def connection_error():
+    return groq.APIConnectionError(request=REQUEST)
+
+
+def rate_limit_error(retry_after):
+    response = httpx.Response(429, headers={"retry-after": str(retry_after)}, request=REQUEST)
+    return groq.RateLimitError("rate limited", response=response, body=None)
+
+
+def failing(error, attempts):
+    def attempt():
+        attempts.append(error)
+        raise error
+    return attempt
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_breaker_opens_probes_and_closes(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    # After the reset timeout one probe goes through while the others are still refused
+    clock[0] += 30
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock[0] += 30
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+
+def test_cancelled_probe_lets_another_probe_through(clock):
+    gateway = LLMGateway(failure_threshold=1, reset_timeout=30, max_retries=0)
+    with pytest.raises(groq.APIConnectionError):
+        gateway.call(failing(connection_error(), []))
+    assert gateway.breaker.state == CircuitBreaker.OPEN
+    clock[0] += 30
+
+    async def main():
+        started = asyncio.Event()
+
+        async def hang():
+            started.set()
+            await asyncio.sleep(3600)
+
+        probe = asyncio.ensure_future(gateway.call_async(hang))
+        await started.wait()
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        async def answer():
+            return "ok"
+
+        return await gateway.call_async(answer)
+
+    assert asyncio.run(main()) == "ok"
+    assert gateway.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_retryable_errors_are_retried_with_capped_backoff(monkeypatch):
+    delays = []
+    monkeypatch.setattr(llm.time, "sleep", delays.append)
+    gateway = LLMGateway(max_retries=3, backoff=0.5, max_backoff=1.5)
+    errors = [connection_error(), connection_error(), rate_limit_error(1)]
+
+    def attempt():
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    assert gateway.call(attempt) == "ok"
+    assert len(delays) == 3
+    assert 0 <= delays[0] <= 0.5 and 0 <= delays[1] <= 1.0
+    assert 1 <= delays[2] <= 1.5  # at least the Retry-After the API asked for
+    assert gateway.counters["retries"] == 3 and gateway.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_retries_give_up_and_other_errors_are_not_retried(monkeypatch):
+    monkeypatch.setattr(llm.time, "sleep", lambda delay: None)
+    gateway = LLMGateway(max_retries=2)
+    attempts = []
+    with pytest.raises(groq.APIConnectionError):
+        gateway.call(failing(connection_error(), attempts))
+    assert len(attempts) == 3
+
+    attempts.clear()
+    with pytest.raises(ValueError):
+        gateway.call(failing(ValueError("bad request"), attempts))
+    assert len(attempts) == 1
+
+
+def test_single_flight_coalesces_identical_calls():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return "answer"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("key", slow))) for _ in range(4)]
+    threads[0].start()
+    while not flight.calls:
+        pass
+    for thread in threads[1:]:
+        thread.start()
+    while flight.coalesced < 3:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ["answer"] * 4 and len(calls) == 1 and not flight.calls
+
+
+def test_single_flight_survives_the_first_caller_being_cancelled():
+    flight = SingleFlight()
+
+    async def main():
+        release = asyncio.Event()
+        calls = []
+
+        async def slow():
+            calls.append(1)
+            await release.wait()
+            return "answer"
+
+        leader = asyncio.ensure_future(flight.do_async("key", slow))
+        followers = [asyncio.ensure_future(flight.do_async("key", slow)) for _ in range(2)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*followers), calls
+
+    results, calls = asyncio.run(main())
+    assert results == ["answer", "answer"] and len(calls) == 1
+    assert flight.coalesced == 2 and not flight.calls
@@ -0,0 +1,59 @@
+import threading
+
+from chatbot.locks import ReadWriteLock
+
+
+def test_readers_share_the_lock():
+    lock = ReadWriteLock()
+    both_reading = threading.Barrier(2, timeout=5)
+
+    def read():
+        with lock.read_lock():
+            both_reading.wait()
+
+    thread = threading.Thread(target=read)
+    thread.start()
+    read()
+    thread.join()
+
+
+def test_writer_waits_for_readers_and_blocks_new_ones():
+    lock = ReadWriteLock()
+    events = []
+    writer_waiting = threading.Event()
+
+    def write():
+        writer_waiting.set()
+        with lock.write_lock():
+            events.append("write")
+
+    def read():
+        with lock.read_lock():
+            events.append("late read")
+
+    with lock.read_lock():
+        writer = threading.Thread(target=write)
+        writer.start()
+        writer_waiting.wait(5)
+        while not lock.waiting_writers:
+            pass
+        reader = threading.Thread(target=read)
+        reader.start()
+        reader.join(0.1)
+        assert events == []  # the late reader queues behind the waiting writer
+    writer.join(5)
+    reader.join(5)
+    assert events == ["write", "late read"]
+
+
+def test_lock_is_reentrant_and_the_writer_may_read():
+    lock = ReadWriteLock()
+    with lock.write_lock():
+        with lock.write_lock():
+            with lock.read_lock():
+                assert not lock.reading()
+    with lock.read_lock():
+        with lock.read_lock():
+            assert lock.reading()
+        assert lock.reading()
+    assert not lock.reading()
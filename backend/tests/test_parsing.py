@@ -0,0 +1,81 @@
+import re
+import random
+
+from chatbot import parsing
+from chatbot.chunking import chunk_spans
+from chatbot.ingest import parse_and_clean
+from chatbot.parsing import clean_text, iter_document_parts
+from chatbot.text import analyze
+
+
+def old_clean_text(text):
+    """The cleaner clean_text replaced: five passes over the whole text."""
+    cleaned_text = text.lower()
+    cleaned_text = cleaned_text.replace('•', '\n- ').replace('●', '\n- ')
+    cleaned_text = re.sub(r'([a-z])([A-Z])', r'\1 \2', cleaned_text)
+    cleaned_text = re.sub(r'(?<!\s)([.,!?%])', r' \1', cleaned_text)
+    return re.sub(r'\s+', ' ', cleaned_text).strip()
+
+
+def test_clean_text_matches_the_old_cleaner():
+    samples = [
+        "", "   ", "Hello, World!", "Total: 50%.", "a..b", "•item one●item two", "• spaced bullet",
+        "CamelCase words", "line\nbreaks\tand  tabs", "trailing space ", "?!", "x,y,z", "ÄÖÜ straße.",
+    ]
+    rng = random.Random(0)
+    alphabet = "aZ9 .,!?%•●-\n\té"
+    samples += ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40))) for _ in range(5000)]
+    for sample in samples:
+        assert clean_text(sample) == old_clean_text(sample), sample
+
+
+def test_cleaning_pieces_cut_at_whitespace_matches_cleaning_the_whole():
+    rng = random.Random(1)
+    alphabet = "ab .,%•\n"
+    for _ in range(2000):
+        text = "".join(rng.choice(alphabet) for _ in range(60))
+        cuts = sorted({i for i, char in enumerate(text) if char.isspace() and rng.random() < 0.5})
+        pieces = [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+        joined = " ".join(part for part in map(clean_text, pieces) if part)
+        assert joined == clean_text(text), text
+
+
+def test_txt_files_stream_in_blocks_that_end_at_whitespace(tmp_path, monkeypatch):
+    monkeypatch.setattr(parsing, "TXT_BLOCK_SIZE", 16)
+    text = "The expense limit is five hundred euros.\nReports need approval. " + "x" * 40 + " done"
+    path = tmp_path / "policy.txt"
+    path.write_text(text)
+
+    parts = list(iter_document_parts(str(path)))
+    assert len(parts) > 3 and "".join(parts) == text
+    # Blocks end at whitespace, unless a word is longer than a whole block
+    assert all(part[-1].isspace() or not part.strip("x") for part in parts[:-1])
+
+
+def test_parse_and_clean_matches_cleaning_and_analyzing_the_whole_document(tmp_path, monkeypatch):
+    monkeypatch.setattr(parsing, "TXT_BLOCK_SIZE", 32)
+    text = "Badges open the office doors.\n\n• Report a lost badge to the Security desk at once!\n" * 5
+    path = tmp_path / "security.txt"
+    path.write_text(text)
+
+    cleaned_text, error, (positions, spans), timings = parse_and_clean(str(path))
+    assert error is None and cleaned_text == old_clean_text(text)
+    expected = {}
+    for term, offset in analyze(cleaned_text):
+        expected.setdefault(term, []).append(offset)
+    assert {term: list(offsets) for term, offsets in positions.items()} == expected
+    assert spans == chunk_spans(cleaned_text)
+    assert set(timings) == {"parse", "clean", "analyze"}
+
+
+def test_docx_paragraphs_are_streamed(tmp_path):
+    from docx import Document
+
+    document = Document()
+    for paragraph in ("First paragraph.", "Second, with a bullet • here."):
+        document.add_paragraph(paragraph)
+    path = str(tmp_path / "notes.docx")
+    document.save(path)
+
+    assert list(iter_document_parts(path)) == ["First paragraph.", "Second, with a bullet • here."]
+    assert parse_and_clean(path)[0] == "first paragraph . second , with a bullet - here ."
@@ -0,0 +1,22 @@
+import time
+
+from chatbot.profiling import SamplingProfiler
+
+
+def test_interval_is_clamped():
+    assert SamplingProfiler(interval=0).interval == SamplingProfiler.MIN_INTERVAL
+    profiler = SamplingProfiler(interval=0.01)
+    profiler.start(interval=60)
+    profiler.stop()
+    assert profiler.interval == SamplingProfiler.MAX_INTERVAL
+
+
+def test_distinct_stacks_are_capped():
+    profiler = SamplingProfiler(interval=0.001, max_stacks=1)
+    profiler.stacks[("main (app.py:1)",)] = 1
+    profiler.start()
+    deadline = time.monotonic() + 5
+    while profiler.samples < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    profiler.stop()
+    assert set(profiler.stacks) == {("main (app.py:1)",), SamplingProfiler.OTHER_STACKS}
@@ -0,0 +1,44 @@
+from chatbot.rag import build_messages, count_tokens, pack_passages
+
+TEXTS = {
+    "a.txt": "one two three four five six seven eight nine ten",
+    "b.txt": "alpha beta gamma delta epsilon",
+}
+
+
+def slice_text(file_name, start, end):
+    return TEXTS[file_name][start:end]
+
+
+def test_count_tokens_counts_words_punctuation_and_long_words():
+    assert count_tokens("Hello, world!") == 4
+    assert count_tokens("internationalization") == 3  # 20 characters: one token, plus one per 8 more characters
+
+
+def test_passages_are_packed_best_first_within_the_budget():
+    passages = [("b.txt", 0, 16, 9.0), ("a.txt", 0, 13, 8.0), ("a.txt", 40, 48, 7.0)]
+    excerpts, used = pack_passages(passages, budget=6, slice_text=slice_text)
+    assert [(e["file_name"], e["text"]) for e in excerpts] == [("b.txt", "alpha beta gamma"), ("a.txt", "one two three")]
+    assert used == 6  # "nine ten" would have taken it to 8
+
+
+def test_a_passage_over_budget_is_skipped_for_smaller_ones():
+    passages = [("a.txt", 0, 49, 9.0), ("b.txt", 0, 10, 8.0)]
+    excerpts, used = pack_passages(passages, budget=4, slice_text=slice_text)
+    assert [e["text"] for e in excerpts] == ["alpha beta"]
+    assert used == 2
+
+
+def test_overlapping_passages_of_a_document_are_merged_and_counted_once():
+    passages = [("a.txt", 0, 13, 9.0), ("a.txt", 8, 23, 8.0), ("a.txt", 4, 7, 7.0)]
+    excerpts, used = pack_passages(passages, budget=100, slice_text=slice_text)
+    assert excerpts == [{"file_name": "a.txt", "score": 9.0, "start": 0, "end": 23, "text": "one two three four five"}]
+    assert used == 5
+
+
+def test_messages_name_excerpts_as_uploaded():
+    from chatbot.chatbot import display_name, owned_file_name
+
+    excerpts = [{"file_name": owned_file_name(7, "plan.pdf"), "text": "The plan."}]
+    content = build_messages("What is the plan?", excerpts, display_name)[-1]["content"]
+    assert "[1] (plan.pdf)\nThe plan." in content and "7__" not in content
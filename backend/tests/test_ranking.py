@@ -0,0 +1,73 @@
+import pytest
+
+from chatbot.chatbot import ALL_USERS
+
+# Parking is common among the shared documents and rare among user 1's, so scoring each
+# owner's documents with statistics of their own would favour user 1's passing mention
+DOCUMENTS = {
+    "parking.txt": "Parking permits are issued by the parking office. Parking is free after six.",
+    "garage.txt": "The garage has parking for bicycles and parking for cars.",
+    "canteen.txt": "The canteen opens at noon and serves a vegetarian menu.",
+    "1__notes.txt": "Meeting notes. Parking was mentioned once during the meeting about budgets.",
+    "1__budget.txt": "The budget for next year grows by four percent across every team.",
+    "1__hiring.txt": "Hiring slows down next quarter while the budget is reviewed.",
+    "1__travel.txt": "Travel requests go through the travel desk two weeks ahead.",
+    "2__parking.txt": "Parking spaces for visitors are booked through reception.",
+}
+OWNERS = {"1__notes.txt": 1, "1__budget.txt": 1, "1__hiring.txt": 1, "1__travel.txt": 1, "2__parking.txt": 2}
+
+
+@pytest.fixture
+def chatbot(make_chatbot):
+    bot = make_chatbot(DOCUMENTS)
+    bot.set_document_owners(OWNERS)
+    return bot
+
+
+def ranking(passages):
+    return [(passage["file_name"], pytest.approx(passage["score"], rel=1e-5)) for passage in passages]
+
+
+def test_user_search_ranks_like_the_whole_collection(chatbot):
+    everything = chatbot.retrieve("parking", top_k=10, user=ALL_USERS)
+    visible = [passage for passage in everything if passage["file_name"] != "2__parking.txt"]
+
+    assert ranking(chatbot.retrieve("parking", top_k=10, user=1)) == ranking(visible)
+    assert [passage["file_name"] for passage in visible][-1] == "1__notes.txt"
+
+
+def test_user_search_follows_documents_added_elsewhere(chatbot):
+    chatbot.retrieve("parking", top_k=10, user=1)
+
+    chatbot.set_document_owner("2__lots.txt", 2)
+    with open(f"{chatbot.documents_dir}/2__lots.txt", "w", encoding="utf-8") as f:
+        f.write("Parking lots, parking decks and parking garages for parking.")
+    assert chatbot.index_file("2__lots.txt")
+
+    everything = chatbot.retrieve("parking", top_k=10, user=ALL_USERS)
+    visible = [passage for passage in everything if not passage["file_name"].startswith("2__")]
+    assert ranking(chatbot.retrieve("parking", top_k=10, user=1)) == ranking(visible)
+
+
+def test_rebuilds_count_only_changed_documents_and_rank_like_a_fresh_build(chatbot):
+    from chatbot.ranking import BM25Ranker
+
+    chatbot.retrieve("parking", top_k=10, user=1)
+    counted = dict(chatbot.ranker.passage_terms.documents)
+
+    with open(f"{chatbot.documents_dir}/canteen.txt", "w", encoding="utf-8") as f:
+        f.write("The canteen has no parking, but serves lunch until two.")
+    assert chatbot.index_file("canteen.txt")
+    chatbot.remove_document("garage.txt")
+    chatbot.set_document_owner("parking.txt", 1)
+    results = chatbot.retrieve("parking lunch", top_k=10, user=1)
+
+    recounted = chatbot.ranker.passage_terms.documents
+    assert {name for name in recounted if recounted[name] is not counted[name]} == {"canteen.txt"}
+    assert "garage.txt" not in recounted
+
+    fresh = BM25Ranker(chatbot.inverted_index)
+    terms = chatbot.match_query_terms("parking lunch")
+    visible = [(name, start, end, pytest.approx(score, rel=1e-5)) for name, start, end, score in fresh.top_k(terms, k=10)
+               if OWNERS.get(name, 1) == 1]
+    assert [(p["file_name"], p["start"], p["end"], p["score"]) for p in results] == visible
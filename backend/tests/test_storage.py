@@ -0,0 +1,98 @@
+import io
+import os
+import shutil
+
+import pytest
+
+from chatbot import LocalStorage, StorageError, UNKNOWN_OWNER
+from chatbot.chatbot import ALL_USERS
+
+
+def found(bot, query, user):
+    return {passage["file_name"] for passage in bot.retrieve(query, user=user)}
+
+
+def test_synced_files_are_private_to_their_recorded_owner(make_chatbot, tmp_path):
+    storage = LocalStorage(str(tmp_path / "bucket"))
+    storage.upload("plan.txt", io.BytesIO(b"The migration plan moves the billing database in March."))
+    storage.upload("orphan.txt", io.BytesIO(b"The orphan plan has no recorded uploader."))
+    owners = {"plan.txt": 7}
+    bot = make_chatbot(documents={}, storage=storage, owner_lookup=lambda names: {
+        name: owners[name] for name in names if name in owners})
+
+    changed, removed = bot.fetch_files_from_supabase()
+    assert sorted(changed) == ["orphan.txt", "plan.txt"] and removed == []
+    assert bot.manifest.owner("orphan.txt") == UNKNOWN_OWNER
+
+    assert found(bot, "plan", 7) == {"plan.txt"}
+    assert found(bot, "plan", 8) == set()
+    assert found(bot, "plan", None) == set()
+    assert found(bot, "plan", ALL_USERS) == {"plan.txt", "orphan.txt"}
+
+    # Once the uploads table knows the owner, the next sync hands the file over
+    owners["orphan.txt"] = 8
+    bot.fetch_files_from_supabase()
+    assert found(bot, "plan", 8) == {"orphan.txt"}
+
+
+def test_sync_downloads_changes_and_drops_deleted_objects(make_chatbot, tmp_path):
+    storage = LocalStorage(str(tmp_path / "bucket"))
+    storage.upload("a.txt", io.BytesIO(b"Alpha quarterly report."))
+    bot = make_chatbot(documents={}, storage=storage, owner_lookup=lambda names: {name: 1 for name in names})
+
+    assert bot.fetch_files_from_supabase() == (["a.txt"], [])
+    assert bot.fetch_files_from_supabase() == ([], [])  # nothing changed, nothing downloaded
+
+    storage.upload("a.txt", io.BytesIO(b"Alpha yearly report."))
+    assert bot.fetch_files_from_supabase() == (["a.txt"], [])
+    assert found(bot, "yearly", 1) == {"a.txt"}
+
+    storage.remove(["a.txt"])
+    assert bot.fetch_files_from_supabase() == ([], ["a.txt"])
+    assert found(bot, "alpha", ALL_USERS) == set()
+
+
+def test_documents_restored_from_the_cache_are_never_indexed_half_written(make_chatbot, tmp_path, monkeypatch):
+    storage = LocalStorage(str(tmp_path / "bucket"))
+    storage.upload("a.txt", io.BytesIO(b"Alpha quarterly report."))
+    bot = make_chatbot(documents={}, storage=storage, owner_lookup=lambda names: {name: 1 for name in names})
+    assert bot.fetch_files_from_supabase() == (["a.txt"], [])
+
+    # A copy out of the cache that has not been put in place yet is not a document
+    os.remove(os.path.join(bot.documents_dir, "a.txt"))
+    copies = []
+    copyfile = shutil.copyfile
+
+    def copy_and_index(source, destination):
+        copyfile(source, destination)
+        copies.append(os.path.basename(destination))
+        bot.index_documents()
+
+    monkeypatch.setattr(shutil, "copyfile", copy_and_index)
+    assert bot.fetch_files_from_supabase() == (["a.txt"], [])
+    assert sorted(bot.manifest.names()) == ["a.txt"]
+    assert len(copies) == 1
+    assert os.listdir(bot.documents_dir) == ["a.txt"]
+
+
+def test_local_storage_never_lists_an_upload_in_progress(tmp_path):
+    storage = LocalStorage(str(tmp_path / "bucket"))
+    storage.upload("a.txt", io.BytesIO(b"Alpha"))
+    listed = []
+
+    class SlowFile(io.BytesIO):
+        def read(self, size=-1):
+            listed.append(sorted(storage.list_objects()))
+            return super().read(size)
+
+    storage.upload("b.txt", SlowFile(b"Bravo"))
+    assert listed and all(names == ["a.txt"] for names in listed)
+    assert sorted(storage.list_objects()) == ["a.txt", "b.txt"]
+
+    class BrokenFile(io.BytesIO):
+        def read(self, size=-1):
+            raise OSError("connection reset")
+
+    with pytest.raises(StorageError):
+        storage.upload("c.txt", BrokenFile())
+    assert sorted(os.listdir(tmp_path / "bucket")) == ["a.txt", "b.txt"]
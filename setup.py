@@ -16,13 +16,18 @@ setup(
     packages=find_packages(where="src"),  # Specify that packages are inside `src/`
     package_dir={"": "src"},  # Root package directory
     install_requires=[
+        "asgiref>=3.7",  # Serves the Flask app under an ASGI server
         "groq>=0.11.0",  # GPT API
+        "httpx>=0.25",  # Pooled HTTP client for Supabase storage
         "Flask>=3.0.3",   # Web framework for Flask app
         "fuzzywuzzy>=0.18.0",  # Fuzzy text searching
         "nltk>=3.9.1",  # Natural Language Toolkit for text processing
+        "numpy>=1.24",  # Vectorized ranking
         "PyPDF2>=3.0.1",  # PDF parsing
         "python-docx>=1.1.2",  # Word document parsing
         "RapidFuzz>=3.10.0",  # Optimized fuzzy matching (consider replacing fuzzywuzzy)
+        "scipy>=1.10",  # Sparse term-document matrix for BM25
+        "uvicorn>=0.30",  # ASGI server for the async chat endpoints
     ],
     classifiers=[
         "Programming Language :: Python :: 3",